@@ -0,0 +1,189 @@
+# Write Jupyter server and lab extension configuration without running `jupyter server extension ...` and `jupyter labextension ...`.
+#
+# The files written are the same as the ones the Jupyter CLI writes:
+# - lab extensions: `CONFIG_DIR/labconfig/page_config.json` (`disabledExtensions`, `lockedExtensions`)
+# - server extensions: `CONFIG_DIR/jupyter_server_config.json` (`ServerApp.jpserver_extensions`)
+# where CONFIG_DIR is `~/.jupyter` for user level and `SYS_PREFIX/etc/jupyter` for sys-prefix level.
+
+import fcntl
+import json
+import os
+import sys
+import tempfile
+from typing import Callable, Optional
+
+sys_prefix_config_dir = os.path.join(sys.prefix, 'etc', 'jupyter')
+
+
+class ExtensionLockedError(Exception):
+    def __init__(self, extension: str) -> None:
+        super().__init__(f'Extension {extension} is locked.')
+        self.extension = extension
+
+
+def user_config_dir(home: str) -> str:
+    """
+    Jupyter config directory (user level) of a user with given home directory.
+    """
+
+    return os.path.join(home, '.jupyter')
+
+
+def _read_json(path: str) -> dict:
+    try:
+        with open(path, 'r') as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {}
+
+
+def _update_json(path: str, update: Callable[[dict], None], owner: Optional[tuple[int, int]] = None) -> None:
+    """
+    Read-modify-write a JSON file atomically while holding an exclusive lock on its directory.
+
+    Parameters
+    ----------
+    path : str
+        Path to the JSON file.
+    update : Callable[[dict], None]
+        Function modifying the file's content in place.
+    owner : tuple[int, int], optional
+        uid and gid for created directories and the file, ownership is not changed if None.
+
+    Returns
+    -------
+    None
+    """
+
+    directory = os.path.dirname(path)
+    missing = []
+    parent = directory
+    while not os.path.isdir(parent):
+        missing.append(parent)
+        parent = os.path.dirname(parent)
+    for missing_directory in reversed(missing):
+        os.mkdir(missing_directory, mode=0o755)
+        if owner:
+            os.chown(missing_directory, *owner)
+
+    dir_fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        fcntl.flock(dir_fd, fcntl.LOCK_EX)
+        data = _read_json(path)
+        original = json.dumps(data, sort_keys=True)
+        update(data)
+        if json.dumps(data, sort_keys=True) == original:
+            return
+
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w') as file:
+                json.dump(data, file, indent=2)
+            os.chmod(tmp_path, 0o644)
+            if owner:
+                os.chown(tmp_path, *owner)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    finally:
+        fcntl.flock(dir_fd, fcntl.LOCK_UN)
+        os.close(dir_fd)
+
+
+def locked_labextensions(config_dir: str = sys_prefix_config_dir) -> set[str]:
+    """
+    Lab extensions locked at the given level (sys-prefix by default).
+    """
+
+    locked = _read_json(os.path.join(config_dir, 'labconfig', 'page_config.json')).get('lockedExtensions', {})
+    return {extension for extension, is_locked in locked.items() if is_locked}
+
+
+def set_labextension_locks(locks: dict[str, bool], config_dir: str = sys_prefix_config_dir) -> None:
+    """
+    Lock or unlock lab extensions (like `jupyter labextension lock/unlock`).
+
+    Parameters
+    ----------
+    locks : dict[str, bool]
+        Extension names mapped to True (lock) or False (unlock).
+    config_dir : str, optional
+        Jupyter config directory, sys-prefix level by default.
+
+    Returns
+    -------
+    None
+    """
+
+    def update(page_config: dict) -> None:
+        page_config.setdefault('lockedExtensions', {}).update(locks)
+
+    _update_json(os.path.join(config_dir, 'labconfig', 'page_config.json'), update)
+
+
+def set_labextensions(config_dir: str, states: dict[str, bool], owner: Optional[tuple[int, int]] = None, force: bool = False) -> None:
+    """
+    Enable or disable lab extensions at the level of the given config directory.
+
+    Enabling writes an explicit `false` to `disabledExtensions` (like `jupyter labextension disable` followed by `enable`),
+    so the extension is enabled even if it is disabled at a lower level (e.g. sys-prefix).
+
+    Parameters
+    ----------
+    config_dir : str
+        Jupyter config directory (e.g. `user_config_dir(home)`).
+    states : dict[str, bool]
+        Extension names mapped to True (enable) or False (disable).
+    owner : tuple[int, int], optional
+        uid and gid for created directories and files.
+    force : bool, optional
+        Modify extensions locked at sys-prefix level. The CLI requires unlocking, modifying and locking again instead,
+        which leaves the extension unlocked for all users in between.
+
+    Returns
+    -------
+    None
+
+    Raises
+    ------
+    ExtensionLockedError
+        If an extension is locked and `force` is False.
+    """
+
+    if not force:
+        locked = locked_labextensions()
+        for extension in states:
+            if extension in locked:
+                raise ExtensionLockedError(extension)
+
+    def update(page_config: dict) -> None:
+        disabled = page_config.setdefault('disabledExtensions', {})
+        for extension, enabled in states.items():
+            disabled[extension] = not enabled
+
+    _update_json(os.path.join(config_dir, 'labconfig', 'page_config.json'), update, owner=owner)
+
+
+def set_server_extensions(config_dir: str, states: dict[str, bool], owner: Optional[tuple[int, int]] = None) -> None:
+    """
+    Enable or disable server extensions at the level of the given config directory (like `jupyter server extension enable/disable`).
+
+    Parameters
+    ----------
+    config_dir : str
+        Jupyter config directory (e.g. `user_config_dir(home)`).
+    states : dict[str, bool]
+        Extension module names mapped to True (enable) or False (disable).
+    owner : tuple[int, int], optional
+        uid and gid for created directories and files.
+
+    Returns
+    -------
+    None
+    """
+
+    def update(server_config: dict) -> None:
+        server_config.setdefault('ServerApp', {}).setdefault('jpserver_extensions', {}).update(states)
+
+    _update_json(os.path.join(config_dir, 'jupyter_server_config.json'), update, owner=owner)
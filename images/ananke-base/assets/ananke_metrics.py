@@ -0,0 +1,69 @@
+# Prometheus metrics of Ananke's login path, exported on the hub's `/hub/metrics` endpoint
+# (metrics are registered in prometheus_client's default registry, which JupyterHub exports).
+
+import time
+
+from prometheus_client import Counter, Histogram
+
+login_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+POST_AUTH_CALLBACK_DURATION = Histogram(
+    'ananke_post_auth_callback_duration_seconds',
+    'Duration of post-authentication callbacks',
+    ['callback', 'role', 'outcome'],
+    buckets=login_buckets
+)
+
+POST_AUTH_STEP_DURATION = Histogram(
+    'ananke_post_auth_step_duration_seconds',
+    'Duration of named steps within post-authentication callbacks',
+    ['step', 'role', 'outcome'],
+    buckets=login_buckets
+)
+
+HUB_RESTARTS = Counter(
+    'ananke_hub_restarts_total',
+    'Hub restarts triggered by post-authentication callbacks',
+    ['callback']
+)
+
+
+def role_of(auth_state: dict) -> str:
+    """
+    Metrics label for the user's LTI role (`instructor` or `student`).
+    """
+
+    roles = auth_state.get('https://purl.imsglobal.org/spec/lti/claim/roles', []) if auth_state else []
+    return 'instructor' if 'http://purl.imsglobal.org/vocab/lis/v2/membership#Instructor' in roles else 'student'
+
+
+class Timer:
+    """
+    Context manager observing the duration of its block in a histogram.
+
+    The outcome label is `error` if the block raises, else the value of the `outcome` attribute (`ok` by default),
+    which may be changed within the block.
+    """
+
+    def __init__(self, histogram: Histogram, **labels: str) -> None:
+        self.histogram = histogram
+        self.labels = labels
+        self.outcome = 'ok'
+        self.start = 0.0
+
+    def __enter__(self) -> 'Timer':
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> bool:
+        outcome = 'error' if exc_type else self.outcome
+        self.histogram.labels(outcome=outcome, **self.labels).observe(time.perf_counter() - self.start)
+        return False
+
+
+def time_callback(callback: str, role: str) -> Timer:
+    return Timer(POST_AUTH_CALLBACK_DURATION, callback=callback, role=role)
+
+
+def time_step(step: str, role: str) -> Timer:
+    return Timer(POST_AUTH_STEP_DURATION, step=step, role=role)
@@ -0,0 +1,96 @@
+# User data base (names, email and LMS user id of hub users) with incremental updates.
+#
+# Each user is one row of an SQLite table (WAL mode), keyed by username. Updates touch only the user's row,
+# reads always see the latest committed state (also across hub restarts and processes).
+
+import json
+import logging
+import os
+import sqlite3
+from typing import Optional
+
+fields = ['first', 'last', 'email', 'lms_uid']
+
+
+class UserDatabase:
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._db = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS users ('
+                         'username TEXT PRIMARY KEY, first TEXT, last TEXT, email TEXT, lms_uid TEXT)')
+        os.chmod(self.path, 0o600)
+
+    def __len__(self) -> int:
+        return self._db.execute('SELECT COUNT(*) FROM users').fetchone()[0]
+
+    def get(self, username: str) -> Optional[dict]:
+        """
+        Data of a user (keys `first`, `last`, `email`, `lms_uid`, values None if unknown) or None for unknown users.
+        """
+
+        row = self._db.execute('SELECT first, last, email, lms_uid FROM users WHERE username = ?', (username,)).fetchone()
+        return dict(row) if row else None
+
+    def update(self, username: str, first: Optional[str], last: Optional[str], email: Optional[str], lms_uid: Optional[str]) -> bool:
+        """
+        Create the user or update name and email if given and different from stored data.
+
+        Returns
+        -------
+        bool
+            True if the data base has been changed, False otherwise.
+        """
+
+        data = self.get(username)
+        if data is None:
+            self._db.execute('INSERT OR IGNORE INTO users (username, first, last, email, lms_uid) VALUES (?, ?, ?, ?, ?)',
+                             (username, first, last, email, lms_uid))
+            return True
+
+        changes = {key: value for key, value in [('first', first), ('last', last), ('email', email)] if value and data[key] != value}
+        if not changes:
+            return False
+
+        changes['lms_uid'] = lms_uid
+        self._db.execute(f'UPDATE users SET {", ".join(f"{key} = ?" for key in changes)} WHERE username = ?',
+                         tuple(changes.values()) + (username,))
+        return True
+
+    def migrate(self, json_path: str) -> None:
+        """
+        Import users from the JSON file used by older versions (renamed to `*.migrated` afterwards).
+
+        Parameters
+        ----------
+        json_path : str
+            Path to the JSON file (dict mapping usernames to dicts with keys `first`, `last`, `email`, `lms_uid`).
+
+        Returns
+        -------
+        None
+        """
+
+        if not os.path.isfile(json_path):
+            return
+
+        try:
+            with open(json_path) as f:
+                user_data = json.load(f)
+        except (PermissionError, OSError, json.JSONDecodeError):
+            logging.error(f'Cannot read user data base {json_path} for migration.')
+            return
+
+        logging.info(f'Migrating {len(user_data)} users from {json_path}.')
+        self._db.execute('BEGIN IMMEDIATE')
+        try:
+            self._db.executemany('INSERT OR IGNORE INTO users (username, first, last, email, lms_uid) VALUES (?, ?, ?, ?, ?)',
+                                 [(username,) + tuple(data.get(key) for key in fields) for username, data in user_data.items()])
+            self._db.execute('COMMIT')
+        except sqlite3.Error:
+            self._db.execute('ROLLBACK')
+            raise
+
+        os.rename(json_path, f'{json_path}.migrated')
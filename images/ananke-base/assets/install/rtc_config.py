@@ -3,6 +3,18 @@
 import os
 import pwd
 
+from ananke_extension_config import set_labextensions, user_config_dir
+
+# lab extensions of room accounts (written to user level config, regardless of global locks)
+rtc_labextensions = {
+    '@jupyter/collaboration-extension': True,
+    '@jupyter/docprovider-extension': True,
+    'jupyter-server-nbmodel': True,
+    '@jupyter/nbgrader:assignment-list': False,
+    '@jupyter/nbgrader:validate-assignment': False,
+    '@jupyter/nbgrader:menu': False
+}
+
 # create public rooms
 for idx, room in enumerate(public_rtc_rooms):
 
@@ -14,25 +26,9 @@ for idx, room in enumerate(public_rtc_rooms):
         os.system(f'useradd --create-home --shell=/bin/bash {username}')
         os.system(f'usermod -L {username}')
         os.system(f'chown -R {username}:{username} /home/{username}')
-        os.system('jupyter labextension unlock @jupyter/nbgrader:assignment-list')
-        os.system('jupyter labextension unlock @jupyter/nbgrader:validate-assignment')
-        os.system('jupyter labextension unlock @jupyter/nbgrader:nbgrader:menu')
-        os.system(f'su - {username} -c \
-                    "export JUPYTER_PREFER_ENV_PATH=0; \
-                    source /opt/conda/etc/profile.d/conda.sh; \
-                    conda activate jhub; \
-                    jupyter labextension disable --level=user @jupyter/collaboration-extension; \
-                    jupyter labextension enable --level=user @jupyter/collaboration-extension; \
-                    jupyter labextension disable --level=user @jupyter/docprovider-extension; \
-                    jupyter labextension enable --level=user @jupyter/docprovider-extension; \
-                    jupyter labextension disable --level=user jupyter-server-nbmodel; \
-                    jupyter labextension enable --level=user jupyter-server-nbmodel; \
-                    jupyter labextension disable --level=user @jupyter/nbgrader:assignment-list; \
-                    jupyter labextension disable --level=user @jupyter/nbgrader:validate-assignment; \
-                    jupyter labextension disable --level=user @jupyter/nbgrader:menu"')
-        os.system('jupyter labextension lock @jupyter/nbgrader:assignment-list')
-        os.system('jupyter labextension lock @jupyter/nbgrader:validate-assignment')
-        os.system('jupyter labextension lock @jupyter/nbgrader:nbgrader:menu')
+        user_info = pwd.getpwnam(username)
+        set_labextensions(config_dir=user_config_dir(f'/home/{username}'), states=rtc_labextensions,
+                          owner=(user_info.pw_uid, user_info.pw_gid), force=True)
 
     # create JHub service for room
     port = 8500 + idx
@@ -63,25 +59,9 @@ for idx, room in enumerate(private_rtc_rooms):
         os.system(f'useradd --create-home --shell=/bin/bash {username}')
         os.system(f'usermod -L {username}')
         os.system(f'chown -R {username}:{username} /home/{username}')
-        os.system('jupyter labextension unlock @jupyter/nbgrader:assignment-list')
-        os.system('jupyter labextension unlock @jupyter/nbgrader:validate-assignment')
-        os.system('jupyter labextension unlock @jupyter/nbgrader:nbgrader:menu')
-        os.system(f'su - {username} -c \
-                    "export JUPYTER_PREFER_ENV_PATH=0; \
-                    source /opt/conda/etc/profile.d/conda.sh; \
-                    conda activate jhub; \
-                    jupyter labextension disable --level=user @jupyter/collaboration-extension; \
-                    jupyter labextension enable --level=user @jupyter/collaboration-extension; \
-                    jupyter labextension disable --level=user @jupyter/docprovider-extension; \
-                    jupyter labextension enable --level=user @jupyter/docprovider-extension; \
-                    jupyter labextension disable --level=user jupyter-server-nbmodel; \
-                    jupyter labextension enable --level=user jupyter-server-nbmodel; \
-                    jupyter labextension disable --level=user @jupyter/nbgrader:assignment-list; \
-                    jupyter labextension disable --level=user @jupyter/nbgrader:validate-assignment; \
-                    jupyter labextension disable --level=user @jupyter/nbgrader:menu"')
-        os.system('jupyter labextension lock @jupyter/nbgrader:assignment-list')
-        os.system('jupyter labextension lock @jupyter/nbgrader:validate-assignment')
-        os.system('jupyter labextension lock @jupyter/nbgrader:nbgrader:menu')
+        user_info = pwd.getpwnam(username)
+        set_labextensions(config_dir=user_config_dir(f'/home/{username}'), states=rtc_labextensions,
+                          owner=(user_info.pw_uid, user_info.pw_gid), force=True)
 
     # create JHub service for room
     port = 8600 + idx
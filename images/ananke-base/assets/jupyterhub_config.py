@@ -1,11 +1,11 @@
 # Configuration file for jupyterhub.
 
-import fcntl
-import json
 import logging
 import subprocess
 from glob import glob
 
+from ananke_metrics import HUB_RESTARTS, role_of, time_callback
+from ananke_user_data import UserDatabase
 from ltiauthenticator.lti13.auth import LTI13Authenticator
 from ltiauthenticator.lti13.handlers import LTI13CallbackHandler
 
@@ -47,6 +47,7 @@ async def post_auth_callback(authenticator: LTI13Authenticator, handler: LTI13Ca
     """
     Optional hook to run necessary bootstrapping tasks.
     If any of these tasks returns `True` the JupyterHub will be restarted.
+    Durations of the tasks and triggered restarts are exported as metrics (see ananke_metrics.py).
 
     Parameters
     ----------
@@ -71,9 +72,13 @@ async def post_auth_callback(authenticator: LTI13Authenticator, handler: LTI13Ca
     
     needs_restart  = False
     authentication['name'] = 'u' + authentication['name']    # usernames have to start with a-z on Debian
+    role = role_of(authentication.get('auth_state'))
     for callback in c.post_auth_hook_callbacks:
-        if await callback(authenticator, handler, authentication):
-            needs_restart = True
+        with time_callback(callback=callback.__name__, role=role) as timer:
+            if await callback(authenticator, handler, authentication):
+                needs_restart = True
+                timer.outcome = 'restart'
+                HUB_RESTARTS.labels(callback=callback.__name__).inc()
 
     logging.debug('Finished post authentication hooks. Needs restart: ' + str(needs_restart))
 
@@ -124,10 +129,10 @@ c.post_auth_hook_callbacks.append(log_lti_data)
 # user data base
 #-------------------------------------------------------------------------------
 
-c.user_data_path = '/opt/user_data.json'
-logging.info('Reading user data base ' + c.user_data_path)
-with open(c.user_data_path) as f:
-    user_data = json.load(f)
+c.user_data_path = '/opt/user_data.sqlite'
+logging.info('Opening user data base ' + c.user_data_path)
+user_data = UserDatabase(c.user_data_path)
+user_data.migrate('/opt/user_data.json')  # data base of older versions
 logging.debug(str(len(user_data)) + ' users in data base')
 
 async def update_user_data(authenticator: LTI13Authenticator, handler: LTI13CallbackHandler, authentication: dict) -> False:
@@ -158,30 +163,14 @@ async def update_user_data(authenticator: LTI13Authenticator, handler: LTI13Call
     username = authentication.get('name')
     logging.debug(f'Looking up user {username} in data base.')
     
-    data = user_data.get(username, {})
     first = authentication.get('auth_state').get('given_name')
     last = authentication.get('auth_state').get('family_name')
     email = authentication.get('auth_state').get('email')
     sub = authentication.get('auth_state').get('sub')
-    update = False
-    if first and data.get('first') != first:
-        data['first'] = first
-        update = True
-    if last and data.get('last') != last:
-        data['last'] = last
-        update = True
-    if email and data.get('email') != email:
-        data['email'] = email
-        update = True
-
-    if update or len(data) == 0: # len==0 is equivalent to new user without name/email info in LTI data
-        logging.debug(f'User {username} is new or came in with new name/email. Updating user data base')
-        data['lms_uid'] = sub
-        user_data[username] = data
-        with open(c.user_data_path, 'w') as f:
-            fcntl.flock(f, fcntl.LOCK_EX)
-            json.dump(user_data, f)
-            fcntl.flock(f, fcntl.LOCK_UN)
+
+    # only the user's row is written, and only if the user is new or came in with new name/email
+    if user_data.update(username, first=first, last=last, email=email, lms_uid=sub):
+        logging.debug(f'User {username} is new or came in with new name/email. Updated user data base')
 
     return False
 
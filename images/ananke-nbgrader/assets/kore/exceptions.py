@@ -64,3 +64,21 @@ class UniqueNamesError(KoreError):
         self.message = 'An error occurred while generating unique names.'
         logging.error(self.message)
         super().__init__(self.message)
+
+
+class CopyError(KoreError):
+    """ Error related to copying files and directories. """
+
+    def __init__(self):
+        self.message = 'An error occurred while copying files.'
+        logging.error(self.message)
+        super().__init__(self.message)
+
+
+class BackupError(KoreError):
+    """ Error related to the backup store. """
+
+    def __init__(self):
+        self.message = 'An error occurred while interacting with the backup store.'
+        logging.error(self.message)
+        super().__init__(self.message)
@@ -1,16 +1,19 @@
 import logging
 import os
-import secrets
-from tempfile import mkdtemp
 
 from flask import Flask
 from flask_session import Session
+from jupyterhub.services.auth import HubOAuth
 
+from misc.hub_client import HubClient
+from misc.jobs import JobQueue
 from models.config_loaders import FlaskConfigLoader
+from models.registry import CourseRegistry
 from routes.assignments_route import assignments_bp
 from routes.courses_route import courses_bp
 from routes.grades_route import grades_bp
 from routes.home_route import home, home_bp, authenticated
+from routes.jobs_route import jobs_bp
 from routes.problems_route import problems_bp
 from routes.utils_routes import utils_bp
 
@@ -21,31 +24,45 @@ logging.basicConfig(
 )
 
 app = Flask(__name__)
+
+# Initialize the ConfigLoader class and load both (general and LTI) configuration files.
+config_loader = FlaskConfigLoader(
+    kore_config_file_path='/opt/kore/config/config.json',
+    lti_config_file_path='/opt/conda/envs/jhub/etc/jupyterhub/jupyterhub_config.d/30_lms.py',
+    app=app
+)
+config_loader.load_config()
+
+registry = CourseRegistry(path=config_loader.registry_path,
+                          autogenerated_file_path=config_loader.autogenerated_file_path,
+                          nbgrader_config_path=config_loader.nbgrader_config_path)
+
+# Sessions and signing key are shared by all worker processes (and survive restarts).
+os.makedirs(config_loader.session_dir, mode=0o700, exist_ok=True)
 app.config.update(
-    SECRET_KEY=secrets.token_bytes(32),
+    SECRET_KEY=bytes.fromhex(registry.get_secret('kore_session_key')),
     SESSION_COOKIE_NAME='kore-sessionid',
     SESSION_COOKIE_HTTPONLY=True,
     SESSION_COOKIE_SECURE=True,  # should be True in case of HTTPS usage (production)
     SESSION_COOKIE_SAMESITE=None,  # should be 'None' in case of HTTPS usage (production)
     SESSION_TYPE='filesystem',
-    SESSION_FILE_DIR=mkdtemp(),
+    SESSION_FILE_DIR=config_loader.session_dir,
     DEBUG_TB_INTERCEPT_REDIRECTS=False
 )
 Session(app)  # store session data on server (not on client)
 
-# Initialize the ConfigLoader class and load both (general and LTI) configuration files.
-config_loader = FlaskConfigLoader(
-    kore_config_file_path='/opt/kore/config/config.json',
-    lti_config_file_path='/opt/conda/envs/jhub/etc/jupyterhub/jupyterhub_config.d/30_lms.py',
-    app=app
-)
-config_loader.load_config()
-
 # Store global parameters and the ConfigLoader in the app context.
 prefix = os.environ.get('JUPYTERHUB_SERVICE_PREFIX', '/')
 logging.info(f'JupyterHub service prefix for Kore: {prefix}')
 config_loader.store_parameter(key='PREFIX', value=prefix)
 config_loader.store_parameter(key='KORE_TOKEN', value=os.environ['JUPYTERHUB_API_TOKEN'])
+config_loader.store_parameter(key='HUB_CLIENT', value=HubClient(api_url=os.environ.get('JUPYTERHUB_API_URL', 'http://127.0.0.1:8081/hub/api'),
+                                                                api_token=os.environ['JUPYTERHUB_API_TOKEN']))
+config_loader.store_parameter(key='HUB_AUTH', value=HubOAuth(api_token=os.environ['JUPYTERHUB_API_TOKEN'], cache_max_age=60))
+config_loader.store_parameter(key='REGISTRY', value=registry)
+registry.recover_jobs()
+config_loader.store_parameter(key='JOB_QUEUE', value=JobQueue(registry=registry, max_workers=config_loader.kore_job_workers,
+                                                                wait=config_loader.kore_job_wait))
 config_loader.store_in_app_context()
 
 # Register blueprints with the app.
@@ -56,6 +73,7 @@ app.register_blueprint(courses_bp, url_prefix=prefix)
 app.register_blueprint(assignments_bp, url_prefix=prefix)
 app.register_blueprint(problems_bp, url_prefix=prefix)
 app.register_blueprint(utils_bp, url_prefix=prefix)
+app.register_blueprint(jobs_bp, url_prefix=prefix)
 
 
 if __name__ == '__main__':
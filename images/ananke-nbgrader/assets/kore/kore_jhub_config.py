@@ -1,24 +1,35 @@
 # Configuration for nbgrader and Kore.
 
 import asyncio
-import fcntl
 import json
 import logging
 import os
-import pwd
 import secrets
-import subprocess
+import shutil
+import sqlite3
 import sys
-from subprocess import run, CalledProcessError
+from subprocess import CalledProcessError
+from typing import Optional
 
+from ananke_extension_config import set_labextensions, set_server_extensions, user_config_dir
+from ananke_metrics import role_of, time_step
 from ltiauthenticator.lti13.auth import LTI13Authenticator
 from ltiauthenticator.lti13.handlers import LTI13CallbackHandler
-from nbgrader.api import Gradebook
+from sqlalchemy.exc import SQLAlchemyError
 
 sys.path.append('/opt/kore')  # noqa
-from exceptions import AutogeneratedFileError
-from misc.utils import read_autogenerated_config, write_autogenerated_config, make_course_id, get_hub_base_url
+from misc.accounts import reconcile_accounts
+from misc.enrollment import EnrollmentQueue
+from misc.grader_pool import GraderPool
+from misc.hub_client import AsyncHubClient
+from misc.hub_runtime import register_groups, register_roles, runtime_service_names, skip_on_demand_service_checks, \
+    start_formgraders
+from misc.provisioning import Provisioner
+from misc.shared_formgrader import make_shared_formgrader_roles, make_shared_formgrader_service, prepare_shared_formgrader, share_course, \
+    write_shared_courses
+from misc.utils import make_course_id
 from models.config_loaders import KoreConfigLoader
+from models.registry import CourseRegistry
 
 logging.basicConfig(
     level=logging.INFO,
@@ -41,37 +52,40 @@ remove_hidden = True
 # Remove tracebacks of hidden tests from feedback? (default value for new courses)
 remove_hidden_trace = False
 
+# Runs provisioning steps of the post-authentication hook off the hub's event loop.
+provisioner = Provisioner(concurrency=config_loader.provisioning_concurrency, step_timeout=config_loader.provisioning_step_timeout)
+
+# Write-behind enrollment of students into gradebooks.
+enrollment_queue = EnrollmentQueue(provisioner=provisioner)
+
+# Prepared grader accounts for new courses (filled up in background at start and after each new course).
+grader_pool = GraderPool(provisioner=provisioner, size=config_loader.grader_pool_size)
+
 # API tokens
 kore_token = secrets.token_hex(32)
 
-# Ensure existence of grader user accounts for all grader home directories, which is necessary after replacing the container with a new one.
-home_directory_root = '/home'
-for directory in os.listdir(home_directory_root):
-    directory_path = os.path.join(home_directory_root, directory)
+# Hub's base url (formgraders are started outside the hub and need to know it)
+hub_base_url = c.JupyterHub.base_url if 'base_url' in c.JupyterHub else '/'
+hub_base_url = '/' + hub_base_url.strip('/') + '/' if hub_base_url.strip('/') else '/'
 
-    if os.path.isdir(directory_path):
-        try:
-            pwd.getpwnam(directory)
-        except KeyError:
-            try:
-                run(['useradd', '--shell=/bin/bash', directory], check=True)
-                run(['usermod', '-L', directory], check=True)
-                run(['chown', '-R', f'{directory}:{directory}', directory_path], check=True)
-            except CalledProcessError:
-                logging.error('Command cannot be executed!')
+# Client for the hub's REST API (group memberships, service registration).
+hub_client = AsyncHubClient(api_url=f'http://127.0.0.1:8081{hub_base_url}hub/api', api_token=kore_token)
 
+# Open course registry (courses, course groups and instructors), import data from files used by older versions and write
+# course titles to the (possibly new) container's nbgrader config.
+registry = CourseRegistry(path=config_loader.registry_path, autogenerated_file_path=autogenerated_file_path, nbgrader_config_path=nbgrader_config_path)
+registry.migrate(instructors_database_path=instructors_database_path)
+registry.export()
 
-# Read instructors list (nbgrader extensions are already enabled if in list)
-logging.info('Reading instructors data base.')
+# Ensure existence of grader user accounts for all grader home directories, which is necessary after replacing the container with a new one.
+reconcile_accounts(registry=registry, concurrency=config_loader.provisioning_concurrency)
 
-instructors = []
+# Fill the grader account pool at start (the config is loaded while the hub's event loop runs), later after each new course.
 try:
-    with open(file=instructors_database_path, mode='r') as instructors_database:
-        instructors = json.load(instructors_database)
-except (FileNotFoundError, PermissionError, OSError, json.JSONDecodeError):
-    logging.error('Error while accessing/parsing the instructor data base.')
-
-logging.debug('found {} instructors'.format(len(instructors)))
+    asyncio.get_running_loop()
+    grader_pool.fill()
+except RuntimeError:
+    logging.debug('No running event loop, grader account pool is filled when the first course is created.')
 
 
 # Post-authentication callback for nbgrader configuration.
@@ -95,11 +109,12 @@ async def nbgrader_post_auth(authenticator: LTI13Authenticator, handler: LTI13Ca
 
     (4) If the user is an instructor and the course is not present as a service on the `JupyterHub`, then
     (4.1) the course gets added as a service,
-    (4.2) the user (instructor) is added to the formgrade group of the service.
+    (4.2) the user (instructor) is added to the formgrade group of the service,
+    (4.3) the formgrader is started and service, groups and roles are registered on the running `JupyterHub`.
 
     (5) If the user is a student and the grader exists, then the user (student) gets added to the course.
 
-    (6) Finally a bool is returned which indicates if the `JupyterHub` has to be restarted.
+    (6) Finally a bool is returned which indicates if the `JupyterHub` has to be restarted (only if registering on the running hub failed).
 
     Parameters
     ----------
@@ -137,57 +152,6 @@ async def nbgrader_post_auth(authenticator: LTI13Authenticator, handler: LTI13Ca
         else:
             return None, None
 
-    def set_dir_owner(path: str, uid: int, gid: int) -> None:
-        """
-        Set directory's owner recursively if uid and gid both are not None.
-
-        Parameters
-        ----------
-        path : str
-            Path to the directory.
-        uid : int
-            The user identifier (uid) of the directory.
-        gid : int
-            The group identifier (gid) of the directory.
-
-        Returns
-        -------
-        None
-        """
-
-        if uid and gid:
-            run(['chown', '-R', f'{uid}:{gid}', path], check=True)
-
-    async def run_as_user(username: str, cmd: str, args: list[str]) -> None:
-        """
-        Run command as dynamic user in usernames home directory.
-        cmd is a string. args is a list of strings.
-
-        Parameters
-        ----------
-        username : str
-            The user as which to execute a command.
-        cmd : str
-            The command to be executed.
-        args : list[str]
-            Additional arguments for the supplied command.
-
-        Returns
-        -------
-        None
-        """
-
-        systemd_run = ['systemd-run',
-                       '--wait',
-                       f'--unit=post-auth-hook-{username}',
-                       f'--working-directory=/var/lib/{username}',
-                       '--property=DynamicUser=yes',
-                       f'--property=StateDirectory={username}',
-                       f'--property=Environment=HOME=/var/lib/{username}',
-                       cmd] + args
-        proc = await asyncio.create_subprocess_exec(*systemd_run)
-        await proc.wait()
-
     logging.debug('Running nbgrader post authentication hook.')
     needs_restart = False
 
@@ -195,46 +159,50 @@ async def nbgrader_post_auth(authenticator: LTI13Authenticator, handler: LTI13Ca
     auth_state = authentication.get('auth_state')
 
     is_instructor = True if 'http://purl.imsglobal.org/vocab/lis/v2/membership#Instructor' in auth_state.get('https://purl.imsglobal.org/spec/lti/claim/roles', []) else False
+    role = role_of(auth_state)
     user_home = f'/var/lib/private/{username}'
 
-    # If the user is an instructor and the first login on the server, then the extensions are activated and the user is added to the database.
-    if is_instructor and username not in instructors:
+    # If the user is an instructor and the first login on the server, then the extensions are activated and the user is added to the registry.
+    if is_instructor and not registry.is_instructor(username):
 
         # Activate nbgrader and kore extensions for instructor user.
         logging.debug(f'Activating nbgrader extensions for user: {username}.')
         uid, gid = get_dir_owner(path=user_home)
-        await run_as_user(username, 'jupyter', ['server', 'extension', 'enable', '--user', 'nbgrader.server_extensions.course_list'])
-        os.system('jupyter labextension unlock @jupyter/nbgrader:course-list')
-        await run_as_user(username, 'jupyter', ['labextension', 'disable', '--level=user', '@jupyter/nbgrader:course-list'])
-        await run_as_user(username, 'jupyter', ['labextension', 'enable', '--level=user', '@jupyter/nbgrader:course-list'])
-        os.system('jupyter labextension lock @jupyter/nbgrader:course-list')
-        os.system('jupyter labextension unlock kore-extension')
-        await run_as_user(username, 'jupyter', ['labextension', 'disable', '--level=user', 'kore-extension'])
-        await run_as_user(username, 'jupyter', ['labextension', 'enable', '--level=user', 'kore-extension'])
-        os.system('jupyter labextension lock kore-extension')
-        set_dir_owner(path=user_home, uid=uid, gid=gid)
-
-        # Add the user to the instructor list and write altered database to file.
-        instructors.append(username)
-
-        with open(file=instructors_database_path, mode='w') as instructors_database:
-            fcntl.flock(instructors_database, fcntl.LOCK_EX)
-            json.dump(instructors, instructors_database)
-            fcntl.flock(instructors_database, fcntl.LOCK_UN)
 
-            try:
-                run(['chmod', '600', instructors_database_path], check=True)
-            except CalledProcessError:
-                logging.error('Command cannot be executed!')
+        # Home directory (state directory of the user's dynamic user) may not exist yet. Then systemd adjusts ownership when the user's server starts.
+        def enable_instructor_extensions() -> None:
+            os.makedirs('/var/lib/private', mode=0o700, exist_ok=True)
+            owner = (uid, gid) if uid is not None else None
+            set_server_extensions(config_dir=user_config_dir(user_home), states={'nbgrader.server_extensions.course_list': True}, owner=owner)
+            set_labextensions(config_dir=user_config_dir(user_home), states={'@jupyter/nbgrader:course-list': True, 'kore-extension': True},
+                              owner=owner, force=True)
+
+        try:
+            with time_step(step='instructor_extensions', role=role):
+                await provisioner.run_blocking(enable_instructor_extensions)
+        except (PermissionError, OSError, ValueError, TimeoutError):
+            logging.error('Error while writing extension config of instructor.')
+
+        # Add the user to the instructors in the registry.
+        try:
+            with time_step(step='add_instructor', role=role):
+                await provisioner.run_blocking(registry.add_instructor, username)
+        except (sqlite3.Error, TimeoutError):
+            logging.error('Error while adding instructor to course registry.')
 
     # Write the instructor's LTI data to file. These are read by Kore.
     if is_instructor:
         lti_file_path = f'/opt/kore/runtime/lti_{username}.json'
-        try:
+
+        def write_lti_file() -> None:
             with open(lti_file_path, mode='w') as lti_file:
                 json.dump(auth_state, lti_file, ensure_ascii=False, indent=4)
-            run(['chmod', '600', lti_file_path], check=True)
-        except (FileNotFoundError, PermissionError, OSError):
+            os.chmod(lti_file_path, 0o600)
+
+        try:
+            with time_step(step='write_lti_file', role=role):
+                await provisioner.run_blocking(write_lti_file)
+        except (FileNotFoundError, PermissionError, OSError, TimeoutError):
             logging.error('LTI file cannot be opened/altered.')
 
     # Generate course title and id.
@@ -246,79 +214,64 @@ async def nbgrader_post_auth(authenticator: LTI13Authenticator, handler: LTI13Ca
     # Check existence of grader user.
     grader_exists = os.path.isdir(f'/home/{grader_user}')
 
-    # Create grader user if necessary.
-    if is_instructor and not grader_exists:
-        logging.info(f'Creating grader user: {grader_user}.')
-
-        # Add non-existing user to system.
-        try:
-            run(['useradd', '--create-home', '--shell=/bin/bash', grader_user], check=True)
-            run(['usermod', '-L', grader_user], check=True)
-        except CalledProcessError:
-            logging.error('Command cannot be executed!')
+    async def provision_course() -> Optional[bool]:
+        """
+        Create grader user, course directory and formgrader service of the course and register it on the running hub.
+        Runs at most once at a time per course, see Provisioner.single_flight().
 
-        # Activate nbgrader extensions for current user.
-        try:
-            run(['runuser', '-u', grader_user, '--', 'jupyter', 'server', 'extension', 'enable', '--user', 'nbgrader.server_extensions.formgrader'], check=True)
-            run(['runuser', '-u', grader_user, '--', 'jupyter', 'server', 'extension', 'disable', '--user', 'nbgrader.server_extensions.assignment_list'], check=True)
-            run(['runuser', '-u', grader_user, '--', 'jupyter', 'server', 'extension', 'disable', '--user', 'nbgrader.server_extensions.validate_assignment'], check=True)
-
-            os.system('jupyter labextension unlock @jupyter/nbgrader:formgrader')
-            os.system('jupyter labextension unlock @jupyter/nbgrader:assignment-list')
-            os.system('jupyter labextension unlock @jupyter/nbgrader:create-assignment')
-            os.system('jupyter labextension unlock @jupyter/nbgrader:validate-assignment')
-            run(['runuser', '-u', grader_user, '--', 'jupyter', 'labextension', 'disable', '--level=user', '@jupyter/nbgrader:formgrader'], check=True)
-            run(['runuser', '-u', grader_user, '--', 'jupyter', 'labextension', 'enable', '--level=user', '@jupyter/nbgrader:formgrader'], check=True)
-            run(['runuser', '-u', grader_user, '--', 'jupyter', 'labextension', 'disable', '--level=user', '@jupyter/nbgrader:assignment-list'], check=True)
-            run(['runuser', '-u', grader_user, '--', 'jupyter', 'labextension', 'disable', '--level=user', '@jupyter/nbgrader:create-assignment'], check=True)
-            run(['runuser', '-u', grader_user, '--', 'jupyter', 'labextension', 'enable', '--level=user', '@jupyter/nbgrader:create-assignment'], check=True)
-            run(['runuser', '-u', grader_user, '--', 'jupyter', 'labextension', 'disable', '--level=user', '@jupyter/nbgrader:validate-assignment'], check=True)
-            os.system('jupyter labextension lock @jupyter/nbgrader:formgrader')
-            os.system('jupyter labextension lock @jupyter/nbgrader:assignment-list')
-            os.system('jupyter labextension lock @jupyter/nbgrader:create-assignment')
-            os.system('jupyter labextension lock @jupyter/nbgrader:validate-assignment')
-        except CalledProcessError:
-            logging.error('Command cannot be executed!')
-
-        # Create nbgrader config and course directory.
-        config_content = '\n'.join([
-            'c = get_config()',
-            '',
-            f'c.CourseDirectory.root = \'/home/{grader_user}/course_data\'',
-            f'c.CourseDirectory.course_id = \'{course_id}\'',
-            '',
-            'c.GenerateFeedback.preprocessors = [',
-            '    \'nbgrader.preprocessors.GetGrades\',',
-            '    \'nbconvert.preprocessors.CSSHTMLHeaderPreprocessor\',',
-            '    # uncomment next line to remove hidden tests from feedback',
-            '    ' + ('' if remove_hidden else '#') + '\'nbgrader.preprocessors.ClearHiddenTests\',',
-            '    # uncomment next line to remove tracebacks of hidden tests from feedback',
-            '    ' + ('' if remove_hidden_trace else '#') + '\'nbgrader.preprocessors.Execute\',',
-            ']'
-        ])
-
-        with open(f'/home/{grader_user}/.jupyter/nbgrader_config.py', 'w') as f:
-            f.write(config_content)
+        Returns
+        -------
+        Optional[bool]
+            True if a restart of the JupyterHub is necessary, False otherwise, None if the grader user could not be created.
+        """
 
-        try:
-            run(['mkdir', f'/home/{grader_user}/course_data'], check=True)
-        except CalledProcessError:
-            logging.error('Command cannot be executed!')
+        course_needs_restart = False
+
+        # Create grader user if necessary.
+        if not os.path.isdir(f'/home/{grader_user}'):
+            logging.info(f'Creating grader user: {grader_user}.')
+
+            # Take a prepared account from the pool or prepare a new one.
+            with time_step(step='grader_account', role=role) as timer:
+                if await grader_pool.claim(grader_user):
+                    timer.outcome = 'pooled'
+                elif not await grader_pool.prepare(grader_user):
+                    logging.error(f'Grader user {grader_user} could not be prepared. Please see logs and contact your administrator.')
+                    timer.outcome = 'error'
+                    return None
+            grader_pool.fill()
+
+            # Create course's nbgrader config.
+            config_content = '\n'.join([
+                'c = get_config()',
+                '',
+                f'c.CourseDirectory.root = \'/home/{grader_user}/course_data\'',
+                f'c.CourseDirectory.course_id = \'{course_id}\'',
+                '',
+                'c.GenerateFeedback.preprocessors = [',
+                '    \'nbgrader.preprocessors.GetGrades\',',
+                '    \'nbconvert.preprocessors.CSSHTMLHeaderPreprocessor\',',
+                '    # uncomment next line to remove hidden tests from feedback',
+                '    ' + ('' if remove_hidden else '#') + '\'nbgrader.preprocessors.ClearHiddenTests\',',
+                '    # uncomment next line to remove tracebacks of hidden tests from feedback',
+                '    ' + ('' if remove_hidden_trace else '#') + '\'nbgrader.preprocessors.Execute\',',
+                ']'
+            ])
+
+            def write_nbgrader_config() -> None:
+                config_file_path = f'/home/{grader_user}/.jupyter/nbgrader_config.py'
+                with open(config_file_path, 'w') as f:
+                    f.write(config_content)
+                shutil.chown(config_file_path, user=grader_user, group=grader_user)
+                os.chmod(config_file_path, 0o600)
 
-        # Initialize SQLite database using Gradebook class from nbgrader.
-        with Gradebook(f'sqlite:////home/{grader_user}/course_data/gradebook.db'):
-            pass
+            try:
+                with time_step(step='write_nbgrader_config', role=role):
+                    await provisioner.run_blocking(write_nbgrader_config)
+            except (FileNotFoundError, PermissionError, LookupError, OSError, TimeoutError):
+                logging.error('Error while writing nbgrader config of course.')
 
-        # Change ownership and permissions.
-        try:
-            run(['chown', '-R', f'{grader_user}:{grader_user}', f'/home/{grader_user}'], check=True)
-            run(['chmod', '-R', 'go-rwx', f'/home/{grader_user}'], check=True)
-        except CalledProcessError:
-            logging.error('Command cannot be executed!')
-
-    # Write general data of course (e.g. title, id, ...) to a JSON file.
-    info_file_path = f'/home/{grader_user}/course_data/info.json'
-    if is_instructor and not os.path.exists(info_file_path):
+        # Add course (with formgrader service, roles and groups) to registry or update its title.
         target_link_uri = auth_state['https://purl.imsglobal.org/spec/lti/claim/target_link_uri']
         target_link_uri = '/'.join(target_link_uri.strip('/').split('://')[-1].split('/')[1:]) + '/'
         target_link_uri = '' if target_link_uri == '/' else target_link_uri
@@ -333,135 +286,97 @@ async def nbgrader_post_auth(authenticator: LTI13Authenticator, handler: LTI13Ca
             'lineitem': auth_state['https://purl.imsglobal.org/spec/lti-ags/claim/endpoint']['lineitem']
         }
 
-        try:
-            with open(info_file_path, 'w', encoding='utf-8') as info_file:
-                json.dump(info, info_file, ensure_ascii=False, indent=4)
+        def add_course() -> tuple[list, list, dict]:
+            if not registry.add_course(info):
+                logging.debug('Course exists already.')
+                return [], [], {}
 
-            run(['chown', '-R', f'{grader_user}:{grader_user}', info_file_path], check=True)
-            run(['chmod', '-R', 'go-rwx', info_file_path], check=True)
-        except (FileNotFoundError, PermissionError, CalledProcessError, OSError):
-            logging.error('Error while accessing info.json file.')
+            logging.info(f'Created new nbgrader course: {course_id}.')
+            service, roles, groups = registry.get_course_hub_config(course_id)
+            if config_loader.shared_formgrader:
+                share_course(grader_user)
+                write_shared_courses(registry.get_courses())
+                roles = roles + make_shared_formgrader_roles([course_id])
+            return [service], roles, groups
 
-    # Create grader service if necessary.
-    if is_instructor:
+        try:
+            with time_step(step='registry_add_course', role=role):
+                new_services, new_roles, new_groups = await provisioner.run_blocking(add_course)
+        except (sqlite3.Error, TimeoutError):
+            logging.error('Course could not be added to course registry. Please see logs and contact your administrator.')
+            return course_needs_restart
+
+        # Start formgrader and register service, groups and roles on the running hub.
+        if new_services:
+            try:
+                with time_step(step='start_formgrader', role=role) as timer:
+                    if not await provisioner.run_blocking(start_formgraders, services=new_services, hub_base_url=hub_base_url,
+                                                          idle_timeout=config_loader.formgrader_idle_timeout):
+                        timer.outcome = 'error'
+                        course_needs_restart = True
+            except (CalledProcessError, OSError, TimeoutError):
+                logging.error('Starting formgrader of new course failed. Falling back to hub restart.')
+                course_needs_restart = True
+            with time_step(step='register_service', role=role) as timer:
+                if not await hub_client.register_service(service=new_services[0]):
+                    timer.outcome = 'error'
+                    course_needs_restart = True
+        try:
+            with time_step(step='register_groups_roles', role=role):
+                register_groups(handler=handler, groups=new_groups)
+                register_roles(db=handler.db, roles=new_roles)
+        except (KeyError, ValueError, SQLAlchemyError):
+            logging.error('Registering course on running hub failed. Falling back to hub restart.')
+            course_needs_restart = True
 
-        # Read services, roles, groups from config file.
-        services, roles, groups = read_autogenerated_config(autogenerated_file_path=config_loader.autogenerated_file_path)
+        return course_needs_restart
 
-        # Check if formgrader service is present otherwise create it.
-        for service in services:
-            if service['name'] == course_id:
-                logging.debug('Course exists already.')
-                break
-        else:
-            logging.info(f'Creating new nbgrader course: {course_id}.')
-
-            # Defining port on which the service is running.
-            port = 8100 if len(services) == 0 else max([int(service['url'].split(':')[-1]) for service in services]) + 1
-
-            # Appending new service to existing ones.
-            services.append({
-                'name': course_id,
-                'url': f'http://127.0.0.1:{port}',
-                'command': ['jupyterhub-singleuser', f'--group=formgrade-{course_id}', '--KernelSpecManager.ensure_native_kernel=False'],  # '--debug'],
-                'user': grader_user,
-                'cwd': f'/home/{grader_user}',
-                'api_token': secrets.token_hex(32),
-                'oauth_no_confirm': True,
-                'display': False
-            })
-
-            # Check if formgrader role exists otherwise create it.
-            for role in roles:
-                if role.get('name') == 'formgrader-service-role':
-                    role['services'].append(course_id)
-                    break
-            else:
-                roles.append({
-                    'name': 'formgrader-service-role',
-                    'scopes': ['read:users:groups', 'list:services', 'list:users', 'groups', 'admin:users', 'admin:groups'],
-                    'services': [course_id]
-                })
-
-            roles.append({
-                'name': f'formgrader-{course_id}-role',
-                'groups': [f'formgrade-{course_id}'],
-                'scopes': [f'access:services!service={course_id}',
-                           f'list:services!service={course_id}',
-                           f'read:services!service={course_id}',
-                           'access:services!service=kore']
-            })
-
-            groups.update({
-                f'formgrade-{course_id}': {'users': [grader_user]},
-                f'nbgrader-{course_id}': {'users': [grader_user]}
-            })
+    if is_instructor:
 
-            needs_restart = True
+        # Concurrent launches of the same course wait for one provisioning run and share its result.
+        with time_step(step='provision_course', role=role) as timer:
+            course_needs_restart = await provisioner.single_flight(key=course_id, func=provision_course)
+            if course_needs_restart is None:
+                timer.outcome = 'error'
+                return needs_restart
+            if course_needs_restart:
+                needs_restart = True
 
         # Add instructor to course.
         group_name = f'formgrade-{course_id}'
-        if username not in groups[group_name]:
-            groups[group_name]['users'].append(username)
-            needs_restart = True
-
-        # Write new services, roles, groups to config file.
-        try:
-            write_autogenerated_config(autogenerated_file_path=config_loader.autogenerated_file_path, services=services, roles=roles, groups=groups)
-        except AutogeneratedFileError:
-            logging.error('Configuration file could not be written. Please see logs and contact your administrator.')
-
-    # Write course title to global nbgrader_config.py.
-    if is_instructor:
-        try:
-            with open(file=nbgrader_config_path, mode='r') as nbgrader_config_file:
-                content = nbgrader_config_file.read()
-        except (FileNotFoundError, PermissionError, OSError):
-            logging.error('Error while accessing nbgrader configuration file.')
-
-        start = content.find('c.NbGrader.course_titles')
-        end = content.find('}', start)
-        pre = content[:start]
-        code = content[start:end + 1]
-        post = content[end + 1:]
-        code = code.replace('c.NbGrader.course_titles = ', 'mapping.update(')
-        code = code.replace('}', '})')
-
-        mapping = {}
-        exec(code + '\n')
-        mapping[course_id] = course_title
 
         try:
-            with open(file=nbgrader_config_path, mode='w') as nbgrader_config_file:
-                nbgrader_config_file.write(pre)
-                nbgrader_config_file.write(f'c.NbGrader.course_titles = {str(mapping)}')
-                nbgrader_config_file.write(post)
-        except (FileNotFoundError, PermissionError, OSError):
-            logging.error('Error while accessing nbgrader configuration file.')
+            with time_step(step='join_formgrade_group', role=role):
+                if await provisioner.run_blocking(registry.add_group_members, group_name, [username]):
+                    register_groups(handler=handler, groups={group_name: {'users': [username]}})
+        except (sqlite3.Error, TimeoutError):
+            logging.error('Instructor could not be added to course registry. Please see logs and contact your administrator.')
+        except SQLAlchemyError:
+            logging.error('Registering instructor on running hub failed. Falling back to hub restart.')
+            needs_restart = True
 
     # Add student to course.
     if grader_exists and not is_instructor:
 
-        # Add student to nbgrader database.
-        with Gradebook(f'sqlite:////home/{grader_user}/course_data/gradebook.db') as gb:
-            gb.update_or_create_student(
-                username,
+        # Add student to nbgrader database (batched write behind the login, skipped if student's data is unchanged).
+        with time_step(step='enroll_student', role=role):
+            enrollment_queue.enqueue(
+                grader_user=grader_user,
+                username=username,
                 first_name=auth_state.get('given_name', 'none'),
                 last_name=auth_state.get('family_name', 'none'),
                 email=auth_state.get('email', 'none'),
                 lms_user_id=auth_state['sub']
             )
 
-        # Add student to course's JupyterHub group, which is required by nbgrader.
-        base_url = get_hub_base_url(auth_state)
+        # Add student to course's JupyterHub group, which is required by nbgrader (batched request in background).
         logging.debug('adding student to course\'s nbgrader group')
-        subprocess.run(['systemd-run', '--on-active=5', 'curl',
-                        '-H', 'Content-Type: application/json',
-                        '-H', 'Accept: application/json',
-                        '-H', f'Authorization: token {kore_token}',
-                        '-X', 'POST',
-                        '-d', '{"users":["' + username + '"]}',
-                        f'http://127.0.0.1:8081/{base_url}hub/api/groups/nbgrader-{course_id}/users'])
+        try:
+            with time_step(step='join_nbgrader_group', role=role):
+                handler.user_from_username(username)
+                hub_client.add_group_member(group_name=f'nbgrader-{course_id}', username=username)
+        except (SQLAlchemyError, RuntimeError, ValueError):
+            logging.error(f'Adding student {username} to course\'s nbgrader group failed.')
 
     return needs_restart
 
@@ -482,13 +397,37 @@ c.JupyterHub.services.append({
     'api_token': kore_token,
     'oauth_no_confirm': True,
     'cwd': '/opt/kore',
-    'command': ['gunicorn', '--workers=1', '--bind=localhost:10001', 'kore:app']
+    # Threaded workers, app (and nbgrader) imported once before forking workers.
+    'command': ['gunicorn', f'--workers={config_loader.kore_workers}', f'--threads={config_loader.kore_threads}', '--worker-class=gthread',
+                '--preload', '--bind=localhost:10001', 'kore:app']
 })
 c.JupyterHub.load_roles.append({
     'name': 'kore_role',
-    'scopes': ['groups', 'read:users'],
+    'scopes': ['groups', 'read:users', 'admin:services'],
     'services': ['kore']
 })
 
-# Load autogenerated services.
-load_subconfig(autogenerated_file_path)  # noqa
\ No newline at end of file
+# Load services, roles and groups of all courses from the registry and start formgraders.
+# Services created via the REST API are already stored in the hub's database and must not be redefined here.
+course_services, course_roles, course_groups = registry.get_hub_config()
+start_formgraders(services=course_services, hub_base_url=hub_base_url, idle_timeout=config_loader.formgrader_idle_timeout)
+if config_loader.formgrader_idle_timeout > 0:
+    # The hub's health checks of services (periodic and at start-up) would start on-demand formgraders.
+    c.JupyterHub.service_check_interval = 0
+    skip_on_demand_service_checks()
+runtime_services = runtime_service_names(db_url=c.JupyterHub.db_url)
+c.JupyterHub.services.extend([service for service in course_services if service['name'] not in runtime_services])
+c.JupyterHub.load_roles.extend(course_roles)
+c.JupyterHub.load_groups.update(course_groups)
+
+# Shared formgrader serving the formgrader GUI of all courses (course accounts' Lab sessions remain per course).
+if config_loader.shared_formgrader:
+    prepare_shared_formgrader()
+    courses = registry.get_courses()
+    for course in courses:
+        share_course(course['grader_user'])
+    write_shared_courses(courses)
+    shared_service = make_shared_formgrader_service(api_token=registry.get_secret('shared_formgrader'))
+    start_formgraders(services=[shared_service], hub_base_url=hub_base_url, idle_timeout=config_loader.formgrader_idle_timeout)
+    c.JupyterHub.services.append(shared_service)
+    c.JupyterHub.load_roles.extend(make_shared_formgrader_roles([course['id'] for course in courses]))
\ No newline at end of file
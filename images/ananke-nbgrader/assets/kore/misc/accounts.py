@@ -0,0 +1,156 @@
+import grp
+import hashlib
+import logging
+import os
+import pwd
+import time
+from concurrent.futures import ThreadPoolExecutor
+from subprocess import run, CalledProcessError
+from typing import TYPE_CHECKING, Optional
+
+if TYPE_CHECKING:
+    from models.registry import CourseRegistry
+
+
+def account_state(entry: pwd.struct_passwd) -> str:
+    """
+    Hash of an account's properties relevant for reconciliation (uid, gid, home directory, shell).
+    """
+
+    return hashlib.sha256(f'{entry.pw_uid}:{entry.pw_gid}:{entry.pw_dir}:{entry.pw_shell}'.encode()).hexdigest()[0:16]
+
+
+def manifest_entry(entry: pwd.struct_passwd) -> dict:
+    return {'uid': entry.pw_uid, 'gid': entry.pw_gid, 'home': entry.pw_dir, 'state': account_state(entry)}
+
+
+def _id_free(get_func, id_: int) -> bool:
+    try:
+        get_func(id_)
+    except KeyError:
+        return True
+    return False
+
+
+def create_account(username: str, home: str, uid: int, gid: int, keep_ids: bool) -> Optional[pwd.struct_passwd]:
+    """
+    Create a missing account for an existing home directory.
+
+    Parameters
+    ----------
+    username : str
+        The account's name.
+    home : str
+        The account's (existing) home directory.
+    uid, gid : int
+        Expected user and group id (from manifest or owner of the home directory).
+    keep_ids : bool
+        Create the account with the expected ids (must be free).
+
+    Returns
+    -------
+    pwd.struct_passwd or None
+        The new account, None if creating the account failed.
+    """
+
+    args = ['useradd', '--shell=/bin/bash', f'--home-dir={home}', '--no-create-home']
+    try:
+        if keep_ids:
+            args.append(f'--uid={uid}')
+            if _id_free(grp.getgrgid, gid):
+                run(['groupadd', f'--gid={gid}', username], check=True)
+                args.append(f'--gid={gid}')
+        run(args + [username], check=True)
+        run(['usermod', '-L', username], check=True)
+        return pwd.getpwnam(username)
+    except (CalledProcessError, KeyError, OSError):
+        logging.error(f'Creating account {username} failed.')
+        return None
+
+
+def fix_ownership(entry: pwd.struct_passwd, home: str) -> bool:
+    """
+    Change ownership of a home directory tree to the account, if the account's ids differ from the directory's owner.
+
+    Returns
+    -------
+    bool
+        True if ownership is correct, False if changing it failed.
+    """
+
+    # Files keep their numeric owner, so walking the tree is only necessary if the account got other ids.
+    try:
+        stat = os.stat(home)
+        if (stat.st_uid, stat.st_gid) != (entry.pw_uid, entry.pw_gid):
+            logging.info(f'Ids of account {entry.pw_name} changed, fixing ownership of {home}.')
+            run(['chown', '-R', f'{entry.pw_uid}:{entry.pw_gid}', home], check=True)
+    except (CalledProcessError, OSError):
+        logging.error(f'Fixing ownership of {home} failed.')
+        return False
+
+    return True
+
+
+def reconcile_accounts(registry: 'CourseRegistry', home_root: str = '/home', concurrency: int = 4) -> None:
+    """
+    Ensure existence of accounts for all home directories, which is necessary after replacing the container with a new one.
+
+    Existing accounts are only checked against the manifest stored in the registry. Missing accounts are created one by one
+    (`useradd` locks the account database anyway), reusing the expected uid and gid if they are free. Ownership of home
+    directories of accounts with other ids is fixed in parallel (bounded by `concurrency`).
+
+    Parameters
+    ----------
+    registry : CourseRegistry
+        The course registry holding the manifest of accounts.
+    home_root : str
+        Directory containing the home directories.
+    concurrency : int
+        Maximum number of home directories whose ownership is fixed at the same time.
+
+    Returns
+    -------
+    None
+    """
+
+    start = time.perf_counter()
+    manifest = registry.get_accounts()
+    updates = {}
+    keep_ids, new_ids = [], []
+
+    for item in os.scandir(home_root):
+        if not item.is_dir(follow_symlinks=False):
+            continue
+        try:
+            entry = pwd.getpwnam(item.name)
+        except KeyError:
+            # Expected ids from manifest, else from the home directory's owner (numeric ids survive container replacement).
+            expected = manifest.get(item.name)
+            if expected is None:
+                stat = item.stat(follow_symlinks=False)
+                expected = {'uid': stat.st_uid, 'gid': stat.st_gid}
+            task = (item.name, item.path, expected['uid'], expected['gid'])
+            (keep_ids if expected['uid'] >= 1000 and _id_free(pwd.getpwuid, expected['uid']) else new_ids).append(task)
+            continue
+
+        if manifest.get(item.name, {}).get('state') != account_state(entry):
+            updates[item.name] = manifest_entry(entry)
+
+    # Accounts keeping their ids first, so automatically chosen ids cannot collide with expected ones.
+    created = []
+    for tasks, keep in [(keep_ids, True), (new_ids, False)]:
+        for username, home, uid, gid in tasks:
+            entry = create_account(username, home, uid, gid, keep_ids=keep)
+            if entry is not None:
+                created.append((entry, home))
+
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='kore-accounts') as executor:
+        for (entry, home), ok in zip(created, executor.map(lambda account: fix_ownership(*account), created)):
+            if ok:
+                updates[entry.pw_name] = manifest_entry(entry)
+
+    registry.set_accounts(updates)
+
+    if keep_ids or new_ids:
+        logging.info(f'Created {len(created)} of {len(keep_ids) + len(new_ids)} missing accounts ({len(new_ids)} with new ids) '
+                     f'in {time.perf_counter() - start:.1f} seconds.')
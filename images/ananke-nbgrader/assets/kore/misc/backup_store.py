@@ -0,0 +1,429 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import stat
+import tempfile
+import time
+import zlib
+from typing import List, Optional, Tuple
+
+try:
+    import zstandard
+    decompression_errors = (zstandard.ZstdError,)
+except ImportError:
+    zstandard = None
+    decompression_errors = ()
+
+from exceptions import BackupError, CopyError
+from misc.content_index import content_index
+from misc.copy_engine import copy, owner_ids
+
+# Course backups of a user are stored in a root-owned directory next to the users' home directories (users cannot modify
+# backups, Kore restores them as root). File contents are split into chunks, which are stored compressed and only once
+# (named by their hash). Each backup is a manifest listing the backed-up course's directories, files and the chunks of the
+# files. Backups are listed as `/var/lib/private/USER/BACKUP_NAME` (see `find_backup`).
+backups_dir = '/var/lib/private'
+store_dir_name = '.kore_backups'
+chunk_size = 1024 * 1024
+
+chunk_pattern = re.compile('[0-9a-f]{64}')
+
+# Unreferenced chunks younger than this (seconds) may belong to a backup in progress and are not removed.
+garbage_min_age = 3600
+
+# Parsed manifests (path > (mtime in ns, manifest)).
+_manifests: dict[str, Tuple[int, dict]] = {}
+
+
+def _store_path(user_name: str) -> str:
+    store = f'{backups_dir}/{store_dir_name}/{user_name}'
+    if not os.path.isdir(store):
+        _migrate_store(user_name, store)
+    return store
+
+
+def _migrate_store(user_name: str, store: str) -> None:
+    """
+    Move a store of a former version (in the user's home directory, writable by the user) to the root-owned store directory.
+    Links and special files are removed, the remaining files are owned by root. Manifests are checked on restore.
+    """
+
+    old_store = f'{backups_dir}/{user_name}/{store_dir_name}'
+    if os.path.islink(old_store) or not os.path.isdir(old_store):
+        return
+
+    try:
+        os.makedirs(f'{backups_dir}/{store_dir_name}', mode=0o700, exist_ok=True)
+        os.rename(old_store, store)
+        for root, dirs, files in os.walk(store):
+            for name in dirs + files:
+                path = os.path.join(root, name)
+                path_stat = os.lstat(path)
+                if stat.S_ISDIR(path_stat.st_mode):
+                    os.chown(path, 0, 0)
+                    os.chmod(path, 0o700)
+                elif stat.S_ISREG(path_stat.st_mode):
+                    os.chown(path, 0, 0)
+                    os.chmod(path, 0o600)
+                else:
+                    os.unlink(path)
+        os.chown(store, 0, 0)
+        os.chmod(store, 0o700)
+    except OSError as e:
+        logging.error(f'Moving backup store {old_store} to {store} failed: {e}')
+        return
+
+    logging.info(f'Moved backup store {old_store} to {store}.')
+
+
+def _chunk_path(store: str, chunk: str) -> Optional[str]:
+    for suffix in ['.zst', '.zz']:
+        path = f'{store}/chunks/{chunk[0:2]}/{chunk}{suffix}'
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+def _write_chunk(store: str, data: bytes) -> str:
+    chunk = hashlib.sha256(data).hexdigest()
+    if _chunk_path(store, chunk) is not None:
+        return chunk
+
+    if zstandard is not None:
+        data, suffix = zstandard.ZstdCompressor(level=3).compress(data), '.zst'
+    else:
+        data, suffix = zlib.compress(data, 6), '.zz'
+
+    chunk_dir = f'{store}/chunks/{chunk[0:2]}'
+    os.makedirs(chunk_dir, mode=0o700, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=chunk_dir, prefix='.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            file.write(data)
+        os.replace(tmp_path, f'{chunk_dir}/{chunk}{suffix}')
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+    return chunk
+
+
+def _read_chunk(store: str, chunk: str) -> bytes:
+    if not isinstance(chunk, str) or not chunk_pattern.fullmatch(chunk):
+        logging.error(f'Invalid chunk name in backup store {store}.')
+        raise BackupError
+
+    path = _chunk_path(store, chunk)
+    if path is None:
+        logging.error(f'Chunk {chunk} missing in backup store {store}.')
+        raise BackupError
+
+    if path.endswith('.zst') and zstandard is None:
+        logging.error('Backup store contains zstd compressed chunks, but zstandard is not installed.')
+        raise BackupError
+
+    try:
+        with open(os.open(path, os.O_RDONLY | os.O_NOFOLLOW), 'rb') as file:
+            data = file.read()
+        return zstandard.ZstdDecompressor().decompress(data) if path.endswith('.zst') else zlib.decompress(data)
+    except (OSError, zlib.error, *decompression_errors):
+        logging.error(f'Chunk {chunk} in backup store {store} not readable.')
+        raise BackupError
+
+
+def load_manifests(user_name: str) -> dict:
+    """
+    Manifests of all backups of a user (backup name > manifest), cached until a manifest file changes.
+    """
+
+    manifests = {}
+    for path in content_index.files(f'{_store_path(user_name)}/manifests', suffix='.json'):
+        try:
+            mtime = os.stat(path).st_mtime_ns
+            cached = _manifests.get(path)
+            if cached is None or cached[0] != mtime:
+                with open(path, 'r') as file:
+                    cached = (mtime, json.load(file))
+                _manifests[path] = cached
+        except (OSError, ValueError):
+            logging.warning(f'Backup manifest {path} not readable.')
+            continue
+        manifests[os.path.basename(path).removesuffix('.json')] = cached[1]
+
+    return manifests
+
+
+def create_backup(user_name: str, src: str, name: str, exclude: Optional[List[str]] = None) -> None:
+    """
+    Back up a directory tree to the user's backup store.
+
+    Files unchanged (size and mtime) since the latest backup of the same directory are not read again, new chunks are
+    compressed with zstd (zlib if zstandard is not installed).
+
+    Parameters
+    ----------
+    user_name : str
+        Owner of the backup.
+    src : str
+        Directory to back up.
+    name : str
+        Name of the backup.
+    exclude : Optional[List[str]], optional
+        Paths relative to `src` which are not backed up. Default is None.
+
+    Returns
+    -------
+    None
+
+    Raises
+    ------
+    BackupError
+        If the backup cannot be created.
+    """
+
+    src = src.rstrip('/')
+    exclude = set(exclude or [])
+    store = _store_path(user_name)
+
+    try:
+        for path in [f'{backups_dir}/{store_dir_name}', store, f'{store}/manifests']:
+            os.makedirs(path, mode=0o700, exist_ok=True)
+    except OSError as e:
+        logging.error(f'Creating backup store {store} failed: {e}')
+        raise BackupError
+
+    manifests = load_manifests(user_name)
+    if name in manifests:
+        logging.error(f'Backup {name} of {user_name} already exists.')
+        raise BackupError
+
+    # Files of the latest backup of the same directory.
+    previous = max((manifest for manifest in manifests.values() if manifest.get('source') == src),
+                   key=lambda manifest: manifest['created'], default={'entries': []})
+    previous_files = {entry['path']: entry for entry in previous['entries'] if entry['type'] == 'file'}
+
+    entries = []
+    try:
+        for root, dirs, files in os.walk(src):
+            relative_root = os.path.relpath(root, src) if root != src else ''
+            dirs[:] = sorted(d for d in dirs if os.path.join(relative_root, d) not in exclude)
+            for item in dirs + sorted(files):
+                relative = os.path.join(relative_root, item)
+                if relative in exclude:
+                    continue
+                path = os.path.join(root, item)
+                path_stat = os.lstat(path)
+                entry = {'path': relative, 'mode': stat.S_IMODE(path_stat.st_mode)}
+                if stat.S_ISLNK(path_stat.st_mode):
+                    entry.update(type='link', target=os.readlink(path))
+                elif stat.S_ISDIR(path_stat.st_mode):
+                    entry.update(type='dir')
+                elif stat.S_ISREG(path_stat.st_mode):
+                    entry.update(type='file', size=path_stat.st_size, mtime=path_stat.st_mtime_ns)
+                    old = previous_files.get(relative)
+                    if old is not None and (old['size'], old['mtime']) == (entry['size'], entry['mtime']) \
+                            and all(_chunk_path(store, chunk) for chunk in old['chunks']):
+                        entry['chunks'] = old['chunks']
+                    else:
+                        with open(path, 'rb') as file:
+                            entry['chunks'] = [_write_chunk(store, data) for data in iter(lambda: file.read(chunk_size), b'')]
+                else:
+                    continue
+                entries.append(entry)
+
+        manifest = {'source': src, 'created': time.time(), 'entries': entries}
+        fd, tmp_path = tempfile.mkstemp(dir=f'{store}/manifests', prefix='.', suffix='.tmp')
+        with os.fdopen(fd, 'w') as file:
+            json.dump(manifest, file)
+        os.replace(tmp_path, f'{store}/manifests/{name}.json')
+    except OSError as e:
+        logging.error(f'Backing up {src} failed: {e}')
+        raise BackupError
+
+    logging.info(f'Backed up {src} as {name} ({len(entries)} entries).')
+    _collect_garbage(user_name)
+
+
+def _collect_garbage(user_name: str) -> None:
+    """
+    Remove chunks not referenced by any manifest (backups are deleted by deleting their manifest).
+    """
+
+    store = _store_path(user_name)
+    referenced = {
+        chunk
+        for manifest in load_manifests(user_name).values()
+        for entry in manifest['entries'] if entry['type'] == 'file'
+        for chunk in entry['chunks']
+    }
+    now = time.time()
+    for path in content_index.files(f'{store}/chunks', suffix=''):
+        chunk = os.path.basename(path).split('.')[0]
+        try:
+            if chunk not in referenced and now - os.stat(path).st_mtime > garbage_min_age:
+                os.unlink(path)
+        except OSError:
+            pass
+
+
+def find_backup(path: str) -> Optional[Tuple[str, dict, str]]:
+    """
+    Find the backup containing a path of the form `/var/lib/private/USER/BACKUP_NAME/...`.
+
+    Returns
+    -------
+    Optional[Tuple[str, dict, str]]
+        User name, manifest and path relative to the backed-up directory, None if there is no such backup.
+    """
+
+    parts = path.removeprefix(f'{backups_dir}/').rstrip('/').split('/')
+    if not path.startswith(f'{backups_dir}/') or len(parts) < 2 or parts[0] in ['', '.', '..', store_dir_name]:
+        return None
+
+    manifest = load_manifests(parts[0]).get(parts[1])
+    if manifest is None:
+        return None
+
+    return parts[0], manifest, '/'.join(parts[2:])
+
+
+def list_backups(user_name: str) -> List[Tuple[str, dict]]:
+    """
+    Paths (`/var/lib/private/USER/BACKUP_NAME`) and manifests of all backups of a user.
+    """
+
+    return [(f'{backups_dir}/{user_name}/{name}', manifest) for name, manifest in load_manifests(user_name).items()]
+
+
+def subdirectories(path: str) -> List[str]:
+    """
+    Paths of the (non-hidden) subdirectories of a directory on disk or in a backup.
+    """
+
+    backup = None if os.path.isdir(path) else find_backup(path)
+    if backup is None:
+        return content_index.subdirectories(path)
+
+    _, manifest, relative = backup
+    prefix = f'{relative}/' if relative else ''
+    return [
+        f'{path.rstrip("/")}/{entry["path"].removeprefix(prefix)}'
+        for entry in manifest['entries']
+        if entry['type'] == 'dir' and entry['path'].startswith(prefix) and '/' not in entry['path'].removeprefix(prefix)
+        and not entry['path'].removeprefix(prefix).startswith('.')
+    ]
+
+
+def _is_relative_path(path: str) -> bool:
+    """
+    Check whether a path is relative, normalized and does not leave its base directory.
+    """
+
+    return isinstance(path, str) and path != '' and not os.path.isabs(path) and os.path.normpath(path) == path \
+        and '..' not in path.split('/')
+
+
+def _is_inside(path: str, directory: str) -> bool:
+    return os.path.commonpath([os.path.realpath(path), os.path.realpath(directory)]) == os.path.realpath(directory)
+
+
+def _restore(user_name: str, manifest: dict, relative: str, dst: str, uid: int, gid: int) -> None:
+    store = _store_path(user_name)
+
+    # Manifests of former versions were writable by users, Kore must not write outside `dst`.
+    if any(not _is_relative_path(entry.get('path')) for entry in manifest['entries']):
+        logging.error(f'Backup manifest of {user_name} contains invalid paths.')
+        raise BackupError
+
+    entries = [entry for entry in manifest['entries'] if entry['path'] == relative or entry['path'].startswith(f'{relative}/')] \
+        if relative else manifest['entries']
+    if relative and not entries:
+        logging.error(f'{relative} not found in backup.')
+        raise BackupError
+
+    def write_file(entry: dict, target: str) -> None:
+        fd = os.open(target, os.O_WRONLY | os.O_CREAT | os.O_EXCL | os.O_NOFOLLOW, 0o600)
+        try:
+            for chunk in entry['chunks']:
+                os.write(fd, _read_chunk(store, chunk))
+            os.fchown(fd, uid, gid)
+            os.fchmod(fd, entry['mode'] & 0o777)
+        finally:
+            os.close(fd)
+
+    # Single file
+    if entries[0]['path'] == relative and entries[0]['type'] == 'file':
+        write_file(entries[0], dst)
+        return
+
+    if not relative:
+        os.chmod(dst, 0o755)
+    for entry in entries:
+        if entry['path'] == relative:
+            os.chmod(dst, (entry['mode'] & 0o777) | stat.S_IRWXU)
+            continue
+        path = entry['path'].removeprefix(f'{relative}/') if relative else entry['path']
+        target = os.path.join(dst, path)
+        if not _is_inside(os.path.dirname(target), dst):
+            logging.error(f'Restoring {entry["path"]} would write outside of {dst}.')
+            raise BackupError
+        if entry['type'] == 'dir':
+            os.mkdir(target, (entry['mode'] & 0o777) | stat.S_IRWXU)
+            os.chown(target, uid, gid)
+        elif entry['type'] == 'link':
+            # Only links within the restored tree are restored.
+            link = entry.get('target')
+            if not isinstance(link, str) or os.path.isabs(link) \
+                    or not _is_relative_path(os.path.normpath(os.path.join(os.path.dirname(path), link))):
+                logging.warning(f'Link {entry["path"]} in backup of {user_name} points outside of the restored directory, skipping it.')
+                continue
+            os.symlink(link, target)
+            os.lchown(target, uid, gid)
+        elif entry['type'] == 'file':
+            write_file(entry, target)
+
+
+def copy_content(src: str, dst: str, owner: str) -> None:
+    """
+    Copy a file or directory tree on disk or in a backup (see `misc.copy_engine.copy`).
+
+    Raises
+    ------
+    CopyError
+        If copying fails (nothing is left at `dst` then).
+    """
+
+    backup = None if os.path.lexists(src) else find_backup(src)
+    if backup is None:
+        copy(src, dst, owner=owner)
+        return
+
+    user_name, manifest, relative = backup
+    uid, gid = owner_ids(owner)
+    dst = dst.rstrip('/')
+    if os.path.lexists(dst):
+        logging.error(f'Restoring {src} failed, {dst} already exists.')
+        raise CopyError
+
+    is_file = any(entry['path'] == relative and entry['type'] == 'file' for entry in manifest['entries'])
+    tmp = None
+    try:
+        if is_file:
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(dst), prefix='.kore-copy-')
+            os.close(fd)
+            os.unlink(tmp)
+        else:
+            tmp = tempfile.mkdtemp(dir=os.path.dirname(dst), prefix='.kore-copy-')
+            os.chown(tmp, uid, gid)
+        _restore(user_name, manifest, relative, tmp, uid, gid)
+        os.rename(tmp, dst)
+    except (OSError, BackupError) as e:
+        logging.error(f'Restoring {src} to {dst} failed: {e}')
+        if tmp is not None and os.path.isdir(tmp):
+            shutil.rmtree(tmp, ignore_errors=True)
+        elif tmp is not None and os.path.lexists(tmp):
+            os.unlink(tmp)
+        raise CopyError
@@ -0,0 +1,88 @@
+import os
+import threading
+from typing import List, Optional, Tuple
+
+
+class ContentIndex:
+    """
+    Per-process index of directory listings with lazy, mtime-based invalidation.
+
+    Adding, removing or renaming an entry changes the mtime of its parent directory, so a cached listing stays valid as long
+    as the directory's mtime is unchanged. Looking up a tree costs one `stat` per directory, directories are only listed
+    again after they have changed.
+    """
+
+    def __init__(self) -> None:
+        # Directory path > (mtime in ns, subdirectory names, file names)
+        self._listings: dict[str, Tuple[int, List[str], List[str]]] = {}
+        self._lock = threading.Lock()
+
+    def _listing(self, path: str) -> Optional[Tuple[List[str], List[str]]]:
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            self._forget(path)
+            return None
+
+        cached = self._listings.get(path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1], cached[2]
+
+        directories, files = [], []
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    (directories if entry.is_dir() else files).append(entry.name)
+        except OSError:
+            self._forget(path)
+            return None
+
+        with self._lock:
+            # Listings of removed subdirectories will never be looked up again.
+            if cached is not None:
+                for name in set(cached[1]) - set(directories):
+                    self._forget(os.path.join(path, name), lock=False)
+            self._listings[path] = (mtime, directories, files)
+
+        return directories, files
+
+    def _forget(self, path: str, lock: bool = True) -> None:
+        if lock:
+            with self._lock:
+                self._forget(path, lock=False)
+            return
+
+        prefix = path.rstrip('/') + '/'
+        for key in [key for key in self._listings if key == path or key.startswith(prefix)]:
+            del self._listings[key]
+
+    def subdirectories(self, path: str) -> List[str]:
+        """
+        Paths of the (non-hidden) subdirectories of a directory (empty list if the directory does not exist).
+        """
+
+        listing = self._listing(path)
+        if listing is None:
+            return []
+        return [os.path.join(path, name) for name in listing[0] if not name.startswith('.')]
+
+    def files(self, path: str, suffix: str) -> List[str]:
+        """
+        Paths of all files with the given suffix in a directory tree, skipping hidden directories (like `rglob`).
+        """
+
+        found = []
+        stack = [path]
+        while stack:
+            directory = stack.pop()
+            listing = self._listing(directory)
+            if listing is None:
+                continue
+            found.extend(os.path.join(directory, name) for name in listing[1] if name.endswith(suffix))
+            stack.extend(os.path.join(directory, name) for name in listing[0] if not name.startswith('.'))
+
+        return found
+
+
+# Shared by all requests of a Kore worker process.
+content_index = ContentIndex()
@@ -0,0 +1,168 @@
+import fcntl
+import logging
+import os
+import pwd
+import shutil
+import stat
+import tempfile
+from typing import Iterable, Optional, Tuple
+
+from exceptions import CopyError
+
+# ioctl request for cloning a file (reflink), see `ioctl_ficlone(2)`.
+FICLONE = 0x40049409
+
+
+def _copy_data(src_fd: int, dst_fd: int, size: int) -> None:
+    """
+    Copy a file's content, as reflink if the file system supports it.
+    """
+
+    try:
+        fcntl.ioctl(dst_fd, FICLONE, src_fd)
+        return
+    except OSError:
+        pass
+
+    # Copying in the kernel without reading into user space.
+    offset = 0
+    while offset < size:
+        sent = os.sendfile(dst_fd, src_fd, offset, size - offset)
+        if sent == 0:
+            break
+        offset += sent
+
+
+def _copy_file(src: str, dst: str, uid: int, gid: int) -> None:
+    with open(src, 'rb') as src_file:
+        src_stat = os.fstat(src_file.fileno())
+        dst_fd = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        try:
+            _copy_data(src_file.fileno(), dst_fd, src_stat.st_size)
+            os.fchown(dst_fd, uid, gid)
+            os.fchmod(dst_fd, stat.S_IMODE(src_stat.st_mode))
+        finally:
+            os.close(dst_fd)
+
+
+def _copy_tree(src: str, dst: str, uid: int, gid: int, exclude: Iterable[str], relative: str = '') -> None:
+    with os.scandir(src) as entries:
+        for entry in entries:
+            entry_relative = os.path.join(relative, entry.name)
+            if entry_relative in exclude:
+                continue
+            target = os.path.join(dst, entry.name)
+            if entry.is_symlink():
+                os.symlink(os.readlink(entry.path), target)
+                os.lchown(target, uid, gid)
+            elif entry.is_dir():
+                os.mkdir(target, stat.S_IMODE(entry.stat().st_mode) | stat.S_IRWXU)
+                os.chown(target, uid, gid)
+                _copy_tree(entry.path, target, uid, gid, exclude, entry_relative)
+            elif entry.is_file():
+                _copy_file(entry.path, target, uid, gid)
+
+
+def owner_ids(owner: str) -> Tuple[int, int]:
+    """
+    User and group id of a user.
+
+    Raises
+    ------
+    CopyError
+        If there is no such user.
+    """
+
+    try:
+        entry = pwd.getpwnam(owner)
+    except KeyError:
+        logging.error(f'Unknown user {owner}.')
+        raise CopyError
+    return entry.pw_uid, entry.pw_gid
+
+
+def make_dirs(path: str, owner: str) -> None:
+    """
+    Create a directory and missing parent directories, new directories are owned by the given user.
+
+    Raises
+    ------
+    CopyError
+        If a directory cannot be created.
+    """
+
+    _make_dirs(os.path.normpath(path), *owner_ids(owner))
+
+
+def _make_dirs(path: str, uid: int, gid: int) -> None:
+    if os.path.isdir(path):
+        return
+
+    _make_dirs(os.path.dirname(path), uid, gid)
+    try:
+        os.mkdir(path)
+        os.chown(path, uid, gid)
+    except FileExistsError:
+        pass
+    except OSError as e:
+        logging.error(f'Creating directory {path} failed: {e}')
+        raise CopyError
+
+
+def copy(src: str, dst: str, owner: str, exclude: Optional[Iterable[str]] = None) -> None:
+    """
+    Copy a file or a directory tree (in-process, as reflinks if supported by the file system).
+
+    The copy is owned by the given user right from the start and built under a temporary hidden name next to `dst`.
+    It appears at `dst` by an atomic rename when complete, so nobody ever sees a partial copy.
+
+    Parameters
+    ----------
+    src : str
+        File or directory to copy.
+    dst : str
+        Path of the copy (must not exist, parent directory must exist).
+    owner : str
+        Name of the user owning the copy.
+    exclude : Optional[Iterable[str]], optional
+        Paths relative to `src` which are not copied. Default is None.
+
+    Returns
+    -------
+    None
+
+    Raises
+    ------
+    CopyError
+        If copying fails (nothing is left at `dst` then).
+    """
+
+    uid, gid = owner_ids(owner)
+    src = src.rstrip('/')
+    dst = dst.rstrip('/')
+    exclude = set(exclude or [])
+
+    if os.path.lexists(dst):
+        logging.error(f'Copying {src} failed, {dst} already exists.')
+        raise CopyError
+
+    tmp = None
+    try:
+        if os.path.isdir(src):
+            tmp = tempfile.mkdtemp(dir=os.path.dirname(dst), prefix='.kore-copy-')
+            os.chown(tmp, uid, gid)
+            os.chmod(tmp, stat.S_IMODE(os.stat(src).st_mode) | stat.S_IRWXU)
+            _copy_tree(src, tmp, uid, gid, exclude)
+        else:
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(dst), prefix='.kore-copy-')
+            os.close(fd)
+            os.unlink(tmp)
+            _copy_file(src, tmp, uid, gid)
+        os.rename(tmp, dst)
+    except OSError as e:
+        logging.error(f'Copying {src} to {dst} failed: {e}')
+        if tmp is not None and os.path.isdir(tmp):
+            shutil.rmtree(tmp, ignore_errors=True)
+        elif tmp is not None and os.path.lexists(tmp):
+            os.unlink(tmp)
+        raise CopyError
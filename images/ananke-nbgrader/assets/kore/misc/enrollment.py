@@ -0,0 +1,183 @@
+import asyncio
+import logging
+import os
+import threading
+from typing import Optional
+
+from nbgrader.api import Gradebook, Student
+from sqlalchemy.exc import SQLAlchemyError
+
+from misc.provisioning import Provisioner
+
+student_fields = ['first_name', 'last_name', 'email', 'lms_user_id']
+
+# Retries of failed batches wait at most `delay * 2 ** max_backoff_exponent` seconds.
+max_backoff_exponent = 6
+
+
+class EnrollmentQueue:
+    """
+    Write-behind enrollment of students into course gradebooks.
+
+    Launches are coalesced per course and written as one batched upsert after `delay` seconds. Students whose record
+    is unchanged (known from a cache of all students of the course) are not written at all. One Gradebook (SQLAlchemy engine)
+    per course is kept open and reopened if the gradebook file gets replaced (e.g. by resetting the course).
+    """
+
+    def __init__(self, provisioner: Provisioner, delay: float = 1) -> None:
+        self.provisioner = provisioner
+        self.delay = delay
+        self._gradebooks: dict[str, tuple[Gradebook, int]] = {}
+        self._gradebooks_lock = threading.Lock()
+        self._students: dict[str, dict[str, tuple]] = {}
+        self._inodes: dict[str, Optional[int]] = {}
+        self._pending: dict[str, dict[str, dict]] = {}
+        self._flush_tasks: dict[str, asyncio.Task] = {}
+        self._failures: dict[str, int] = {}
+        self._write_locks: dict[str, threading.Lock] = {}
+
+    @staticmethod
+    def _gradebook_path(grader_user: str) -> str:
+        return f'/home/{grader_user}/course_data/gradebook.db'
+
+    def _inode(self, grader_user: str) -> Optional[int]:
+        try:
+            return os.stat(self._gradebook_path(grader_user)).st_ino
+        except FileNotFoundError:
+            return None
+
+    def enqueue(self, grader_user: str, username: str, first_name: str, last_name: str, email: str, lms_user_id: str) -> bool:
+        """
+        Queue a student for enrollment in the course's gradebook unless the stored record is unchanged.
+
+        Parameters
+        ----------
+        grader_user : str
+            The course's grader user.
+        username : str
+            The student's username.
+        first_name, last_name, email, lms_user_id : str
+            The student's data.
+
+        Returns
+        -------
+        bool
+            True if the student has been queued, False if the record is unchanged.
+        """
+
+        # Forget cached students if the gradebook has been replaced.
+        inode = self._inode(grader_user)
+        if self._inodes.get(grader_user) != inode:
+            self._students.pop(grader_user, None)
+            self._inodes[grader_user] = inode
+
+        record = (first_name, last_name, email, lms_user_id)
+        if self._students.get(grader_user, {}).get(username) == record:
+            return False
+
+        self._pending.setdefault(grader_user, {})[username] = dict(zip(student_fields, record))
+        if grader_user not in self._flush_tasks:
+            self._schedule(grader_user)
+
+        return True
+
+    def _schedule(self, grader_user: str) -> None:
+        # Failed batches are retried with exponential backoff.
+        delay = self.delay * 2 ** min(self._failures.get(grader_user, 0), max_backoff_exponent)
+        self._flush_tasks[grader_user] = asyncio.ensure_future(self._flush_later(grader_user, delay))
+
+    async def _flush_later(self, grader_user: str, delay: float) -> None:
+        # The task stays registered until the batch is written, so there is at most one write per course at a time.
+        try:
+            await asyncio.sleep(delay)
+            batch = self._pending.pop(grader_user, {})
+            try:
+                students = await self.provisioner.run_blocking(self._write_batch, grader_user, batch)
+            except (SQLAlchemyError, OSError, TimeoutError) as e:
+                logging.error(f'Enrolling {len(batch)} students in gradebook of {grader_user} failed: {e}')
+                # Students queued in the meantime carry newer data.
+                self._pending[grader_user] = {**batch, **self._pending.get(grader_user, {})}
+                self._failures[grader_user] = self._failures.get(grader_user, 0) + 1
+            else:
+                self._students[grader_user] = students
+                self._failures.pop(grader_user, None)
+        finally:
+            del self._flush_tasks[grader_user]
+
+        # Students queued during the write (or a failed batch) form the next batch.
+        if self._pending.get(grader_user):
+            self._schedule(grader_user)
+
+    def _gradebook(self, grader_user: str) -> Gradebook:
+        with self._gradebooks_lock:
+            inode = self._inode(grader_user)
+            gradebook, gradebook_inode = self._gradebooks.get(grader_user, (None, None))
+            if gradebook is None or gradebook_inode != inode or inode is None:
+                self._close(grader_user)
+                gradebook = Gradebook(f'sqlite:///{self._gradebook_path(grader_user)}')
+                self._gradebooks[grader_user] = (gradebook, self._inode(grader_user))
+            return gradebook
+
+    def _close(self, grader_user: str) -> None:
+        gradebook, _ = self._gradebooks.pop(grader_user, (None, None))
+        if gradebook is not None:
+            try:
+                gradebook.close()
+            except SQLAlchemyError:
+                pass
+
+    def _write_batch(self, grader_user: str, batch: dict[str, dict]) -> dict[str, tuple]:
+        """
+        Upsert changed students of a batch in one transaction (runs in the provisioning thread pool).
+
+        Returns
+        -------
+        dict[str, tuple]
+            All students of the course after the write (for the unchanged check).
+        """
+
+        # A write the caller stopped waiting for (timeout) may still be running in its thread and uses the same session.
+        with self._gradebooks_lock:
+            write_lock = self._write_locks.setdefault(grader_user, threading.Lock())
+
+        with write_lock:
+            try:
+                return self._upsert(grader_user, batch)
+            except (SQLAlchemyError, OSError):
+                # Reopened for the next batch.
+                with self._gradebooks_lock:
+                    self._close(grader_user)
+                raise
+
+    def _upsert(self, grader_user: str, batch: dict[str, dict]) -> dict[str, tuple]:
+        gb = self._gradebook(grader_user)
+        students = {
+            row.id: tuple(getattr(row, field) for field in student_fields)
+            for row in gb.db.query(Student.id, Student.first_name, Student.last_name, Student.email, Student.lms_user_id)
+        }
+
+        changed = 0
+        try:
+            for username, data in batch.items():
+                record = tuple(data[field] for field in student_fields)
+                if students.get(username) == record:
+                    continue
+                student = gb.db.query(Student).filter(Student.id == username).one_or_none() if username in students else None
+                if student is None:
+                    gb.db.add(Student(id=username, **data))
+                else:
+                    for field, value in data.items():
+                        setattr(student, field, value)
+                students[username] = record
+                changed += 1
+            # Ends the read transaction as well, which would block writers of the gradebook otherwise.
+            if changed:
+                gb.db.commit()
+            else:
+                gb.db.rollback()
+        except SQLAlchemyError:
+            gb.db.rollback()
+            raise
+
+        logging.debug(f'Enrolled {changed} of {len(batch)} queued students in gradebook of {grader_user}.')
+        return students
@@ -0,0 +1,71 @@
+from typing import Dict, List
+
+from nbgrader.api import Assignment, Grade, Gradebook, Student, SubmittedAssignment, SubmittedNotebook
+from sqlalchemy import func
+
+
+def assignment_max_scores(gb: Gradebook) -> Dict[str, float]:
+    """
+    Maximum score of each assignment of a gradebook (one SQL statement).
+
+    Parameters
+    ----------
+    gb : Gradebook
+        The course's gradebook.
+
+    Returns
+    -------
+    dict[str, float]
+        Assignment name > maximum score (sum of grade cells' and task cells' maximum scores).
+    """
+
+    return {name: float(max_score) for name, max_score in gb.db.query(Assignment.name, Assignment.max_score)}
+
+
+def student_scores(gb: Gradebook) -> List[dict]:
+    """
+    Scores of all students of a gradebook, total and per assignment.
+
+    Same results as reading `score` and `max_score` of each of nbgrader's `Student` objects, but computed by two
+    aggregate SQL statements instead of several queries per student.
+
+    Parameters
+    ----------
+    gb : Gradebook
+        The course's gradebook.
+
+    Returns
+    -------
+    list[dict]
+        One dict per student (ordered like `gb.students`) with keys `id`, `lms_user_id`, `score`, `max_score` and
+        `assignments` (assignment name > score, 0 for assignments without submission).
+    """
+
+    max_scores = assignment_max_scores(gb)
+    max_score = sum(max_scores.values())
+
+    rows = gb.db.query(Student.id, Student.lms_user_id, Assignment.name, func.coalesce(func.sum(Grade.score), 0.0))\
+        .select_from(Student)\
+        .outerjoin(SubmittedAssignment, SubmittedAssignment.student_id == Student.id)\
+        .outerjoin(Assignment, Assignment.id == SubmittedAssignment.assignment_id)\
+        .outerjoin(SubmittedNotebook, SubmittedNotebook.assignment_id == SubmittedAssignment.id)\
+        .outerjoin(Grade, Grade.notebook_id == SubmittedNotebook.id)\
+        .group_by(Student.id, Student.lms_user_id, Student.last_name, Student.first_name, Assignment.name)\
+        .order_by(Student.last_name, Student.first_name, Student.id)
+
+    students: Dict[str, dict] = {}
+    for student_id, lms_user_id, assignment_name, score in rows:
+        student = students.get(student_id)
+        if student is None:
+            student = students[student_id] = {
+                'id': student_id,
+                'lms_user_id': lms_user_id,
+                'score': 0.0,
+                'max_score': max_score,
+                'assignments': dict.fromkeys(max_scores, 0.0)
+            }
+        if assignment_name is not None:
+            student['assignments'][assignment_name] = float(score)
+            student['score'] += float(score)
+
+    return list(students.values())
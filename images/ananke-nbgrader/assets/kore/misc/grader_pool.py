@@ -0,0 +1,235 @@
+import asyncio
+import grp
+import logging
+import os
+import pwd
+import secrets
+from subprocess import CalledProcessError
+from typing import Optional
+
+from ananke_extension_config import set_labextensions, set_server_extensions, user_config_dir
+from nbgrader.api import Gradebook
+from sqlalchemy.exc import SQLAlchemyError
+
+from misc.provisioning import Provisioner
+
+# Marker file in the home directory of a fully prepared, unclaimed pool account.
+ready_marker = '.kore_pool_ready'
+
+
+def user_exists(name: str) -> bool:
+    try:
+        pwd.getpwnam(name)
+        return True
+    except KeyError:
+        return False
+
+
+def group_exists(name: str) -> bool:
+    try:
+        grp.getgrnam(name)
+        return True
+    except KeyError:
+        return False
+
+
+def account_exists(name: str) -> bool:
+    """
+    Check whether a user or a group with the given name exists.
+    """
+
+    return user_exists(name) or group_exists(name)
+
+
+class GraderPool:
+    """
+    Keeps a number of fully prepared grader accounts (nbgrader extensions configured, empty course directory and gradebook),
+    so creating a course only requires renaming a pooled account instead of the whole preparation.
+
+    Pool accounts are named `pool-<hex>` and live in `/home`. They are filled up in the background on the hub's event loop.
+    Accounts left in an unknown state by a failed claim are quarantined (never handed out, see `quarantined`).
+    """
+
+    def __init__(self, provisioner: Provisioner, size: int = 2, home_dir: str = '/home') -> None:
+        self.provisioner = provisioner
+        self.size = size
+        self.home_dir = home_dir
+        self.quarantined: list[str] = []
+        self._ready: Optional[list[str]] = None
+        self._fill_task: Optional[asyncio.Task] = None
+
+    @property
+    def ready(self) -> list[str]:
+        # Read lazily, pool accounts survive hub restarts.
+        if self._ready is None:
+            self._ready = sorted(
+                item.name for item in os.scandir(self.home_dir)
+                if item.name.startswith('pool-') and os.path.isfile(f'{item.path}/{ready_marker}')
+            )
+        return self._ready
+
+    async def prepare(self, grader_user: str) -> bool:
+        """
+        Create and prepare a grader account (user, nbgrader extensions, course directory, gradebook, permissions).
+        Extension config is written directly, without running Jupyter CLI commands as the grader user.
+
+        Parameters
+        ----------
+        grader_user : str
+            Name of the account (user or group with this name must not exist).
+
+        Returns
+        -------
+        bool
+            True if all steps succeeded, False otherwise (a partially prepared account is removed then).
+        """
+
+        home = f'{self.home_dir}/{grader_user}'
+
+        if account_exists(grader_user):
+            logging.error(f'Cannot prepare grader account {grader_user}, user or group exists already.')
+            return False
+
+        # Add non-existing user to system.
+        try:
+            await self.provisioner.run(['useradd', '--create-home', f'--home-dir={home}', '--shell=/bin/bash', grader_user])
+            await self.provisioner.run(['usermod', '-L', grader_user])
+        except CalledProcessError:
+            logging.error(f'Creating user {grader_user} failed.')
+            await self._remove(grader_user)
+            return False
+
+        # Activate nbgrader extensions, create course directory and initialize SQLite database using Gradebook class from nbgrader.
+        def create_course_directory() -> None:
+            config_dir = user_config_dir(home)
+            set_server_extensions(config_dir=config_dir, states={
+                'nbgrader.server_extensions.formgrader': True,
+                'nbgrader.server_extensions.assignment_list': False,
+                'nbgrader.server_extensions.validate_assignment': False
+            })
+            set_labextensions(config_dir=config_dir, force=True, states={
+                '@jupyter/nbgrader:formgrader': True,
+                '@jupyter/nbgrader:assignment-list': False,
+                '@jupyter/nbgrader:create-assignment': True,
+                '@jupyter/nbgrader:validate-assignment': False
+            })
+
+            os.makedirs(f'{home}/course_data', exist_ok=True)
+            with Gradebook(f'sqlite:///{home}/course_data/gradebook.db'):
+                pass
+
+        try:
+            await self.provisioner.run_blocking(create_course_directory)
+        except (OSError, ValueError, SQLAlchemyError, TimeoutError):
+            logging.error(f'Creating course directory of {grader_user} failed.')
+            await self._remove(grader_user)
+            return False
+
+        # Change ownership and permissions.
+        try:
+            await self.provisioner.run(['chown', '-R', f'{grader_user}:{grader_user}', home])
+            await self.provisioner.run(['chmod', '-R', 'go-rwx', home])
+        except CalledProcessError:
+            logging.error(f'Setting ownership and permissions of {home} failed.')
+            await self._remove(grader_user)
+            return False
+
+        return True
+
+    async def _remove(self, name: str) -> None:
+        """
+        Remove a partially prepared account (user, group and home directory).
+        """
+
+        try:
+            await self.provisioner.run(['userdel', '--remove', name])
+        except CalledProcessError:
+            logging.error(f'Removing account {name} failed, remove user and group {name} manually.')
+
+    async def claim(self, grader_user: str) -> bool:
+        """
+        Rename a prepared pool account (user, group and home directory) to the given grader user.
+
+        If renaming fails, the pool account is renamed back and returned to the pool. If that fails too, it is
+        quarantined.
+
+        Parameters
+        ----------
+        grader_user : str
+            Name of the course's grader user.
+
+        Returns
+        -------
+        bool
+            True if a pool account has been claimed, False if the pool is empty or renaming failed.
+        """
+
+        if not self.ready:
+            logging.info('Grader account pool is empty.')
+            return False
+
+        # Taken from the list before the first await, so concurrent claims never get the same account.
+        pool_user = self.ready.pop(0)
+        try:
+            await self.provisioner.run(['usermod', '--login', grader_user, '--home', f'{self.home_dir}/{grader_user}', '--move-home',
+                                        pool_user])
+            await self.provisioner.run(['groupmod', '--new-name', grader_user, pool_user])
+            os.remove(f'{self.home_dir}/{grader_user}/{ready_marker}')
+        except (CalledProcessError, OSError):
+            logging.error(f'Claiming pool account {pool_user} for {grader_user} failed.')
+            await self._release(pool_user, grader_user)
+            return False
+
+        logging.info(f'Claimed pool account {pool_user} as grader user {grader_user}.')
+        return True
+
+    async def _release(self, pool_user: str, grader_user: str) -> None:
+        """
+        Undo the renaming steps of a failed claim which succeeded and return the account to the pool.
+        """
+
+        try:
+            if not group_exists(pool_user) and group_exists(grader_user):
+                await self.provisioner.run(['groupmod', '--new-name', pool_user, grader_user])
+            if not user_exists(pool_user) and user_exists(grader_user):
+                await self.provisioner.run(['usermod', '--login', pool_user, '--home', f'{self.home_dir}/{pool_user}', '--move-home',
+                                            grader_user])
+        except CalledProcessError:
+            pass
+
+        if user_exists(pool_user) and group_exists(pool_user) and not account_exists(grader_user) \
+                and os.path.isfile(f'{self.home_dir}/{pool_user}/{ready_marker}'):
+            self.ready.append(pool_user)
+        else:
+            logging.error(f'Pool account {pool_user} quarantined after failed claim for {grader_user}, remove user and group '
+                          f'{pool_user} or {grader_user} manually.')
+            self.quarantined.append(pool_user)
+
+    def fill(self) -> None:
+        """
+        Start filling up the pool in the background (unless already running or full).
+        """
+
+        if len(self.ready) >= self.size or (self._fill_task is not None and not self._fill_task.done()):
+            return
+        self._fill_task = asyncio.ensure_future(self._fill())
+
+    async def _fill(self) -> None:
+        while len(self.ready) < self.size:
+            pool_user = f'pool-{secrets.token_hex(4)}'
+            logging.info(f'Preparing pool account {pool_user}.')
+
+            # Stopped until the next fill() (next new course), so persistent errors do not create accounts in a loop.
+            if not await self.prepare(pool_user):
+                logging.error(f'Preparing pool account {pool_user} failed.')
+                return
+            try:
+                with open(f'{self.home_dir}/{pool_user}/{ready_marker}', 'w'):
+                    pass
+            except OSError:
+                logging.error(f'Marking pool account {pool_user} as ready failed, removing it.')
+                await self._remove(pool_user)
+                return
+
+            self.ready.append(pool_user)
+
@@ -0,0 +1,224 @@
+import asyncio
+import json
+import logging
+import threading
+import time
+from typing import Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from tornado.httpclient import AsyncHTTPClient, HTTPClientError, HTTPRequest
+from urllib3.util.retry import Retry
+
+# Retry policy for both clients (connection errors and these status codes, exponential backoff).
+retries = 3
+backoff_factor = 0.5
+retry_status_codes = (502, 503, 504)
+
+
+def _headers(api_token: str) -> dict:
+    return {
+        'Content-Type': 'application/json',
+        'Accept': 'application/json',
+        'Authorization': f'token {api_token}'
+    }
+
+
+class HubClient:
+    """
+    Client for JupyterHub's REST API used by Kore.
+
+    Connections are kept alive and pooled (one requests session per client), failed requests are retried with
+    exponential backoff and users' admin state is cached for `admin_cache_ttl` seconds.
+    """
+
+    def __init__(self, api_url: str, api_token: str, admin_cache_ttl: float = 60, timeout: float = 10) -> None:
+        self.api_url = api_url.rstrip('/')
+        self.admin_cache_ttl = admin_cache_ttl
+        self.timeout = timeout
+        self._admin_cache: dict[str, tuple[bool, float]] = {}
+        self._admin_cache_lock = threading.Lock()
+
+        retry = Retry(total=retries, backoff_factor=backoff_factor, status_forcelist=retry_status_codes, allowed_methods=None,
+                      raise_on_status=False)
+        self.session = requests.Session()
+        self.session.headers.update(_headers(api_token))
+        self.session.mount('http://', HTTPAdapter(max_retries=retry, pool_connections=1, pool_maxsize=8))
+
+    def _request(self, method: str, path: str, **kwargs) -> requests.Response:
+        response = self.session.request(method, f'{self.api_url}/{path}', timeout=self.timeout, **kwargs)
+        response.raise_for_status()
+        return response
+
+    def get_user(self, username: str) -> dict:
+        """
+        Get a user's model from the hub.
+
+        Raises
+        ------
+        requests.exceptions.RequestException
+            If the request fails (also for unknown users).
+        """
+
+        return self._request('GET', f'users/{username}').json()
+
+    def is_admin(self, username: str) -> bool:
+        """
+        Admin state of a user (cached).
+
+        Raises
+        ------
+        requests.exceptions.RequestException
+            If the request fails.
+        KeyError
+            If the hub's response does not contain the admin state.
+        """
+
+        with self._admin_cache_lock:
+            admin, expires = self._admin_cache.get(username, (False, 0))
+        if expires > time.monotonic():
+            return admin
+
+        admin = bool(self.get_user(username)['admin'])
+        with self._admin_cache_lock:
+            self._admin_cache[username] = (admin, time.monotonic() + self.admin_cache_ttl)
+
+        return admin
+
+    def remove_group_members(self, group_name: str, usernames: list) -> None:
+        """
+        Remove users from a group (one request for all users).
+
+        Raises
+        ------
+        requests.exceptions.RequestException
+            If the request fails.
+        """
+
+        if usernames:
+            self._request('DELETE', f'groups/{group_name}/users', json={'users': list(usernames)})
+
+    def delete_service(self, service_name: str) -> bool:
+        """
+        Remove a service created via the REST API from the hub.
+
+        Returns
+        -------
+        bool
+            True if the service has been removed, does not exist or is a config-based service (removed by the next hub restart).
+        """
+
+        try:
+            response = self.session.delete(f'{self.api_url}/services/{service_name}', timeout=self.timeout)
+        except requests.exceptions.RequestException as e:
+            logging.warning(f'Service {service_name} could not be removed from hub: {e}')
+            return False
+
+        if response.status_code not in [200, 204, 400, 404]:
+            logging.warning(f'Service {service_name} could not be removed from hub (status {response.status_code}).')
+            return False
+
+        return True
+
+
+class AsyncHubClient:
+    """
+    Client for JupyterHub's REST API used by the post-authentication hook (on the hub's event loop).
+
+    Requests go through tornado's shared AsyncHTTPClient (JupyterHub configures the pooled curl client if pycurl is
+    available). Failed requests are retried with exponential backoff. Group memberships are added in the background,
+    all additions to the same group arriving within `batch_delay` seconds are sent as one request.
+    """
+
+    def __init__(self, api_url: str, api_token: str, batch_delay: float = 0.2, timeout: float = 10) -> None:
+        self.api_url = api_url.rstrip('/')
+        self.api_token = api_token
+        self.batch_delay = batch_delay
+        self.timeout = timeout
+        self._pending_members: dict[str, set] = {}
+        self._flush_tasks: dict[str, asyncio.Task] = {}
+
+    async def _fetch(self, method: str, path: str, body: Optional[dict] = None) -> None:
+        request = HTTPRequest(
+            url=f'{self.api_url}/{path}',
+            method=method,
+            headers=_headers(self.api_token),
+            body=json.dumps(body) if body is not None else None,
+            allow_nonstandard_methods=True,
+            request_timeout=self.timeout
+        )
+        for attempt in range(retries + 1):
+            try:
+                await AsyncHTTPClient().fetch(request)
+                return
+            except HTTPClientError as e:
+                # Code 599 is a connection error or timeout.
+                if attempt == retries or (e.code not in retry_status_codes and e.code != 599):
+                    raise
+            except OSError:
+                if attempt == retries:
+                    raise
+            await asyncio.sleep(backoff_factor * 2 ** attempt)
+
+    async def register_service(self, service: dict) -> bool:
+        """
+        Register an external service on the running hub (requires `admin:services` scope).
+
+        Parameters
+        ----------
+        service : dict
+            The service definition.
+
+        Returns
+        -------
+        bool
+            True if the service exists on the hub after the call.
+        """
+
+        try:
+            await self._fetch('POST', f'services/{service["name"]}', body=service)
+        except HTTPClientError as e:
+            if e.code != 409:
+                logging.error(f'Registering service {service["name"]} on hub failed: {e}')
+                return False
+        except OSError as e:
+            logging.error(f'Registering service {service["name"]} on hub failed: {e}')
+            return False
+
+        return True
+
+    def add_group_member(self, group_name: str, username: str) -> None:
+        """
+        Queue adding a user to a group (the user has to exist on the hub when the batch is sent).
+
+        Parameters
+        ----------
+        group_name : str
+            Name of the group.
+        username : str
+            Name of the user.
+
+        Returns
+        -------
+        None
+        """
+
+        self._pending_members.setdefault(group_name, set()).add(username)
+        if group_name not in self._flush_tasks:
+            self._flush_tasks[group_name] = asyncio.ensure_future(self._flush_members(group_name))
+
+    async def _flush_members(self, group_name: str) -> None:
+        try:
+            await asyncio.sleep(self.batch_delay)
+        finally:
+            # Additions arriving from now on start a new batch.
+            del self._flush_tasks[group_name]
+
+        usernames = sorted(self._pending_members.pop(group_name, set()))
+        try:
+            await self._fetch('POST', f'groups/{group_name}/users', body={'users': usernames})
+        except (HTTPClientError, OSError) as e:
+            logging.error(f'Adding {len(usernames)} users to group {group_name} failed: {e}')
+            return
+
+        logging.debug(f'Added {len(usernames)} users to group {group_name}.')
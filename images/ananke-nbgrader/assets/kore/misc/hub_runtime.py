@@ -0,0 +1,453 @@
+import json
+import logging
+import os
+import sqlite3
+from subprocess import run, CalledProcessError
+
+from jupyterhub import orm
+from jupyterhub import roles as hub_roles
+
+formgrader_unit_dir = '/etc/systemd/system'
+formgrader_env_dir = '/opt/kore/runtime/formgraders'
+
+
+# Service name of the formgrader serving all courses in shared formgrader mode (see misc/shared_formgrader.py).
+shared_formgrader_name = 'formgraders'
+
+# Offset of the port a socket-activated formgrader listens on (the service's port is held by systemd).
+formgrader_backend_port_offset = 10000
+
+
+def formgrader_unit_name(course_id: str) -> str:
+    return f'formgrader-{course_id}.service'
+
+
+def formgrader_proxy_name(course_id: str, unit_type: str) -> str:
+    return f'formgrader-{course_id}-proxy.{unit_type}'
+
+
+def make_formgrader_service(course_id: str, grader_user: str, port: int, api_token: str) -> dict:
+    """
+    Make the JupyterHub service definition of a course's formgrader.
+
+    The service is an external service (no `command`), so it can be registered on the running hub via the REST API.
+    The formgrader process itself is run by systemd, see start_formgrader().
+
+    Parameters
+    ----------
+    course_id : str
+        The course id, which is also the service name.
+    grader_user : str
+        The course's grader user running the formgrader.
+    port : int
+        Local port the formgrader listens on.
+    api_token : str
+        API token of the service.
+
+    Returns
+    -------
+    dict
+        The service definition as used in `c.JupyterHub.services`.
+    """
+
+    return {
+        'name': course_id,
+        'url': f'http://127.0.0.1:{port}',
+        'user': grader_user,
+        'api_token': api_token,
+        'oauth_no_confirm': True,
+        'display': False
+    }
+
+
+def make_formgrader_roles(course_ids: list) -> list:
+    """
+    Make the roles of the formgrader services (shared service role and one role per course's formgrade group).
+
+    Parameters
+    ----------
+    course_ids : list
+        Ids of all courses.
+
+    Returns
+    -------
+    list
+        Role definitions as used in `c.JupyterHub.load_roles`.
+    """
+
+    if not course_ids:
+        return []
+
+    roles = [{
+        'name': 'formgrader-service-role',
+        'scopes': ['read:users:groups', 'list:services', 'list:users', 'groups', 'admin:users', 'admin:groups'],
+        'services': list(course_ids)
+    }]
+    for course_id in course_ids:
+        roles.append({
+            'name': f'formgrader-{course_id}-role',
+            'groups': [f'formgrade-{course_id}'],
+            'scopes': [f'access:services!service={course_id}',
+                       f'list:services!service={course_id}',
+                       f'read:services!service={course_id}',
+                       'access:services!service=kore']
+        })
+
+    return roles
+
+
+def formgrader_environment(service: dict, hub_base_url: str) -> dict:
+    """
+    Compose the environment JupyterHub would pass to the formgrader if it was a managed service.
+
+    Parameters
+    ----------
+    service : dict
+        The service definition.
+    hub_base_url : str
+        The JupyterHub's base url (`c.JupyterHub.base_url`), starting and ending with `/`.
+
+    Returns
+    -------
+    dict
+        Environment variables for jupyterhub-singleuser.
+    """
+
+    name = service['name']
+    prefix = f'{hub_base_url}services/{name}/'
+    access_scopes = json.dumps([f'access:services!service={name}'])
+
+    return {
+        'PATH': '/opt/conda/envs/jhub/bin:/usr/local/sbin:/usr/local/bin:/usr/sbin:/usr/bin:/bin',
+        'SSL_CERT_DIR': '/etc/ssl/certs',
+        'JUPYTER_PREFER_ENV_PATH': '0',
+        'JUPYTERHUB_SERVICE_NAME': name,
+        'JUPYTERHUB_USER': service['user'],
+        'JUPYTERHUB_API_TOKEN': service['api_token'],
+        'JUPYTERHUB_CLIENT_ID': f'service-{name}',
+        'JUPYTERHUB_API_URL': f'http://127.0.0.1:8081{hub_base_url}hub/api',
+        'JUPYTERHUB_BASE_URL': hub_base_url,
+        'JUPYTERHUB_SERVICE_PREFIX': prefix,
+        'JUPYTERHUB_SERVICE_URL': f'{service["url"]}{prefix}',
+        'JUPYTERHUB_OAUTH_CALLBACK_URL': f'{prefix}oauth_callback',
+        'JUPYTERHUB_OAUTH_SCOPES': access_scopes,
+        'JUPYTERHUB_OAUTH_ACCESS_SCOPES': access_scopes,
+        'JUPYTERHUB_OAUTH_CLIENT_ALLOWED_SCOPES': '[]'
+    }
+
+
+def write_formgrader_unit(service: dict, hub_base_url: str, idle_timeout: int = 0) -> str:
+    """
+    Write systemd units and environment file for a course's formgrader.
+
+    With idle timeout the formgrader is started on demand: systemd listens on the service's port (socket unit),
+    the first connection starts a proxy (`systemd-socket-proxyd`), which pulls in the formgrader listening on a backend port.
+    The proxy exits after `idle_timeout` seconds without connections, which stops the formgrader, too.
+
+    Parameters
+    ----------
+    service : dict
+        The service definition.
+    hub_base_url : str
+        The JupyterHub's base url.
+    idle_timeout : int
+        Seconds without connections before the formgrader is stopped, 0 for an always running formgrader.
+
+    Returns
+    -------
+    str
+        Name of the systemd unit to enable (socket unit with idle timeout, service unit else).
+    """
+
+    name = service['name']
+    grader_user = service['user']
+    port = int(service['url'].split(':')[-1])
+    backend_port = port + formgrader_backend_port_offset
+
+    os.makedirs(formgrader_env_dir, mode=0o700, exist_ok=True)
+    env_file_path = f'{formgrader_env_dir}/{name}.env'
+    env_fd = os.open(env_file_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with open(env_fd, 'w') as env_file:
+        for key, value in formgrader_environment(service, hub_base_url).items():
+            env_file.write(f"{key}='{value}'\n")
+
+    # Access to the shared formgrader is checked per course by its server extension.
+    group_arg = '' if name == shared_formgrader_name else f' --group=formgrade-{name}'
+    exec_start = f'/opt/conda/envs/jhub/bin/jupyterhub-singleuser{group_arg} --KernelSpecManager.ensure_native_kernel=False'
+    units = {}
+    if idle_timeout > 0:
+        # Proxy starts forwarding only after the formgrader accepts connections (any HTTP response).
+        prefix = f'{hub_base_url}services/{name}/'
+        units[formgrader_unit_name(name)] = [
+            '[Unit]',
+            f'Description=nbgrader formgrader for course {name}',
+            'StopWhenUnneeded=yes',
+            '',
+            '[Service]',
+            f'User={grader_user}',
+            f'WorkingDirectory=/home/{grader_user}',
+            f'EnvironmentFile={env_file_path}',
+            f'ExecStart={exec_start} --ip=127.0.0.1 --port={backend_port}',
+            f"ExecStartPost=/bin/bash -c 'until curl --silent --output /dev/null http://127.0.0.1:{backend_port}{prefix}api; do sleep 0.1; done'",
+            'TimeoutStartSec=120',
+            'Restart=on-failure'
+        ]
+        units[formgrader_proxy_name(name, 'socket')] = [
+            '[Unit]',
+            f'Description=Socket of nbgrader formgrader for course {name}',
+            '',
+            '[Socket]',
+            f'ListenStream=127.0.0.1:{port}',
+            '',
+            '[Install]',
+            'WantedBy=sockets.target'
+        ]
+        units[formgrader_proxy_name(name, 'service')] = [
+            '[Unit]',
+            f'Description=Socket proxy of nbgrader formgrader for course {name}',
+            f'Requires={formgrader_unit_name(name)}',
+            f'After={formgrader_unit_name(name)}',
+            '',
+            '[Service]',
+            f'ExecStart=/lib/systemd/systemd-socket-proxyd --exit-idle-time={idle_timeout}s 127.0.0.1:{backend_port}'
+        ]
+        enable_name = formgrader_proxy_name(name, 'socket')
+    else:
+        units[formgrader_unit_name(name)] = [
+            '[Unit]',
+            f'Description=nbgrader formgrader for course {name}',
+            'After=jupyterhub.service',
+            '',
+            '[Service]',
+            f'User={grader_user}',
+            f'WorkingDirectory=/home/{grader_user}',
+            f'EnvironmentFile={env_file_path}',
+            f'ExecStart={exec_start}',
+            'Restart=on-failure',
+            '',
+            '[Install]',
+            'WantedBy=multi-user.target'
+        ]
+        enable_name = formgrader_unit_name(name)
+
+    for unit_name, lines in units.items():
+        with open(f'{formgrader_unit_dir}/{unit_name}', 'w') as unit_file:
+            unit_file.write('\n'.join(['# Autogenerated nbgrader formgrader unit (DO NOT MODIFY)', ''] + lines + ['']))
+
+    return enable_name
+
+
+def _remove_files(paths: list) -> None:
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def start_formgraders(services: list, hub_base_url: str, idle_timeout: int = 0) -> bool:
+    """
+    Write units for all given formgrader services and start them (or their sockets) without waiting for start-up.
+
+    Switching between always running and on-demand formgraders stops running formgraders once.
+
+    Parameters
+    ----------
+    services : list
+        Service definitions.
+    hub_base_url : str
+        The JupyterHub's base url.
+    idle_timeout : int
+        Seconds without connections before a formgrader is stopped, 0 for always running formgraders.
+
+    Returns
+    -------
+    bool
+        True if the units have been started, False if a systemctl command failed.
+
+    Raises
+    ------
+    OSError
+        If a unit file cannot be written.
+    """
+
+    if not services:
+        return True
+
+    names = [service['name'] for service in services]
+    socket_mode = idle_timeout > 0
+    switching = [name for name in names if os.path.isfile(f'{formgrader_unit_dir}/{formgrader_unit_name(name)}')
+                 and os.path.isfile(f'{formgrader_unit_dir}/{formgrader_proxy_name(name, "socket")}') != socket_mode]
+
+    unit_names = [write_formgrader_unit(service, hub_base_url, idle_timeout) for service in services]
+    try:
+        if switching:
+            # Formgraders started in the other mode hold the service's port (or are held by a socket).
+            logging.info(f'Switching {len(switching)} formgraders to {"on-demand" if socket_mode else "always running"} mode.')
+            stop_units = [formgrader_unit_name(name) for name in switching]
+            if not socket_mode:
+                stop_units += [formgrader_proxy_name(name, unit_type) for name in switching for unit_type in ['socket', 'service']]
+            run(['systemctl', 'disable', '--now'] + stop_units)
+            if not socket_mode:
+                _remove_files([f'{formgrader_unit_dir}/{formgrader_proxy_name(name, unit_type)}'
+                               for name in switching for unit_type in ['socket', 'service']])
+        run(['systemctl', 'daemon-reload'], check=True)
+        run(['systemctl', 'enable', '--now', '--no-block'] + unit_names, check=True)
+    except CalledProcessError:
+        logging.error('Command cannot be executed!')
+        return False
+
+    return True
+
+
+def remove_formgrader(course_id: str) -> None:
+    """
+    Stop a course's formgrader and remove its units and environment file.
+
+    Parameters
+    ----------
+    course_id : str
+        The course id.
+
+    Returns
+    -------
+    None
+    """
+
+    unit_names = [formgrader_proxy_name(course_id, 'socket'), formgrader_proxy_name(course_id, 'service'), formgrader_unit_name(course_id)]
+    run(['systemctl', 'disable', '--now'] + unit_names)
+    _remove_files([f'{formgrader_unit_dir}/{unit_name}' for unit_name in unit_names] + [f'{formgrader_env_dir}/{course_id}.env'])
+    run(['systemctl', 'daemon-reload'])
+
+
+def skip_on_demand_service_checks() -> None:
+    """
+    Stop JupyterHub from polling the URLs of on-demand formgraders when starting or registering services.
+
+    At start-up (and when a service is registered via the REST API) JupyterHub sends an HTTP request to each external
+    service with a URL (`JupyterHub.start_service`). With a socket unit on the service's port this request would start the
+    formgrader, so every hub start would start all formgraders. For external services the request is the only thing
+    `start_service` does, so it is skipped for services with a formgrader socket unit. The periodic checks are turned off
+    by `c.JupyterHub.service_check_interval = 0`.
+
+    The services must keep their URL: the hub derives the proxy route and the service prefix (used by nbgrader's course
+    list) from it.
+    """
+
+    from jupyterhub.app import JupyterHub
+
+    start_service = JupyterHub.start_service
+    if getattr(start_service, 'skips_on_demand_formgraders', False):
+        return
+
+    async def start_on_demand_aware(self, service_name, service, ssl_context=None):
+        if not service.managed and os.path.isfile(f'{formgrader_unit_dir}/{formgrader_proxy_name(service_name, "socket")}'):
+            self.log.info(f'Adding on-demand formgrader service {service_name} without checking its URL.')
+            return True
+        return await start_service(self, service_name, service, ssl_context)
+
+    start_on_demand_aware.skips_on_demand_formgraders = True
+    JupyterHub.start_service = start_on_demand_aware
+
+
+def to_external_service(service: dict) -> dict:
+    """
+    Convert a (possibly managed) service definition from older autogenerated files to an external one.
+    """
+
+    service = dict(service)
+    command = service.pop('command', [])
+    service.pop('cwd', None)
+    if 'user' not in service and command:
+        service['user'] = service['name'][0:32]
+
+    return service
+
+
+def runtime_service_names(db_url: str) -> set:
+    """
+    Names of services which have been created via the REST API and which are stored in the hub's database.
+
+    Config-based services with the same name would be ignored by JupyterHub (with an error message).
+
+    Parameters
+    ----------
+    db_url : str
+        The hub's database url (`c.JupyterHub.db_url`), SQLite only.
+
+    Returns
+    -------
+    set
+        Service names.
+    """
+
+    db_path = db_url.removeprefix('sqlite:///')
+    db_path = db_path if db_path.startswith('/') else f'/{db_path}'
+    if not os.path.isfile(db_path):
+        return set()
+
+    try:
+        with sqlite3.connect(f'file:{db_path}?mode=ro', uri=True) as db:
+            rows = db.execute('SELECT name FROM services WHERE from_config = 0').fetchall()
+    except sqlite3.Error:
+        logging.warning('Cannot read runtime services from hub database.')
+        return set()
+
+    return {row[0] for row in rows}
+
+
+def register_roles(db, roles: list) -> None:
+    """
+    Create roles on the running hub and assign them to the listed groups, services and users.
+
+    Parameters
+    ----------
+    db
+        The hub's database session.
+    roles : list
+        Role definitions as used in `c.JupyterHub.load_roles`.
+
+    Returns
+    -------
+    None
+    """
+
+    for role in roles:
+        hub_roles.create_role(db, {key: role[key] for key in ['name', 'description', 'scopes'] if key in role})
+        for kind, orm_class in [('groups', orm.Group), ('services', orm.Service), ('users', orm.User)]:
+            for name in role.get(kind, []):
+                entity = orm_class.find(db, name)
+                if entity is None:
+                    logging.warning(f'Cannot assign role {role["name"]} to {kind} {name}, which does not exist on hub.')
+                    continue
+                hub_roles.grant_role(db, entity, role['name'])
+
+
+def register_groups(handler, groups: dict) -> None:
+    """
+    Create groups on the running hub and add the listed users (creating hub users if necessary).
+
+    Parameters
+    ----------
+    handler
+        The hub's request handler (for database session and user lookup).
+    groups : dict
+        Group definitions as used in `c.JupyterHub.load_groups`.
+
+    Returns
+    -------
+    None
+    """
+
+    db = handler.db
+    for name, content in groups.items():
+        group = orm.Group.find(db, name)
+        if group is None:
+            logging.info(f'Creating group {name} on hub.')
+            group = orm.Group(name=name)
+            db.add(group)
+        for username in content.get('users', []):
+            user = handler.user_from_username(username)
+            if group not in user.orm_user.groups:
+                group.users.append(user.orm_user)
+    db.commit()
@@ -0,0 +1,127 @@
+import json
+import logging
+import secrets
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Callable, Iterator, Tuple
+
+from flask import Response, current_app
+from flask import request as flask_request
+
+if TYPE_CHECKING:
+    from models.registry import CourseRegistry
+
+
+class Job:
+    """
+    A long-running operation, its progress (steps with durations) is stored in the registry's job table.
+    """
+
+    def __init__(self, registry: 'CourseRegistry', job_id: str) -> None:
+        self.registry = registry
+        self.id = job_id
+        self.steps: list = []
+
+    @contextmanager
+    def step(self, name: str) -> Iterator[None]:
+        """
+        Context manager recording a step of the job.
+        """
+
+        self.steps.append({'name': name, 'duration': None})
+        self.registry.update_job(self.id, steps=self.steps)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.steps[-1]['duration'] = round(time.perf_counter() - start, 3)
+            self.registry.update_job(self.id, steps=self.steps)
+
+
+# An operation gets its job and returns the HTTP status and the response body.
+Operation = Callable[[Job], Tuple[int, dict]]
+
+
+def preferred_wait(prefer: str, default: float) -> float:
+    """
+    Seconds a client wants to wait for a job's result, as stated by its `Prefer` header (RFC 7240).
+
+    `respond-async` means not waiting at all, `wait=<seconds>` shortens the default wait.
+    """
+
+    wait = default
+    for preference in prefer.split(','):
+        name, _, value = preference.strip().partition('=')
+        if name.strip().lower() == 'respond-async':
+            return 0
+        if name.strip().lower() == 'wait':
+            try:
+                wait = min(wait, max(float(value.strip().strip('"')), 0))
+            except ValueError:
+                pass
+    return wait
+
+
+class JobQueue:
+    """
+    Runs long-running operations as jobs on a bounded pool of background threads (per Kore worker process).
+
+    The request waits for the job's result at most `wait` seconds (less if the client's `Prefer` header asks for it), so
+    requests do not run into proxy and worker timeouts. Clients get the operation's result if it finished in time,
+    otherwise the job id (status 202) and follow the job's progress via `GET /jobs/<id>`.
+    """
+
+    def __init__(self, registry: 'CourseRegistry', max_workers: int = 2, wait: float = 20) -> None:
+        self.registry = registry
+        self.wait = wait
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='kore-jobs')
+
+    def _run(self, job: Job, operation: Operation) -> Tuple[int, dict]:
+        self.registry.update_job(job.id, state='running', started=time.time())
+        try:
+            status, result = operation(job)
+        except Exception:
+            logging.exception(f'Job {job.id} failed.')
+            status, result = 500, {'message': 'JobError'}
+        self.registry.update_job(job.id, state='finished' if status < 400 else 'failed', status=status, result=result,
+                                 finished=time.time())
+        return status, result
+
+    def run(self, kind: str, username: str, operation: Operation) -> Response:
+        """
+        Run an operation as job in the background and wait for its result for a while.
+
+        Parameters
+        ----------
+        kind : str
+            Kind of the operation (e.g. `course_backup`).
+        username : str
+            User who started the operation.
+        operation : Operation
+            The operation, must not use Flask's request context.
+
+        Returns
+        -------
+        Response
+            The operation's result or, if it is still running, the job id (status 202, job's URL in `Location` header).
+        """
+
+        job = Job(registry=self.registry, job_id=secrets.token_hex(16))
+        self.registry.add_job(job_id=job.id, kind=kind, username=username)
+        logging.info(f'Job {job.id} ({kind}) started by {username}.')
+
+        future = self.executor.submit(self._run, job, operation)
+        wait = preferred_wait(flask_request.headers.get('Prefer', ''), self.wait)
+        try:
+            status, result = future.result(timeout=wait)
+            return Response(response=json.dumps(result), status=status)
+        except FutureTimeoutError:
+            pass
+
+        headers = {'Location': f'{current_app.config["PREFIX"]}jobs/{job.id}'}
+        if wait == 0:
+            headers['Preference-Applied'] = 'respond-async'
+        return Response(response=json.dumps({'message': f'Job {job.id} is running in background.', 'job': job.id}), status=202,
+                        headers=headers)
@@ -0,0 +1,207 @@
+import email.utils
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, List, Optional, Tuple
+
+import jwt
+import requests
+from requests.adapters import HTTPAdapter
+
+from misc.lti_keys import lti_keys
+
+if TYPE_CHECKING:
+    from models.registry import CourseRegistry
+
+# Status codes worth retrying (rate limit and transient server errors).
+retry_status_codes = (429, 502, 503, 504)
+backoff_factor = 0.5
+
+# Upper limit (seconds) for waiting as requested by an LMS's `Retry-After` header.
+max_retry_after = 120
+
+# Access tokens are renewed this many seconds before they expire.
+access_token_margin = 60
+
+# Access tokens (cache key > (token, expiry)), in front of the registry's cache shared by all worker processes.
+_access_tokens: dict[str, Tuple[str, float]] = {}
+
+
+def _access_token_key(access_token_url: str, client_id: str, scope: str) -> str:
+    return f'{access_token_url} {client_id} {" ".join(sorted(scope.split()))}'
+
+
+def get_access_token(registry: 'CourseRegistry', access_token_url: str, issuer: str, client_id: str, scope: str) -> str:
+    """
+    OAuth2 access token from the LMS (client credentials grant with signed client assertion). Tokens are cached per token
+    URL, client and scope set until shortly before they expire.
+
+    Parameters
+    ----------
+    registry : CourseRegistry
+        The course registry (token cache shared by all Kore workers).
+    access_token_url : str
+        The LMS's token endpoint.
+    issuer : str
+        The LMS's issuer (audience of the client assertion).
+    client_id : str
+        Kore's client id at the LMS.
+    scope : str
+        Requested scopes (space separated).
+
+    Returns
+    -------
+    str
+        The access token.
+
+    Raises
+    ------
+    requests.exceptions.RequestException
+        If requesting the token fails.
+    OSError, ValueError, KeyError
+        If Kore's keys cannot be loaded or the LMS's response is invalid.
+    """
+
+    key = _access_token_key(access_token_url, client_id, scope)
+    now = time.time()
+
+    token, expires = _access_tokens.get(key, ('', 0))
+    if expires > now:
+        return token
+
+    cached = registry.get_access_token(key)
+    if cached is not None:
+        _access_tokens[key] = cached
+        return cached[0]
+
+    private_key, kid = lti_keys.signing_key()
+    assertion = jwt.encode({'iss': client_id, 'aud': issuer, 'sub': client_id, 'iat': int(now) - 5, 'exp': int(now) + 60},
+                           private_key, algorithm='RS256', headers={'kid': kid})
+    response = requests.post(access_token_url, timeout=30, data={
+        'grant_type': 'client_credentials',
+        'client_assertion_type': 'urn:ietf:params:oauth:client-assertion-type:jwt-bearer',
+        'client_assertion': assertion,
+        'scope': scope
+    })
+    response.raise_for_status()
+    content = response.json()
+    token = content['access_token']
+    expires = now + float(content.get('expires_in', 3600)) - access_token_margin
+
+    _access_tokens[key] = (token, expires)
+    registry.set_access_token(key, token, expires)
+    return token
+
+
+def invalidate_access_token(registry: 'CourseRegistry', access_token_url: str, client_id: str, scope: str) -> None:
+    """
+    Remove an access token rejected by the LMS from the caches.
+    """
+
+    key = _access_token_key(access_token_url, client_id, scope)
+    _access_tokens.pop(key, None)
+    registry.set_access_token(key, '', 0)
+
+
+def _retry_after(response: requests.Response) -> Optional[float]:
+    """
+    Seconds to wait as requested by the `Retry-After` header (delay in seconds or HTTP date), None if not present.
+    """
+
+    value = response.headers.get('Retry-After')
+    if value is None:
+        return None
+    try:
+        delay = float(value)
+    except ValueError:
+        try:
+            delay = email.utils.parsedate_to_datetime(value).timestamp() - time.time()
+        except (TypeError, ValueError):
+            return None
+    return min(max(delay, 0), max_retry_after)
+
+
+class ScoreSender:
+    """
+    Sends scores to an LMS (LTI Assignment and Grade Services) with pooled connections and several threads.
+
+    Transient errors are retried with exponential backoff. If the LMS asks for a break (`Retry-After`), all threads wait.
+    """
+
+    def __init__(self, score_url: str, access_token: str, concurrency: int = 8, retries: int = 3, timeout: float = 30) -> None:
+        self.score_url = score_url
+        self.concurrency = concurrency
+        self.retries = retries
+        self.timeout = timeout
+        self._not_before = 0.0
+        self._lock = threading.Lock()
+
+        self.session = requests.Session()
+        self.session.headers.update({
+            'Authorization': 'Bearer ' + access_token,
+            'Accept': 'application/json',
+            'Content-Type': 'application/vnd.ims.lis.v1.score+json'
+        })
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def _wait(self) -> None:
+        with self._lock:
+            delay = self._not_before - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def _pause(self, delay: float) -> None:
+        with self._lock:
+            self._not_before = max(self._not_before, time.monotonic() + delay)
+
+    def send(self, score: dict) -> dict:
+        """
+        Send one student's score.
+
+        Returns
+        -------
+        dict
+            Report with keys `id`, `ok` and, if sending failed, `error`.
+        """
+
+        error = None
+        for attempt in range(self.retries + 1):
+            self._wait()
+            try:
+                response = self.session.post(self.score_url, json=score, timeout=self.timeout)
+            except requests.exceptions.RequestException as e:
+                error = str(e)
+                self._pause(backoff_factor * 2 ** attempt)
+                continue
+
+            if response.ok:
+                logging.debug(f'Score(s) for student with ID {score["userId"]} successfully send!')
+                return {'id': score['userId'], 'ok': True}
+
+            error = f'status {response.status_code}'
+            if response.status_code not in retry_status_codes:
+                break
+            retry_after = _retry_after(response)
+            self._pause(retry_after if retry_after is not None else backoff_factor * 2 ** attempt)
+
+        logging.error(f'Sending score for student with ID {score["userId"]} failed: {error}')
+        return {'id': score['userId'], 'ok': False, 'error': error}
+
+    def send_all(self, scores: List[dict]) -> Tuple[int, List[dict]]:
+        """
+        Send the scores of all students.
+
+        Returns
+        -------
+        tuple[int, list]
+            Number of scores sent successfully and report per student (see `send`).
+        """
+
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='kore-scores') as executor:
+            reports = list(executor.map(self.send, scores))
+        self.session.close()
+
+        return sum(report['ok'] for report in reports), reports
@@ -0,0 +1,82 @@
+import hashlib
+import json
+import os
+import threading
+from typing import Any, Optional, Tuple
+
+from cryptography.hazmat.primitives.serialization import load_pem_private_key
+
+
+class LTIKeys:
+    """
+    Kore's LTI key pair (private key for signing, public key as JWK), loaded once per process and reloaded if the key
+    files change (key rotation).
+    """
+
+    def __init__(self, key_dir: str = 'keys', key_name: str = 'lti_key') -> None:
+        self.private_key_path = f'{key_dir}/{key_name}'
+        self.public_key_path = f'{key_dir}/{key_name}.json'
+        self._state: Optional[tuple] = None
+        # Private key, key id, JWKS and its ETag, replaced as a whole on reload.
+        self._keys: Tuple[Any, str, str, str] = (None, '', '', '')
+        self._lock = threading.Lock()
+
+    def _load(self) -> Tuple[Any, str, str, str]:
+        """
+        Reload the keys if the key files changed.
+
+        Returns
+        -------
+        Tuple[Any, str, str, str]
+            Private key, key id, JWKS and its ETag (all from the same key files).
+
+        Raises
+        ------
+        OSError
+            If a key file cannot be read.
+        ValueError
+            If a key file cannot be parsed.
+        """
+
+        state = tuple(os.stat(path).st_mtime_ns for path in [self.private_key_path, self.public_key_path])
+
+        with self._lock:
+            if state != self._state:
+                with open(file=self.private_key_path, mode='rb') as private_key:
+                    private_key = load_pem_private_key(private_key.read(), password=None)
+                with open(file=self.public_key_path, mode='r') as public_key:
+                    jwk = json.load(public_key)
+                jwks = json.dumps({'keys': [jwk]})
+                self._keys = (private_key, jwk['kid'], jwks, hashlib.sha256(jwks.encode()).hexdigest()[0:32])
+                self._state = state
+            return self._keys
+
+    def signing_key(self) -> Tuple[Any, str]:
+        """
+        Private key (for `jwt.encode`) and its key id.
+
+        Raises
+        ------
+        OSError, ValueError, KeyError
+            If the keys cannot be loaded.
+        """
+
+        private_key, kid, _, _ = self._load()
+        return private_key, kid
+
+    def jwks(self) -> Tuple[str, str]:
+        """
+        JSON Web Key Set containing Kore's public key and its ETag.
+
+        Raises
+        ------
+        OSError, ValueError, KeyError
+            If the keys cannot be loaded.
+        """
+
+        _, _, jwks, etag = self._load()
+        return jwks, etag
+
+
+# Shared by all requests of a Kore worker process.
+lti_keys = LTIKeys()
@@ -0,0 +1,120 @@
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from subprocess import CalledProcessError
+from typing import Any, Awaitable, Callable, Optional
+
+
+class Provisioner:
+    """
+    Runs provisioning steps of the post-authentication hook without blocking the hub's event loop.
+
+    Commands run as asyncio subprocesses, blocking Python code (file access, Gradebook) runs in a bounded thread pool.
+    At most `concurrency` steps run at the same time (over all logins) and each step gets a timeout.
+    """
+
+    def __init__(self, concurrency: int = 4, step_timeout: float = 60) -> None:
+        self.concurrency = concurrency
+        self.step_timeout = step_timeout
+        self.executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='kore-provisioning')
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._in_flight: dict[str, asyncio.Task] = {}
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        # Created lazily, because the hub's event loop is not running while loading the config.
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self._semaphore
+
+    async def run(self, args: list[str], timeout: Optional[float] = None) -> None:
+        """
+        Run a command as asyncio subprocess.
+
+        Parameters
+        ----------
+        args : list[str]
+            The command and its arguments.
+        timeout : float, optional
+            Timeout in seconds, defaults to `step_timeout`.
+
+        Returns
+        -------
+        None
+
+        Raises
+        ------
+        CalledProcessError
+            If the command returns a non-zero exit code or does not finish in time (the process gets killed then).
+        """
+
+        timeout = timeout or self.step_timeout
+        async with self.semaphore:
+            proc = await asyncio.create_subprocess_exec(*args)
+            try:
+                returncode = await asyncio.wait_for(proc.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                logging.error(f'Command {args} did not finish within {timeout} seconds.')
+                proc.kill()
+                returncode = await proc.wait()
+
+        if returncode != 0:
+            raise CalledProcessError(returncode, args)
+
+    async def run_blocking(self, func: Callable, *args, timeout: Optional[float] = None, **kwargs) -> Any:
+        """
+        Run blocking Python code in the provisioning thread pool.
+
+        Parameters
+        ----------
+        func : Callable
+            The function to call.
+        timeout : float, optional
+            Timeout in seconds, defaults to `step_timeout`. The thread cannot be stopped, but the caller does not wait any longer.
+
+        Returns
+        -------
+        Any
+            The function's return value.
+
+        Raises
+        ------
+        TimeoutError
+            If the function does not return in time.
+        """
+
+        timeout = timeout or self.step_timeout
+        loop = asyncio.get_running_loop()
+        async with self.semaphore:
+            return await asyncio.wait_for(loop.run_in_executor(self.executor, partial(func, *args, **kwargs)), timeout=timeout)
+
+    async def single_flight(self, key: str, func: Callable[[], Awaitable]) -> Any:
+        """
+        Run a coroutine function at most once at a time per key.
+
+        Callers arriving while a run for the same key is in flight wait for that run and get its result.
+
+        Parameters
+        ----------
+        key : str
+            Key identifying the work (e.g. the course id).
+        func : Callable[[], Awaitable]
+            Coroutine function doing the work.
+
+        Returns
+        -------
+        Any
+            The coroutine's return value.
+        """
+
+        task = self._in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        else:
+            logging.debug(f'Waiting for provisioning of {key} already in progress.')
+
+        # Shielded, so a cancelled caller does not cancel the run other callers wait for.
+        return await asyncio.shield(task)
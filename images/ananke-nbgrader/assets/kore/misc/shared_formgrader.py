@@ -0,0 +1,134 @@
+import json
+import logging
+import os
+import pwd
+import shutil
+from subprocess import run, CalledProcessError
+
+from ananke_extension_config import set_server_extensions, user_config_dir
+
+from misc.hub_runtime import make_formgrader_service, shared_formgrader_name
+
+# Shared formgrader mode: one formgrader server (hub service) for all courses, see `kore_shared_formgrader` extension.
+shared_formgrader_port = 8099
+
+# Marker file in course directories accessible by the shared formgrader.
+shared_marker = '.kore_shared'
+
+
+def make_shared_formgrader_service(api_token: str) -> dict:
+    """
+    Make the JupyterHub service definition of the shared formgrader.
+    """
+
+    return make_formgrader_service(course_id=shared_formgrader_name, grader_user=shared_formgrader_name,
+                                   port=shared_formgrader_port, api_token=api_token)
+
+
+def make_shared_formgrader_roles(course_ids: list) -> list:
+    """
+    Make the roles of the shared formgrader (group lookups for authorization, access for all formgrade groups).
+
+    Parameters
+    ----------
+    course_ids : list
+        Ids of all courses.
+
+    Returns
+    -------
+    list
+        Role definitions as used in `c.JupyterHub.load_roles`.
+    """
+
+    return [
+        {
+            'name': 'formgraders-service-role',
+            'scopes': ['read:users:groups', 'list:users'],
+            'services': [shared_formgrader_name]
+        },
+        {
+            'name': 'formgraders-access-role',
+            'scopes': [f'access:services!service={shared_formgrader_name}'],
+            'groups': [f'formgrade-{course_id}' for course_id in course_ids]
+        }
+    ]
+
+
+def prepare_shared_formgrader() -> None:
+    """
+    Create the shared formgrader's account (if missing) and enable its server extension.
+    """
+
+    home = f'/home/{shared_formgrader_name}'
+    try:
+        pwd.getpwnam(shared_formgrader_name)
+    except KeyError:
+        try:
+            run(['useradd', '--create-home', '--shell=/usr/sbin/nologin', shared_formgrader_name], check=True)
+            run(['usermod', '-L', shared_formgrader_name], check=True)
+        except CalledProcessError:
+            logging.error('Command cannot be executed!')
+            return
+
+    entry = pwd.getpwnam(shared_formgrader_name)
+    set_server_extensions(config_dir=user_config_dir(home), owner=(entry.pw_uid, entry.pw_gid), states={
+        'kore_shared_formgrader': True,
+        'nbgrader.server_extensions.formgrader': False,
+        'nbgrader.server_extensions.assignment_list': False,
+        'nbgrader.server_extensions.validate_assignment': False
+    })
+
+
+def share_course(grader_user: str) -> None:
+    """
+    Give the shared formgrader access to a course (ACLs on the course directory, also for files created later).
+    Course directories which already have been shared are skipped.
+
+    Parameters
+    ----------
+    grader_user : str
+        The course's grader user.
+
+    Returns
+    -------
+    None
+    """
+
+    home = f'/home/{grader_user}'
+    if os.path.isfile(f'{home}/course_data/{shared_marker}'):
+        return
+
+    user = shared_formgrader_name
+    try:
+        run(['setfacl', '-m', f'u:{user}:x', home, f'{home}/.jupyter'], check=True)
+        run(['setfacl', '-m', f'u:{user}:r', f'{home}/.jupyter/nbgrader_config.py'], check=True)
+        run(['setfacl', '-R', '-m', f'u:{user}:rwX,d:u:{user}:rwX,d:u:{grader_user}:rwX', f'{home}/course_data'], check=True)
+        with open(f'{home}/course_data/{shared_marker}', 'w'):
+            pass
+    except (CalledProcessError, OSError):
+        logging.error(f'Sharing course directory of {grader_user} with shared formgrader failed.')
+
+
+def write_shared_courses(courses: list) -> None:
+    """
+    Write the courses served by the shared formgrader (course id > grader user) to its home directory.
+
+    Parameters
+    ----------
+    courses : list
+        Courses as returned by the registry.
+
+    Returns
+    -------
+    None
+    """
+
+    path = f'/home/{shared_formgrader_name}/.kore_courses.json'
+    try:
+        with open(f'{path}.tmp', 'w') as f:
+            json.dump({course['id']: course['grader_user'] for course in courses}, f)
+        shutil.chown(f'{path}.tmp', user=shared_formgrader_name, group=shared_formgrader_name)
+        os.chmod(f'{path}.tmp', 0o600)
+        os.replace(f'{path}.tmp', path)
+    except (LookupError, OSError):
+        logging.error('Writing course list of shared formgrader failed.')
@@ -1,21 +1,30 @@
-import fcntl
-import grp
+import ast
+import copy
 import hashlib
 import json
 import logging
 import os
+import sqlite3
+import tempfile
 from pathlib import Path
 from subprocess import run, CalledProcessError
-from typing import List, Optional, Tuple
+from typing import TYPE_CHECKING, List, Optional, Tuple
 
 from flask import Response
 from flask import request as flask_request
+from requests.exceptions import RequestException
 from werkzeug.exceptions import BadRequestKeyError
 
 from exceptions import AutogeneratedFileError, InfoFileError, CleanUpError, ConfigFileError, UniqueNamesError, ActivePathsError
+from misc.backup_store import list_backups
+from misc.content_index import content_index
 from models.enums import Subset, Content
 from nbgrader.api import Gradebook
 
+if TYPE_CHECKING:
+    from misc.hub_client import HubClient
+    from models.registry import CourseRegistry
+
 
 def load_json(path: str) -> dict:
     """
@@ -43,14 +52,36 @@ def load_config(path: str) -> dict:
         raise ConfigFileError
 
 
-def load_info(path: str) -> dict:
+def load_info(registry: 'CourseRegistry', path: str) -> dict:
+    """
+    Load course info (id, titles, grader user, LTI data) of the course stored at the given path from the course registry
+    (cached until the registry changes).
+
+    Parameters
+    ----------
+    registry : CourseRegistry
+        The course registry.
+    path : str
+        Path of the course directory (`/home/GRADER_USER/course_data`) or of a file or directory within.
+
+    Returns
+    -------
+    dict
+        The course info.
+    """
+
+    parts = Path(path).parts
     try:
-        return load_json(path=path)
-    except (FileNotFoundError, OSError, PermissionError):
+        info = registry.get_course_by_grader(parts[2]) if len(parts) > 2 and parts[1] == 'home' else None
+    except sqlite3.Error:
         raise InfoFileError
+    if info is None:
+        raise InfoFileError
+
+    return info
 
 
-def handle_clean_up(path: str, kore_token: str, base_url: str, course_id: str):
+def handle_clean_up(path: str, hub_client: 'HubClient', course_id: str):
     try:
         # Remove students from gradebook.
         with Gradebook(f'sqlite:///{path}/gradebook.db') as gb:
@@ -59,13 +90,7 @@ def handle_clean_up(path: str, kore_token: str, base_url: str, course_id: str):
                 gb.remove_student(username)
 
         # Remove students from courses nbgrader group.
-        run(['systemd-run', 'curl',
-             '-H', 'Content-Type: application/json',
-             '-H', 'Accept: application/json',
-             '-H', f'Authorization: token {kore_token}',
-             '-X', 'DELETE',
-             '-d', '{"users":' + json.dumps(usernames) + '}',
-             f'http://127.0.0.1:8081/{base_url}hub/api/groups/nbgrader-{course_id}/users'], check=True)
+        hub_client.remove_group_members(group_name=f'nbgrader-{course_id}', usernames=usernames)
 
         # Clean up the nbgrader exchange directory.
         run(['rm', '-rf', f'/opt/nbgrader_exchange/{course_id}/'], check=True)
@@ -74,7 +99,7 @@ def handle_clean_up(path: str, kore_token: str, base_url: str, course_id: str):
         run(['rm', f'{path}/gradebook.db'], check=True)
         for directory in ['autograded', 'feedback', 'release', 'submitted']:
             run(['rm', '-rf', f'{path}/{directory}/'], check=True)
-    except (FileNotFoundError, PermissionError, KeyError, CalledProcessError):
+    except (FileNotFoundError, PermissionError, KeyError, CalledProcessError, RequestException):
         raise CleanUpError
 
 
@@ -116,9 +141,50 @@ def make_course_id(lti_state: dict) -> Tuple[str, str, str, str]:
     return course_id, course_title_long, course_title_short, grader_user
 
 
+def atomic_write(path: str, content: str, mode: int = 0o600) -> None:
+    """
+    Write a file via a temporary file in the same directory, which replaces the file atomically.
+    """
+
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as file:
+            file.write(content)
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+# Parsed autogenerated configuration files (path > ((mtime, size), config)).
+_autogenerated_configs: dict[str, Tuple[tuple, dict]] = {}
+
+
+def _parse_legacy_autogenerated_config(config_code: str) -> dict:
+    """
+    Parse an autogenerated configuration file in the former format (Python code) without executing it.
+    """
+
+    config = {'services': [], 'roles': [], 'groups': {}}
+    for node in ast.parse(config_code).body:
+        if not (isinstance(node, ast.Expr) and isinstance(node.value, ast.Call) and len(node.value.args) == 1):
+            continue
+        target = ast.unparse(node.value.func)
+        if target == 'c.JupyterHub.services.append':
+            config['services'].append(ast.literal_eval(node.value.args[0]))
+        elif target == 'c.JupyterHub.load_roles.append':
+            config['roles'].append(ast.literal_eval(node.value.args[0]))
+        elif target == 'c.JupyterHub.load_groups.update':
+            config['groups'].update(ast.literal_eval(node.value.args[0]))
+
+    return config
+
+
 def read_autogenerated_config(autogenerated_file_path: str) -> Tuple[list, list, dict]:
     """
-    Read services, roles and groups from the autogenerated configuration file.
+    Read services, roles and groups from the autogenerated configuration file (JSON, files in the former Python format
+    are parsed without executing them). The parsed file is cached until it changes.
 
     Parameters
     ----------
@@ -129,45 +195,40 @@ def read_autogenerated_config(autogenerated_file_path: str) -> Tuple[list, list,
     -------
     tuple[list, list, dict]
          The returned tuple contains the services (list), the roles (list) and the groups (dict).
+         All empty if there is no such file.
     """
 
     try:
-        with open(file=autogenerated_file_path, mode='r') as autogenerated_file:
-            # Read Python code from config file.
-            logging.debug('Reading autogenerated service configuration.')
-            config_code = autogenerated_file.read()
+        stat = os.stat(autogenerated_file_path)
     except FileNotFoundError:
-        # File is not present and a new one will be created.
-        logging.debug('No autogenerated service file found! A new one will be created.')
-        write_autogenerated_config(autogenerated_file_path=autogenerated_file_path, services=[], roles=[], groups={})
-        config_code = ''
-    except PermissionError:
-        logging.debug('Autogenerated services files not readable!')
-        run(['chmod', '600', autogenerated_file_path], check=True)
-        with open(file=autogenerated_file_path, mode='r') as autogenerated_file:
-            logging.debug('Reading autogenerated service configuration.')
-            config_code = autogenerated_file.read()
-    except CalledProcessError:
-        logging.error('Command cannot be executed!')
-        raise AutogeneratedFileError
+        logging.debug('No autogenerated service file found!')
+        return [], [], {}
 
-    # Modify Python code.
-    logging.debug('Extracting services, roles and groups from file.')
-    config_code = config_code.replace('c = get_config()', '')
-    config_code = config_code.replace('c.JupyterHub.services', 'services')
-    config_code = config_code.replace('c.JupyterHub.load_roles', 'roles')
-    config_code = config_code.replace('c.JupyterHub.load_groups', 'groups')
-
-    # Execute Python code.
-    services, roles, groups = [], [], {}
-    exec(config_code)
-
-    return services, roles, groups
+    state = (stat.st_mtime_ns, stat.st_size)
+    cached = _autogenerated_configs.get(autogenerated_file_path)
+    if cached is None or cached[0] != state:
+        logging.debug('Reading autogenerated service configuration.')
+        try:
+            with open(file=autogenerated_file_path, mode='r') as autogenerated_file:
+                config_code = autogenerated_file.read()
+            try:
+                config = json.loads(config_code)
+            except json.JSONDecodeError:
+                config = _parse_legacy_autogenerated_config(config_code)
+        except (OSError, ValueError, SyntaxError):
+            logging.error('Error while reading autogenerated configuration file.')
+            raise AutogeneratedFileError
+        cached = (state, config)
+        _autogenerated_configs[autogenerated_file_path] = cached
+
+    config = copy.deepcopy(cached[1])
+    return config.get('services', []), config.get('roles', []), config.get('groups', {})
 
 
 def write_autogenerated_config(autogenerated_file_path: str, services: list, roles: list, groups: dict) -> None:
     """
-    Write services, roles and groups to a Python file. Which is read and used by the JupyterHub after next restart.
+    Write services, roles and groups to a JSON file. The file is replaced atomically, so readers never see a partially
+    written file.
 
     Parameters
     ----------
@@ -190,62 +251,15 @@ def write_autogenerated_config(autogenerated_file_path: str, services: list, rol
 
     logging.debug('Writing autogenerated service configuration.')
 
-    # Compose code to be written.
-    config_code = '# Autogenerated nbgrader course configuration (DO NOT MODIFY)\n\n'
-    config_code += 'c = get_config()\n\n'
-
-    config_code += '# Services\n'
-    for service in services:
-        config_code += 'c.JupyterHub.services.append(' + str(service) + ')\n'
-    config_code += '\n'
-
-    config_code += '# Roles\n'
-    for role in roles:
-        config_code += 'c.JupyterHub.load_roles.append(' + str(role) + ')\n'
-    config_code += '\n'
-
-    config_code += '# Groups\n'
-    config_code += 'c.JupyterHub.load_groups.update(' + str(groups) + ')\n'
-
-    # Write code to file.
     try:
-        with open(file=autogenerated_file_path, mode='w') as autogenerated_file:
-            fcntl.flock(autogenerated_file, fcntl.LOCK_EX)
-            autogenerated_file.write(config_code)
-            fcntl.flock(autogenerated_file, fcntl.LOCK_UN)
-        run(['chmod', '600', autogenerated_file_path], check=True)
-    except CalledProcessError:
-        logging.error('Command cannot be executed!')
+        config_code = json.dumps({'services': services, 'roles': roles, 'groups': groups}, indent=2)
+        atomic_write(path=autogenerated_file_path, content=config_code)
+    except (TypeError, ValueError, OSError):
+        logging.error('Error while writing autogenerated configuration file.')
         raise AutogeneratedFileError
-    except PermissionError:
-        logging.debug('Autogenerated services files not readable!')
 
 
-def get_hub_base_url(lti_state: dict) -> str:
-    """
-    Read base url of JupyterHub from lti state json.
-
-    Parameters
-    ----------
-    lti_state : dict
-        lti state file (json) containing lti parameters.
-
-    Returns
-    -------
-    str
-        The base url of the JupyterHub as string.
-    """
-
-    base_url = lti_state['https://purl.imsglobal.org/spec/lti/claim/target_link_uri']
-    base_url = '/'.join(base_url.strip('/').split('://')[-1].split('/')[1:]) + '/'
-    logging.debug(f'Base url of JupyterHub as retrieved from the LTI state file: {base_url}.')
-
-    base_url = '' if base_url == '/' else base_url
-
-    return base_url
-
-
-def get_active_paths(user_name: str, groups: dict, content: Content, subset: Subset) -> List[str]:
+def get_active_paths(user_name: str, registry: 'CourseRegistry', content: Content, subset: Subset) -> List[str]:
     """
     Retrieves active paths based on the content type within specified base paths.
 
@@ -253,8 +267,8 @@ def get_active_paths(user_name: str, groups: dict, content: Content, subset: Sub
     ----------
     user_name : str
         The current users user_name.
-    groups : dict
-        The groups of the user.
+    registry : CourseRegistry
+        The course registry (courses the user is instructor of).
     content : Content
         The type of content to search for. Must be an instance of the `Content` enum.
         Valid values are:
@@ -273,45 +287,25 @@ def get_active_paths(user_name: str, groups: dict, content: Content, subset: Sub
 
     # Generating the Subset.ACTIVE course list.
     if subset == Subset.ALL or subset == Subset.ACTIVE:
-        owned_groups = [
-            group.lstrip('formgrade-')
-            for group in groups
-            if user_name in groups.get(group)
-        ]
         base_paths = [
-            item.path.removesuffix('/')
-            for item in os.scandir('/home')
-            if item.is_dir() and grp.getgrgid(os.stat(item.path).st_gid)[0] in owned_groups
+            f'/home/{course["grader_user"]}'
+            for course in registry.get_instructor_courses(username=user_name)
         ]
-        logging.debug(f'Owned groups: {owned_groups}')
         logging.debug(f'Base paths: {base_paths}')
 
         active_paths = []
 
         for base_path in base_paths:
-            paths = []
-
             if content == Content.COURSES:
-                specific_path = Path(f'{base_path}/course_data/')
-                if specific_path.exists():
-                    paths = [specific_path / '']
+                if os.path.isdir(f'{base_path}/course_data'):
+                    active_paths.append(f'{base_path}/course_data')
             elif content == Content.ASSIGNMENTS:
-                specific_path = Path(f'{base_path}/course_data/source/')
-                if specific_path.exists():
-                    paths = specific_path.glob('*/')
+                active_paths.extend(content_index.subdirectories(f'{base_path}/course_data/source'))
             elif content == Content.PROBLEMS:
-                specific_path = Path(f'{base_path}/course_data/source/')
-                if specific_path.exists():
-                    paths = specific_path.rglob('*.ipynb')
+                active_paths.extend(content_index.files(f'{base_path}/course_data/source', suffix='.ipynb'))
             else:
                 raise ValueError(f"Invalid content type: {content}")
 
-            active_paths.extend(
-                str(path) for path in paths
-                if path.is_dir() or (content == Content.PROBLEMS and path.is_file())
-                and not any(part.name.startswith('.') for part in path.parents)
-            )
-
         return sorted(active_paths)
 
     # Generate the list with path of current course.
@@ -350,29 +344,34 @@ def get_backed_up_paths(user_name: str, content: Content) -> List[str]:
         that are hidden (i.e., starting with a dot) or are within hidden parent directories.
     """
 
-    base_dir = Path(f'/var/lib/private/{user_name}')
+    base_dir = f'/var/lib/private/{user_name}'
+    backups = list_backups(user_name)
 
+    # Backups from the backup store and backups made by former versions (plain copies of the course directory).
     if content == Content.COURSES:
-        backed_up_paths = [
-            str(path).removesuffix('/')
-            for path in base_dir.glob('*/')
-            if path.is_dir() and not any(part.name.startswith('.') for part in path.parents) and not path.name.startswith('.')
-        ]
+        backed_up_paths = content_index.subdirectories(base_dir) + [path for path, _ in backups]
     elif content == Content.ASSIGNMENTS:
         backed_up_paths = [
-            str(assignment_path)
-            for source_path in base_dir.glob('*/source/')
-            if source_path.is_dir()
-            for assignment_path in source_path.glob('*/')
-            if assignment_path.is_dir() and not assignment_path.name.startswith('.')
+            assignment_path
+            for course_path in content_index.subdirectories(base_dir)
+            for assignment_path in content_index.subdirectories(f'{course_path}/source')
+        ] + [
+            f'{path}/{entry["path"]}'
+            for path, manifest in backups
+            for entry in manifest['entries']
+            if entry['type'] == 'dir' and len(parts := entry['path'].split('/')) == 2 and parts[0] == 'source' and not parts[1].startswith('.')
         ]
     elif content == Content.PROBLEMS:
         backed_up_paths = [
-            str(problem_path)
-            for source_path in base_dir.glob('*/source/')
-            if source_path.is_dir()
-            for problem_path in source_path.rglob('*.ipynb')
-            if problem_path.is_file() and not any(part.name.startswith('.') for part in problem_path.parents)
+            problem_path
+            for course_path in content_index.subdirectories(base_dir)
+            for problem_path in content_index.files(f'{course_path}/source', suffix='.ipynb')
+        ] + [
+            f'{path}/{entry["path"]}'
+            for path, manifest in backups
+            for entry in manifest['entries']
+            if entry['type'] == 'file' and entry['path'].startswith('source/') and entry['path'].endswith('.ipynb')
+            and not any(part.startswith('.') for part in entry['path'].split('/')[0:-1])
         ]
     else:
         raise ValueError(f'Invalid content type: {content}. Must be `Content.COURSES`, `Content.ASSIGNMENTS`, or `Content.PROBLEMS`.')
@@ -380,15 +379,56 @@ def get_backed_up_paths(user_name: str, content: Content) -> List[str]:
     return sorted(backed_up_paths)
 
 
-def get_list(autogenerated_file_path: str, content: Content, subset: Subset = Subset.ALL) -> Response:
+def paginate(names: List[str], paths: List[str], limit: Optional[int] = None, cursor: int = 0, query: Optional[str] = None) -> Tuple[List[str], List[str], Optional[int]]:
+    """
+    Filter and paginate a listing (names and paths in the same order).
+
+    Parameters
+    ----------
+    names : List[str]
+        Names of the entries.
+    paths : List[str]
+        Paths of the entries.
+    limit : Optional[int], optional
+        Maximum number of entries to return. Default is None (all entries).
+    cursor : int, optional
+        Position in the (filtered) listing to start at, as returned by the previous page. Default is 0.
+    query : Optional[str], optional
+        Only entries with names containing `query` (case-insensitive) are returned, names starting with `query` first.
+        Default is None (all entries).
+
+    Returns
+    -------
+    Tuple[List[str], List[str], Optional[int]]
+        Names and paths of the page and the cursor of the next page (None if there are no more entries).
+    """
+
+    entries = list(zip(names, paths))
+    if query:
+        query = query.lower()
+        entries = [entry for entry in entries if entry[0].lower().startswith(query)] \
+            + [entry for entry in entries if query in entry[0].lower() and not entry[0].lower().startswith(query)]
+
+    stop = len(entries) if limit is None else min(cursor + limit, len(entries))
+    page = entries[cursor:stop]
+    next_cursor = stop if stop < len(entries) else None
+
+    return [name for name, _ in page], [path for _, path in page], next_cursor
+
+
+def get_list(registry: 'CourseRegistry', content: Content, subset: Subset = Subset.ALL) -> Response:
     """
     Retrieves and returns a list of active or all content (courses, assignments, or problems)
     for a given user, with appropriate error handling.
 
+    The list can be searched and paginated with the query parameters `q` (substring of names), `limit` (maximum number
+    of entries) and `cursor` (`next_cursor` of the previous response). Ordering is stable: active content first, then
+    backed-up content, each sorted by path.
+
     Parameters
     ----------
-    autogenerated_file_path : str
-        The path to the autogenerated configuration file containing user group information.
+    registry : CourseRegistry
+        The course registry containing the courses and their groups.
     content : Content
         The type of content to be retrieved. Can be `Content.COURSES`, `Content.ASSIGNMENTS`, or `Content.PROBLEMS`.
     subset : Subset, optional
@@ -400,7 +440,7 @@ def get_list(autogenerated_file_path: str, content: Content, subset: Subset = Su
     Response
         A Flask `Response` object containing a JSON-formatted message with either the list of content
         paths and names or an error message. The status code of the response indicates success (200)
-        or failure (500).
+        or failure (400, 500).
     """
 
     try:
@@ -408,15 +448,19 @@ def get_list(autogenerated_file_path: str, content: Content, subset: Subset = Su
     except BadRequestKeyError:
         return Response(response=json.dumps({'message': 'BadRequestKeyError'}), status=500)
 
-    # Access list of 'owned' groups, this is necessary to copy assignments stored at '/home/FORMGRADER_USER' and verifying access rights.
     try:
-        _, _, groups = read_autogenerated_config(autogenerated_file_path=autogenerated_file_path)
-    except AutogeneratedFileError:
-        return Response(response=json.dumps({'message': 'AutogeneratedFileError'}), status=500)
-
+        limit = int(flask_request.args['limit']) if 'limit' in flask_request.args else None
+        cursor = int(flask_request.args.get('cursor', 0))
+        if (limit is not None and limit < 1) or cursor < 0:
+            raise ValueError
+    except ValueError:
+        return Response(response=json.dumps({'message': 'InvalidPaginationError'}), status=400)
+    query = flask_request.args.get('q')
+
+    # Courses of the user are looked up in the registry, this is necessary to copy assignments stored at '/home/FORMGRADER_USER' and verifying access rights.
     try:
-        active_paths = get_active_paths(user_name=user_name, groups=groups, content=content, subset=subset)
-    except ActivePathsError:
+        active_paths = get_active_paths(user_name=user_name, registry=registry, content=content, subset=subset)
+    except (ActivePathsError, sqlite3.Error):
         return Response(response=json.dumps({'message': 'ActivePathsError'}), status=500)
 
     # Exit early if there are no active courses.
@@ -424,39 +468,30 @@ def get_list(autogenerated_file_path: str, content: Content, subset: Subset = Su
         return Response(response=json.dumps({'message': 'NoActiveCoursesFoundError'}), status=500)
 
     if subset == Subset.ACTIVE or subset == Subset.CURRENT:
-        try:
-            unique_names = generate_unique_names(content=content, active_paths=active_paths)
-        except UniqueNamesError:
-            return Response(response=json.dumps({'message': 'UniqueNamesError'}), status=500)
-
-        content_list = {
-            'message': f'List of {content.value} successfully retrieved.',
-            'names': unique_names,
-            'paths': active_paths
-        }
-
-        return Response(response=json.dumps(content_list), status=200)
-
-    if subset == Subset.ALL:
+        backed_up_paths = []
+    else:
         backed_up_paths = get_backed_up_paths(user_name=user_name, content=content)
 
-        # Generate names to display in the dropdown menu of the kore extension.
-        try:
-            unique_names = generate_unique_names(content=content, active_paths=active_paths, backed_up_paths=backed_up_paths)
-        except UniqueNamesError:
-            return Response(response=json.dumps({'message': 'UniqueNamesError'}), status=500)
+    # Generate names to display in the dropdown menu of the kore extension.
+    try:
+        unique_names = generate_unique_names(registry=registry, content=content, active_paths=active_paths, backed_up_paths=backed_up_paths)
+    except UniqueNamesError:
+        return Response(response=json.dumps({'message': 'UniqueNamesError'}), status=500)
 
-        content_list = {
-            'message': f'List of {content.value} successfully retrieved.',
-            'names': unique_names,
-            'paths': active_paths + backed_up_paths,
-        }
-        logging.info(f'Generated {content.value} list: {content_list}')
+    names, paths, next_cursor = paginate(names=unique_names, paths=active_paths + backed_up_paths, limit=limit, cursor=cursor, query=query)
+    content_list = {
+        'message': f'List of {content.value} successfully retrieved.',
+        'names': names,
+        'paths': paths,
+        'next_cursor': next_cursor
+    }
+    logging.debug(f'Generated {content.value} list with {len(paths)} of {len(unique_names)} entries.')
 
-        return Response(response=json.dumps(content_list), status=200)
+    # One page only, so the body is sent in one piece (streaming iterencode's tokens would cost one write per token).
+    return Response(response=json.dumps(content_list), status=200)
 
 
-def generate_unique_names(content: Content, active_paths: List[str], backed_up_paths: Optional[List[str]] = None) -> List[str]:
+def generate_unique_names(registry: 'CourseRegistry', content: Content, active_paths: List[str], backed_up_paths: Optional[List[str]] = None) -> List[str]:
     """
     Generates a list of unique names for the provided content based on active and backed-up paths.
 
@@ -465,6 +500,8 @@ def generate_unique_names(content: Content, active_paths: List[str], backed_up_p
 
     Parameters
     ----------
+    registry : CourseRegistry
+        The course registry (course titles).
     content : Content
         The type of content to generate names for. Can be `Content.COURSES`, `Content.ASSIGNMENTS`, or `Content.PROBLEMS`.
     active_paths : List[str]
@@ -480,13 +517,15 @@ def generate_unique_names(content: Content, active_paths: List[str], backed_up_p
         are ensured to be unique, with duplicates being distinguished by appending counts.
     """
 
+    # Course titles by course directory (many active paths belong to the same course).
+    titles = {}
     active_names = []
     for active_path in active_paths:
-        user_name = active_path.split('/')[2]
-        info_file_path = f'/home/{user_name}/course_data/info.json'
         try:
-            info = load_info(info_file_path)
-            title_short = info['title_short']
+            course_path = '/'.join(active_path.split('/')[0:4])
+            if course_path not in titles:
+                titles[course_path] = load_info(registry=registry, path=active_path)['title_short']
+            title_short = titles[course_path]
             if content == Content.COURSES:
                 active_names.append(title_short)
             elif content == Content.ASSIGNMENTS:
@@ -495,7 +534,7 @@ def generate_unique_names(content: Content, active_paths: List[str], backed_up_p
                 active_names.append(f"{active_path.removesuffix('.ipynb').split('/')[-1]} ({title_short}, {active_path.removesuffix('/').split('/')[-2]})")
             else:
                 raise ValueError(f'Invalid content type: {content}. Must be `Content.COURSES`, `Content.ASSIGNMENTS`, or `Content.PROBLEMS`.')
-        except (FileNotFoundError, PermissionError, CalledProcessError, OSError):
+        except (KeyError, InfoFileError):
             raise UniqueNamesError
 
     backed_up_names = []
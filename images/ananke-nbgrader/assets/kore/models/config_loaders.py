@@ -19,7 +19,22 @@ class KoreConfigLoader:
         self.instructors_database_path: str = '/opt/kore/runtime/instructors.json'
         self.nbgrader_config_path: str = '/opt/conda/envs/jhub/etc/jupyter/nbgrader_config.py'
         self.date_time_format: str = '%y%m%d_%H%M%S'
-        self.autogenerated_file_path: str = '/opt/kore/runtime/autogenerated_services.py'
+        self.autogenerated_file_path: str = '/opt/kore/runtime/autogenerated_services.json'
+        self.registry_path: str = '/opt/kore/runtime/registry.sqlite'
+        self.provisioning_concurrency: int = 4
+        self.provisioning_step_timeout: float = 60
+        self.grader_pool_size: int = 2
+        self.formgrader_idle_timeout: int = 1800
+        self.shared_formgrader: bool = False
+        self.kore_workers: int = 2
+        # Threads per Kore worker. Each client following a job's progress as server-sent events occupies a thread
+        # (for at most `stream_max_duration` seconds, see routes/jobs_route.py).
+        self.kore_threads: int = 4
+        self.session_dir: str = '/opt/kore/runtime/sessions'
+        self.kore_job_workers: int = 2
+        self.kore_job_wait: float = 20
+        self.lms_concurrency: int = 8
+        self.lms_retries: int = 3
 
     @classmethod
     def get_error_messages(cls) -> dict:
@@ -39,6 +54,19 @@ class KoreConfigLoader:
             self.nbgrader_config_path = config['nbgrader_config_path']
             self.date_time_format = config['date_time_format']
             self.autogenerated_file_path = config['autogenerated_file_path']
+            self.registry_path = config.get('registry_path', self.registry_path)
+            self.provisioning_concurrency = config.get('provisioning_concurrency', self.provisioning_concurrency)
+            self.provisioning_step_timeout = config.get('provisioning_step_timeout', self.provisioning_step_timeout)
+            self.grader_pool_size = config.get('grader_pool_size', self.grader_pool_size)
+            self.formgrader_idle_timeout = config.get('formgrader_idle_timeout', self.formgrader_idle_timeout)
+            self.shared_formgrader = config.get('shared_formgrader', self.shared_formgrader)
+            self.kore_workers = config.get('kore_workers', self.kore_workers)
+            self.kore_threads = config.get('kore_threads', self.kore_threads)
+            self.session_dir = config.get('session_dir', self.session_dir)
+            self.kore_job_workers = config.get('kore_job_workers', self.kore_job_workers)
+            self.kore_job_wait = config.get('kore_job_wait', self.kore_job_wait)
+            self.lms_concurrency = config.get('lms_concurrency', self.lms_concurrency)
+            self.lms_retries = config.get('lms_retries', self.lms_retries)
         except tuple(self.error_messages.keys()):
             logging.error('Error while reading or parsing the Kore configuration file. Default values will be used.')
 
@@ -0,0 +1,515 @@
+import json
+import logging
+import os
+import secrets
+import sqlite3
+import time
+from contextlib import contextmanager
+from typing import Iterator, List, Optional, Tuple
+
+from misc.hub_runtime import make_formgrader_roles, make_formgrader_service
+from misc.utils import atomic_write, read_autogenerated_config, write_autogenerated_config
+
+# Columns of the courses table, which are exposed as course info (formerly `info.json`).
+info_keys = ['id', 'title', 'title_short', 'grader_user', 'target_link_uri', 'aud', 'lineitem']
+
+schema = '''
+CREATE TABLE IF NOT EXISTS courses (
+    id TEXT PRIMARY KEY,
+    title TEXT NOT NULL,
+    title_short TEXT NOT NULL,
+    grader_user TEXT NOT NULL UNIQUE,
+    target_link_uri TEXT NOT NULL DEFAULT '',
+    aud TEXT,
+    lineitem TEXT,
+    port INTEGER NOT NULL UNIQUE,
+    api_token TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS instructors (
+    username TEXT PRIMARY KEY
+);
+CREATE TABLE IF NOT EXISTS group_members (
+    group_name TEXT NOT NULL,
+    username TEXT NOT NULL,
+    PRIMARY KEY (group_name, username)
+);
+CREATE INDEX IF NOT EXISTS group_members_username ON group_members (username);
+CREATE TABLE IF NOT EXISTS accounts (
+    username TEXT PRIMARY KEY,
+    uid INTEGER NOT NULL,
+    gid INTEGER NOT NULL,
+    home TEXT NOT NULL,
+    state TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    username TEXT NOT NULL,
+    state TEXT NOT NULL,
+    steps TEXT NOT NULL DEFAULT '[]',
+    status INTEGER,
+    result TEXT,
+    created REAL NOT NULL,
+    started REAL,
+    finished REAL
+);
+CREATE TABLE IF NOT EXISTS grade_sync (
+    course_id TEXT NOT NULL,
+    lineitem TEXT NOT NULL,
+    student_id TEXT NOT NULL,
+    score REAL,
+    max_score REAL,
+    synced REAL NOT NULL,
+    PRIMARY KEY (course_id, lineitem, student_id)
+);
+CREATE TABLE IF NOT EXISTS access_tokens (
+    key TEXT PRIMARY KEY,
+    token TEXT NOT NULL,
+    expires REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+'''
+
+
+class CourseRegistry:
+    """
+    Transactional registry of nbgrader courses, instructors and course groups (SQLite in WAL mode).
+
+    The registry is the only source of truth for course data. The autogenerated hub configuration file and the course titles
+    in the global `nbgrader_config.py` are generated from it whenever a transaction changes something.
+    """
+
+    def __init__(self, path: str, autogenerated_file_path: str, nbgrader_config_path: str) -> None:
+        self.path = path
+        self.autogenerated_file_path = autogenerated_file_path
+        self.nbgrader_config_path = nbgrader_config_path
+        self._courses_cache: Optional[Tuple[tuple, dict]] = None
+
+        with self._connect() as db:
+            db.execute('PRAGMA journal_mode=WAL')
+            db.executescript(schema)
+        os.chmod(self.path, 0o600)
+
+    def _connect(self) -> sqlite3.Connection:
+        db = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+        db.row_factory = sqlite3.Row
+        return db
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        """
+        Open a write transaction. If the transaction changes something, the generation counter is incremented
+        and the hub configuration and course titles are regenerated before the transaction commits.
+
+        Yields
+        ------
+        sqlite3.Connection
+            Database connection within the transaction.
+        """
+
+        db = self._connect()
+        try:
+            db.execute('BEGIN IMMEDIATE')
+            changes = db.total_changes
+            try:
+                yield db
+                if db.total_changes > changes:
+                    db.execute('INSERT INTO meta (key, value) VALUES (\'generation\', \'1\') '
+                               'ON CONFLICT (key) DO UPDATE SET value = CAST(value AS INTEGER) + 1')
+                    self._export(db)
+                db.execute('COMMIT')
+            except BaseException:
+                db.execute('ROLLBACK')
+                raise
+        finally:
+            db.close()
+
+    def _query(self, sql: str, params: tuple = ()) -> List[sqlite3.Row]:
+        db = self._connect()
+        try:
+            return db.execute(sql, params).fetchall()
+        finally:
+            db.close()
+
+    def generation(self) -> int:
+        """
+        Counter incremented by each transaction changing the registry.
+        """
+
+        rows = self._query('SELECT value FROM meta WHERE key = \'generation\'')
+        return int(rows[0]['value']) if rows else 0
+
+    def get_secret(self, key: str) -> str:
+        """
+        Random token stored in the registry under the given key (created on first use).
+        """
+
+        db = self._connect()
+        try:
+            db.execute('INSERT OR IGNORE INTO meta (key, value) VALUES (?, ?)', (f'secret:{key}', secrets.token_hex(32)))
+            return db.execute('SELECT value FROM meta WHERE key = ?', (f'secret:{key}',)).fetchone()['value']
+        finally:
+            db.close()
+
+    # Courses
+
+    def get_course(self, course_id: str) -> Optional[dict]:
+        rows = self._query('SELECT * FROM courses WHERE id = ?', (course_id,))
+        return dict(rows[0]) if rows else None
+
+    def _file_state(self) -> tuple:
+        # Each write changes the database file or its write-ahead log.
+        state = []
+        for path in [self.path, f'{self.path}-wal']:
+            try:
+                stat = os.stat(path)
+                state.append((stat.st_mtime_ns, stat.st_size))
+            except FileNotFoundError:
+                state.append(None)
+        return tuple(state)
+
+    def get_courses_by_grader(self) -> dict:
+        """
+        All courses by grader user, cached per process until the registry's files change.
+
+        Returned course dicts are shared by all callers and must not be modified.
+        """
+
+        state = self._file_state()
+        cached = self._courses_cache
+        if cached is None or cached[0] != state:
+            # State is taken before reading, so a concurrent write invalidates the cache again.
+            cached = (state, {course['grader_user']: course for course in self.get_courses()})
+            self._courses_cache = cached
+
+        return cached[1]
+
+    def get_course_by_grader(self, grader_user: str) -> Optional[dict]:
+        course = self.get_courses_by_grader().get(grader_user)
+        return dict(course) if course is not None else None
+
+    def get_courses(self) -> List[dict]:
+        return [dict(row) for row in self._query('SELECT * FROM courses ORDER BY port')]
+
+    def get_instructor_courses(self, username: str) -> List[dict]:
+        """
+        Courses the user is member of the course's formgrade group.
+        """
+
+        rows = self._query('SELECT courses.* FROM group_members JOIN courses ON group_members.group_name = \'formgrade-\' || courses.id '
+                           'WHERE group_members.username = ? ORDER BY courses.grader_user', (username,))
+        return [dict(row) for row in rows]
+
+    def add_course(self, info: dict) -> bool:
+        """
+        Add a course (with formgrader port, API token and course groups) or update its titles and LTI data.
+
+        Parameters
+        ----------
+        info : dict
+            Course info with keys `id`, `title`, `title_short`, `grader_user`, `target_link_uri`, `aud`, `lineitem`.
+
+        Returns
+        -------
+        bool
+            True if the course is new, False otherwise.
+        """
+
+        with self.transaction() as db:
+            if db.execute('SELECT 1 FROM courses WHERE id = ?', (info['id'],)).fetchone():
+                db.execute('UPDATE courses SET title = ?, title_short = ? WHERE id = ? AND (title != ? OR title_short != ?)',
+                           (info['title'], info['title_short'], info['id'], info['title'], info['title_short']))
+                return False
+
+            port = db.execute('SELECT COALESCE(MAX(port) + 1, 8100) FROM courses').fetchone()[0]
+            db.execute('INSERT INTO courses (id, title, title_short, grader_user, target_link_uri, aud, lineitem, port, api_token) '
+                       'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                       tuple(info.get(key) for key in info_keys) + (port, secrets.token_hex(32)))
+            db.executemany('INSERT OR IGNORE INTO group_members (group_name, username) VALUES (?, ?)',
+                           [(f'formgrade-{info["id"]}', info['grader_user']), (f'nbgrader-{info["id"]}', info['grader_user'])])
+            return True
+
+    def delete_course(self, course_id: str) -> None:
+        with self.transaction() as db:
+            db.execute('DELETE FROM courses WHERE id = ?', (course_id,))
+            db.execute('DELETE FROM group_members WHERE group_name IN (?, ?)', (f'formgrade-{course_id}', f'nbgrader-{course_id}'))
+            db.execute('DELETE FROM grade_sync WHERE course_id = ?', (course_id,))
+
+    # Instructors
+
+    def is_instructor(self, username: str) -> bool:
+        return bool(self._query('SELECT 1 FROM instructors WHERE username = ?', (username,)))
+
+    def add_instructor(self, username: str) -> bool:
+        with self.transaction() as db:
+            return db.execute('INSERT OR IGNORE INTO instructors (username) VALUES (?)', (username,)).rowcount > 0
+
+    # Groups
+
+    @staticmethod
+    def _read_groups(db: sqlite3.Connection) -> dict:
+        groups = {}
+        for row in db.execute('SELECT group_name, username FROM group_members ORDER BY group_name, rowid'):
+            groups.setdefault(row['group_name'], {'users': []})['users'].append(row['username'])
+        return groups
+
+    def get_groups(self) -> dict:
+        db = self._connect()
+        try:
+            return self._read_groups(db)
+        finally:
+            db.close()
+
+    def get_groups_of(self, username: str) -> List[str]:
+        return [row['group_name'] for row in self._query('SELECT group_name FROM group_members WHERE username = ?', (username,))]
+
+    def add_group_members(self, group_name: str, usernames: List[str]) -> List[str]:
+        """
+        Add users to a group.
+
+        Returns
+        -------
+        List[str]
+            The users which have not been members before.
+        """
+
+        added = []
+        with self.transaction() as db:
+            for username in usernames:
+                if db.execute('INSERT OR IGNORE INTO group_members (group_name, username) VALUES (?, ?)', (group_name, username)).rowcount > 0:
+                    added.append(username)
+        return added
+
+    # Accounts (manifest of system accounts owning directories in /home, not part of the hub configuration)
+
+    def get_accounts(self) -> dict:
+        """
+        Expected accounts, mapping usernames to dicts with keys `uid`, `gid`, `home` and `state`.
+        """
+
+        return {row['username']: dict(row) for row in self._query('SELECT * FROM accounts')}
+
+    def set_accounts(self, accounts: dict) -> None:
+        """
+        Store (insert or replace) expected accounts, see get_accounts(). Does not regenerate the hub configuration.
+        """
+
+        if not accounts:
+            return
+
+        db = self._connect()
+        try:
+            db.execute('BEGIN IMMEDIATE')
+            try:
+                db.executemany('INSERT OR REPLACE INTO accounts (username, uid, gid, home, state) VALUES (?, ?, ?, ?, ?)',
+                               [(username, a['uid'], a['gid'], a['home'], a['state']) for username, a in accounts.items()])
+                db.execute('COMMIT')
+            except sqlite3.Error:
+                db.execute('ROLLBACK')
+                raise
+        finally:
+            db.close()
+
+    # Jobs (long-running Kore operations, not part of the hub configuration)
+
+    def _write(self, sql: str, params: tuple = ()) -> None:
+        db = self._connect()
+        try:
+            db.execute(sql, params)
+        finally:
+            db.close()
+
+    def add_job(self, job_id: str, kind: str, username: str) -> None:
+        self._write('INSERT INTO jobs (id, kind, username, state, created) VALUES (?, ?, ?, \'queued\', ?)',
+                    (job_id, kind, username, time.time()))
+
+    def update_job(self, job_id: str, **fields) -> None:
+        """
+        Update columns of a job (`steps` and `result` are stored as JSON).
+        """
+
+        fields = {key: json.dumps(value) if key in ['steps', 'result'] else value for key, value in fields.items()}
+        self._write(f'UPDATE jobs SET {", ".join(f"{key} = ?" for key in fields)} WHERE id = ?', (*fields.values(), job_id))
+
+    def get_job(self, job_id: str) -> Optional[dict]:
+        rows = self._query('SELECT * FROM jobs WHERE id = ?', (job_id,))
+        if not rows:
+            return None
+        job = dict(rows[0])
+        job['steps'] = json.loads(job['steps'])
+        job['result'] = json.loads(job['result']) if job['result'] is not None else None
+        return job
+
+    def recover_jobs(self, max_age: float = 7 * 24 * 3600) -> None:
+        """
+        Mark jobs interrupted by a restart of Kore as failed and remove jobs older than `max_age` seconds.
+        """
+
+        now = time.time()
+        self._write('UPDATE jobs SET state = \'failed\', status = 500, result = ?, finished = ? WHERE state IN (\'queued\', \'running\')',
+                    (json.dumps({'message': 'JobInterruptedError'}), now))
+        self._write('DELETE FROM jobs WHERE created < ?', (now - max_age,))
+
+    # Grade sync ledger (scores last sent to the LMS, not part of the hub configuration)
+
+    def get_synced_scores(self, course_id: str, lineitem: str) -> dict:
+        """
+        Scores last sent to the LMS for a course's line item, mapping LMS user ids to tuples (score, max score).
+        """
+
+        rows = self._query('SELECT student_id, score, max_score FROM grade_sync WHERE course_id = ? AND lineitem = ?', (course_id, lineitem))
+        return {row['student_id']: (row['score'], row['max_score']) for row in rows}
+
+    def set_synced_scores(self, course_id: str, lineitem: str, scores: List[Tuple[str, float, float]]) -> None:
+        """
+        Record scores sent to the LMS (tuples of LMS user id, score and max score).
+        """
+
+        if not scores:
+            return
+
+        now = time.time()
+        db = self._connect()
+        try:
+            db.execute('BEGIN IMMEDIATE')
+            try:
+                db.executemany('INSERT OR REPLACE INTO grade_sync (course_id, lineitem, student_id, score, max_score, synced) VALUES (?, ?, ?, ?, ?, ?)',
+                               [(course_id, lineitem, student_id, score, max_score, now) for student_id, score, max_score in scores])
+                db.execute('COMMIT')
+            except sqlite3.Error:
+                db.execute('ROLLBACK')
+                raise
+        finally:
+            db.close()
+
+    # LMS access tokens (shared by all Kore workers)
+
+    def get_access_token(self, key: str) -> Optional[Tuple[str, float]]:
+        """
+        Cached access token and its expiry time, None if there is no unexpired token.
+        """
+
+        rows = self._query('SELECT token, expires FROM access_tokens WHERE key = ? AND expires > ?', (key, time.time()))
+        return (rows[0]['token'], rows[0]['expires']) if rows else None
+
+    def set_access_token(self, key: str, token: str, expires: float) -> None:
+        self._write('INSERT OR REPLACE INTO access_tokens (key, token, expires) VALUES (?, ?, ?)', (key, token, expires))
+
+    # Generated configuration
+
+    @staticmethod
+    def _make_service(course: dict) -> dict:
+        return make_formgrader_service(course_id=course['id'], grader_user=course['grader_user'], port=course['port'], api_token=course['api_token'])
+
+    def get_hub_config(self) -> Tuple[list, list, dict]:
+        """
+        Services, roles and groups of all courses for the JupyterHub configuration.
+        """
+
+        courses = self.get_courses()
+        return [self._make_service(course) for course in courses], make_formgrader_roles([course['id'] for course in courses]), self.get_groups()
+
+    def get_course_hub_config(self, course_id: str) -> Tuple[dict, list, dict]:
+        """
+        Service, roles and groups of one course for registering it on the running hub.
+        """
+
+        course = self.get_course(course_id)
+        groups = {name: content for name, content in self.get_groups().items() if name in [f'formgrade-{course_id}', f'nbgrader-{course_id}']}
+        return self._make_service(course), make_formgrader_roles([course_id]), groups
+
+    def export(self) -> None:
+        """
+        Regenerate the autogenerated hub configuration file and the course titles in the global `nbgrader_config.py`.
+        Necessary at hub start, because a new container comes with the image's `nbgrader_config.py` (no course titles).
+        """
+
+        db = self._connect()
+        try:
+            self._export(db)
+        finally:
+            db.close()
+
+    def _export(self, db: sqlite3.Connection) -> None:
+        """
+        Regenerate the autogenerated hub configuration file and the course titles in the global `nbgrader_config.py`
+        from the (uncommitted) state of the given transaction.
+        """
+
+        courses = [dict(row) for row in db.execute('SELECT * FROM courses ORDER BY port')]
+        groups = self._read_groups(db)
+        write_autogenerated_config(autogenerated_file_path=self.autogenerated_file_path,
+                                   services=[self._make_service(course) for course in courses],
+                                   roles=make_formgrader_roles([course['id'] for course in courses]),
+                                   groups=groups)
+
+        course_titles = {course['id']: course['title'] for course in courses}
+        try:
+            with open(file=self.nbgrader_config_path, mode='r') as nbgrader_config_file:
+                lines = nbgrader_config_file.read().split('\n')
+            new_lines = [f'c.NbGrader.course_titles = {repr(course_titles)}' if line.startswith('c.NbGrader.course_titles') else line for line in lines]
+            if new_lines == lines:
+                return
+            atomic_write(path=self.nbgrader_config_path, content='\n'.join(new_lines), mode=0o644)
+        except (FileNotFoundError, PermissionError, OSError):
+            logging.error('Error while accessing nbgrader configuration file.')
+
+    # Migration
+
+    def migrate(self, instructors_database_path: str) -> None:
+        """
+        Import courses, groups and instructors from the files used before the registry existed
+        (autogenerated configuration file, `info.json` files, instructors list). Runs only once.
+
+        Parameters
+        ----------
+        instructors_database_path : str
+            Path to the former instructors list (JSON).
+
+        Returns
+        -------
+        None
+        """
+
+        if self._query('SELECT 1 FROM meta WHERE key = \'migrated\''):
+            return
+
+        logging.info('Migrating course data to course registry.')
+
+        # Former versions wrote the autogenerated configuration as Python code.
+        autogenerated_file_path = self.autogenerated_file_path
+        if not os.path.isfile(autogenerated_file_path):
+            autogenerated_file_path = f'{os.path.splitext(autogenerated_file_path)[0]}.py'
+        services, _, groups = read_autogenerated_config(autogenerated_file_path=autogenerated_file_path)
+
+        instructors = []
+        try:
+            with open(file=instructors_database_path, mode='r') as instructors_database:
+                instructors = json.load(instructors_database)
+        except (FileNotFoundError, PermissionError, OSError, json.JSONDecodeError):
+            logging.warning('No instructors list to migrate.')
+
+        with self.transaction() as db:
+            for service in services:
+                course_id = service['name']
+                grader_user = service.get('user', course_id[0:32])
+                info = {'id': course_id, 'title': course_id, 'title_short': course_id, 'grader_user': grader_user, 'target_link_uri': ''}
+                try:
+                    with open(f'/home/{grader_user}/course_data/info.json', mode='r') as info_file:
+                        info.update(json.load(info_file))
+                except (FileNotFoundError, PermissionError, OSError, json.JSONDecodeError):
+                    logging.warning(f'No info file for course {course_id}.')
+
+                db.execute('INSERT OR IGNORE INTO courses (id, title, title_short, grader_user, target_link_uri, aud, lineitem, port, api_token) '
+                           'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                           tuple(info.get(key) for key in info_keys) + (int(service['url'].split(':')[-1]), service['api_token']))
+
+            for group_name, group in groups.items():
+                users = group.get('users', []) if isinstance(group, dict) else group
+                db.executemany('INSERT OR IGNORE INTO group_members (group_name, username) VALUES (?, ?)', [(group_name, user) for user in users])
+
+            db.executemany('INSERT OR IGNORE INTO instructors (username) VALUES (?)', [(username,) for username in instructors])
+            db.execute('INSERT INTO meta (key, value) VALUES (\'migrated\', \'1\')')
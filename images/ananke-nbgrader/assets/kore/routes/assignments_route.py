@@ -1,12 +1,14 @@
 import json
 import logging
+import os
 import time
-from subprocess import run, CalledProcessError
 
 from flask import Blueprint, Response, current_app
 from flask import request as flask_request
 
-from exceptions import InfoFileError
+from exceptions import CopyError, InfoFileError
+from misc.backup_store import copy_content
+from misc.copy_engine import make_dirs
 from misc.utils import get_list, load_info
 from models.enums import Content
 
@@ -17,13 +19,13 @@ assignments_bp = Blueprint('assignments', __name__)
 def assignments():
     config_loader = current_app.config['CONFIG_LOADER']
 
-    autogenerated_file_path = config_loader.autogenerated_file_path
+    registry = current_app.config['REGISTRY']
     date_time_format = config_loader.date_time_format
 
     # Retrieve full assignment list (active and backed up ones).
     if flask_request.method == 'GET':
         try:
-            return get_list(autogenerated_file_path=autogenerated_file_path, content=Content.ASSIGNMENTS)
+            return get_list(registry=registry, content=Content.ASSIGNMENTS)
         except ValueError:
             return Response(response=json.dumps({'message': 'ValueError'}), status=500)
 
@@ -36,23 +38,19 @@ def assignments():
             logging.error('Request key is not in form!')
             return Response(response=json.dumps({'message': 'KeyError'}), status=500)
 
-        # Read `info.json` file.
+        # Read course info from registry.
         try:
-            info = load_info(f'{dst}/info.json')
+            info = load_info(registry=registry, path=dst)
             grader_user = info['grader_user']
         except (KeyError, InfoFileError):
             return Response(response=json.dumps({'message': 'InfoFileError'}), status=500)
 
         dst = f'{dst}/source/'
         try:
-            tmp = f'{src}_{time.strftime(date_time_format)}'
-            run(['cp', '-r', src, tmp], check=True)
-            run(['mkdir', '-p', dst], check=True)
-            run(['mv', tmp, dst], check=True)
-            run(['chown', '-R', f'{grader_user}:{grader_user}', dst], check=True)
-        except CalledProcessError:
-            logging.error('Command cannot be executed!')
-            return Response(response=json.dumps({'message': 'CalledProcessError'}), status=500)
+            make_dirs(dst, owner=grader_user)
+            copy_content(src, f'{dst}{os.path.basename(src)}_{time.strftime(date_time_format)}', owner=grader_user)
+        except CopyError:
+            return Response(response=json.dumps({'message': 'CopyError'}), status=500)
 
         return Response(response=json.dumps({'message': 'Selected assignment copied successfully! \n'
                                                         'Please refresh the webpage (Formgrader) to see the imported assignment.'}), status=200)
@@ -1,14 +1,21 @@
 import json
 import logging
+import os
+import sqlite3
 import time
-from pathlib import Path
 from subprocess import run, CalledProcessError
+from typing import Tuple
 
 from flask import Response, Blueprint, current_app
 from flask import request as flask_request
 
-from exceptions import AutogeneratedFileError, InfoFileError, CleanUpError
-from misc.utils import read_autogenerated_config, write_autogenerated_config, get_list, load_info, handle_clean_up
+from exceptions import BackupError, CopyError, InfoFileError, CleanUpError
+from misc.backup_store import copy_content, create_backup, subdirectories
+from misc.copy_engine import make_dirs
+from misc.hub_runtime import remove_formgrader
+from misc.jobs import Job
+from misc.shared_formgrader import write_shared_courses
+from misc.utils import get_list, load_info, handle_clean_up
 from models.enums import Subset, Content
 
 courses_bp = Blueprint('courses', __name__)
@@ -19,24 +26,22 @@ courses_bp = Blueprint('courses', __name__)
 # - current: Listing the current course. Meaning the one the user accessed JupyterHub from.
 @courses_bp.route('/courses/active', methods=['GET'])
 def active_courses():
-    config_loader = current_app.config['CONFIG_LOADER']
-    autogenerated_file_path = config_loader.autogenerated_file_path
+    registry = current_app.config['REGISTRY']
 
     if flask_request.method == 'GET':
         try:
-            return get_list(autogenerated_file_path=autogenerated_file_path, content=Content.COURSES, subset=Subset.ACTIVE)
+            return get_list(registry=registry, content=Content.COURSES, subset=Subset.ACTIVE)
         except ValueError:
             return Response(response=json.dumps({'message': 'ValueError'}), status=500)
 
 
 @courses_bp.route('/courses/current', methods=['GET'])
 def current_courses():
-    config_loader = current_app.config['CONFIG_LOADER']
-    autogenerated_file_path = config_loader.autogenerated_file_path
+    registry = current_app.config['REGISTRY']
 
     if flask_request.method == 'GET':
         try:
-            return get_list(autogenerated_file_path=autogenerated_file_path, content=Content.COURSES, subset=Subset.CURRENT)
+            return get_list(registry=registry, content=Content.COURSES, subset=Subset.CURRENT)
         except ValueError:
             return Response(response=json.dumps({'message': 'ValueError'}), status=500)
 
@@ -45,15 +50,16 @@ def current_courses():
 def courses():
     config_loader = current_app.config['CONFIG_LOADER']
 
-    autogenerated_file_path = config_loader.autogenerated_file_path
+    registry = current_app.config['REGISTRY']
     date_time_format = config_loader.date_time_format
 
-    kore_token = current_app.config['KORE_TOKEN']
+    hub_client = current_app.config['HUB_CLIENT']
+    job_queue = current_app.config['JOB_QUEUE']
 
     # Retrieve full course list (active and backed up ones).
     if flask_request.method == 'GET':
         try:
-            return get_list(autogenerated_file_path=autogenerated_file_path, content=Content.COURSES)
+            return get_list(registry=registry, content=Content.COURSES)
         except ValueError:
             return Response(response=json.dumps({'message': 'ValueError'}), status=500)
 
@@ -62,39 +68,35 @@ def courses():
         try:
             user_name = flask_request.json['user']
             src = flask_request.json['fromPath'].removesuffix('/')
-            src = Path(f'{src}/source/')
             dst = flask_request.json['toPath'].removesuffix('/')
         except KeyError:
             return Response(response=json.dumps({'message': 'KeyError'}), status=500)
 
-        logging.info(f'User {user_name} is importing a course from {src} to {dst}/source/.')
+        logging.info(f'User {user_name} is importing a course from {src}/source/ to {dst}/source/.')
 
-        # Read `info.json` file.
+        # Read course info from registry.
         try:
-            info = load_info(f'{dst}/info.json')
+            info = load_info(registry=registry, path=dst)
             grader_user = info['grader_user']
         except (KeyError, InfoFileError):
             return Response(response=json.dumps({'message': 'InfoFileError'}), status=500)
 
-        assignments = [
-            assignment for assignment in src.iterdir()
-            if assignment.is_dir() and not assignment.name.startswith('.')
-        ] if src.is_dir() else []
+        def copy_course(job: Job) -> Tuple[int, dict]:
+            # Source directory of the course on disk or in a backup.
+            assignments = subdirectories(f'{src}/source')
 
-        dst = f'{dst}/source/'
-        for assignment in assignments:
             try:
-                tmp = f'{assignment}_{time.strftime(date_time_format)}'
-                run(['cp', '-r', assignment, tmp], check=True)
-                run(['mkdir', '-p', dst], check=True)
-                if Path(tmp).parent != Path(dst):
-                    run(['mv', tmp, dst], check=True)
-                run(['chown', '-R', f'{grader_user}:{grader_user}', dst], check=True)
-            except CalledProcessError:
-                return Response(response=json.dumps({'message': 'CalledProcessError'}), status=500)
+                make_dirs(f'{dst}/source/', owner=grader_user)
+                for assignment in assignments:
+                    with job.step(f'copy {os.path.basename(assignment)}'):
+                        copy_content(assignment, f'{dst}/source/{os.path.basename(assignment)}_{time.strftime(date_time_format)}', owner=grader_user)
+            except CopyError:
+                return 500, {'message': 'CopyError'}
 
-        return Response(response=json.dumps({'message': 'Selected course copied successfully! \n'
-                                                        'Please refresh the webpage (Formgrader) to see the imported course.'}), status=200)
+            return 200, {'message': 'Selected course copied successfully! \n'
+                                    'Please refresh the webpage (Formgrader) to see the imported course.'}
+
+        return job_queue.run(kind='course_copy', username=user_name, operation=copy_course)
 
     # Backup a course.
     if flask_request.method == 'PUT':
@@ -108,16 +110,17 @@ def courses():
         logging.info(f'User {user_name} is backing up course from {src}.')
 
         actual_date_time = time.strftime(date_time_format)
-        dst = f'/var/lib/private/{user_name}/{name}_{actual_date_time}/'
 
-        try:
-            run(['cp', '-r', src, dst], check=True)
-            run(['rm', f'{dst}info.json'], check=True)
-            run(['chown', '-R', f'{user_name}:{user_name}', dst], check=True)
-        except CalledProcessError:
-            return Response(response=json.dumps({'message': 'CalledProcessError'}), status=500)
+        def backup_course(job: Job) -> Tuple[int, dict]:
+            try:
+                with job.step('backup'):
+                    create_backup(user_name=user_name, src=src, name=f'{name}_{actual_date_time}', exclude=['info.json'])
+            except BackupError:
+                return 500, {'message': 'BackupError'}
 
-        return Response(response=json.dumps({'message': 'Selected course backed up successfully!'}), status=200)
+            return 200, {'message': 'Selected course backed up successfully!'}
+
+        return job_queue.run(kind='course_backup', username=user_name, operation=backup_course)
 
     # Reset a course.
     if flask_request.method == 'PATCH':
@@ -129,21 +132,24 @@ def courses():
 
         logging.info(f'User {user_name} is resetting course at {path}.')
 
-        # Read `info.json` file.
+        # Read course info from registry.
         try:
-            info = load_info(f'{path}/info.json')
+            info = load_info(registry=registry, path=path)
             course_id = info['id']
-            base_url = info['target_link_uri']
         except (KeyError, InfoFileError):
             return Response(response=json.dumps({'message': 'InfoFileError'}), status=500)
 
         # Clean up gradebook, course directories and files.
-        try:
-            handle_clean_up(path=path, kore_token=kore_token, base_url=base_url, course_id=course_id)
-        except CleanUpError:
-            return Response(response=json.dumps({'message': 'CleanUpError'}), status=500)
+        def reset_course(job: Job) -> Tuple[int, dict]:
+            try:
+                with job.step('clean_up'):
+                    handle_clean_up(path=path, hub_client=hub_client, course_id=course_id)
+            except CleanUpError:
+                return 500, {'message': 'CleanUpError'}
 
-        return Response(response=json.dumps({'message': 'Selected course reset successfully!'}), status=200)
+            return 200, {'message': 'Selected course reset successfully!'}
+
+        return job_queue.run(kind='course_reset', username=user_name, operation=reset_course)
 
     # Delete a course.
     if flask_request.method == 'DELETE':
@@ -155,82 +161,48 @@ def courses():
 
         logging.info(f'User {user_name} is deleting course at {path}.')
 
-        # Read `info.json` file.
+        # Read course info from registry.
         try:
-            info = load_info(f'{path}/info.json')
+            info = load_info(registry=registry, path=path)
             course_id = info['id']
             grader_user = info['grader_user']
         except (KeyError, InfoFileError):
             return Response(response=json.dumps({'message': 'InfoFileError'}), status=500)
 
-        # Get user's courses and corresponding information.
-        try:
-            services, roles, groups = read_autogenerated_config(autogenerated_file_path=autogenerated_file_path)
-        except AutogeneratedFileError:
-            return Response(response=json.dumps({'message': 'AutogeneratedFileError'}), status=500)
-
-        # Access group and delete it from groups list.
-        group = groups.get(f'formgrade-{course_id}')
-        if not group:
-            return Response(response=json.dumps({'message': 'GroupNotFoundError'}), status=500)
-
-        del groups[f'formgrade-{course_id}']
-
-        # Delete roles from roles lists.
-        for role in roles:
-            if role.get('name') == f'formgrader-{course_id}-role':
-                del roles[roles.index(role)]
-            if role.get('name') == 'formgrader-service-role':
-                del role['services'][role['services'].index(course_id)]
-
-        # Delete services from services list.
-        for service in services:
-            if service['name'] == course_id:
-                del services[services.index(service)]
-                break
-
-        # Write resulting configuration file.
-        try:
-            write_autogenerated_config(autogenerated_file_path=autogenerated_file_path, services=services, roles=roles, groups=groups)
-        except AutogeneratedFileError:
-            return Response(response=json.dumps({'message': 'AutogeneratedFileError'}), status=500)
+        def delete_course(job: Job) -> Tuple[int, dict]:
+            # Remove course (service, roles and groups) from registry, which regenerates the hub configuration and course titles.
+            try:
+                with job.step('registry'):
+                    registry.delete_course(course_id=course_id)
+            except sqlite3.Error:
+                return 500, {'message': 'RegistryError'}
+
+            # Stop formgrader and remove runtime-created service from hub.
+            with job.step('formgrader'):
+                remove_formgrader(course_id=course_id)
+                if config_loader.shared_formgrader:
+                    write_shared_courses(registry.get_courses())
+                hub_client.delete_service(service_name=course_id)
+
+            # Delete nbgrader exchange directory for course.
+            try:
+                with job.step('exchange'):
+                    run(['rm', '-rf', f'/opt/nbgrader_exchange/{course_id}/'], check=True)
+            except CalledProcessError:
+                return 500, {'message': 'CalledProcessError'}
 
-        # Delete nbgrader exchange directory for course.
-        try:
-            run(['rm', '-rf', f'/opt/nbgrader_exchange/{course_id}/'], check=True)
-        except CalledProcessError:
-            return Response(response=json.dumps({'message': 'CalledProcessError'}), status=500)
+            # Delete grader user for course.
+            try:
+                with job.step('grader_user'):
+                    run(['userdel', f'{grader_user}'], check=True)
+                    run(['rm', '-rf', f'/home/{grader_user}/'], check=True)
+            except CalledProcessError:
+                return 500, {'message': 'CalledProcessError'}
 
-        # Delete grader user for course.
-        try:
-            run(['userdel', f'{grader_user}'], check=True)
-            run(['rm', '-rf', f'/home/{grader_user}/'], check=True)
-        except CalledProcessError:
-            return Response(response=json.dumps({'message': 'CalledProcessError'}), status=500)
-
-        # Generate new nbgrader configuration code and write it to file.
-        with open(file='/opt/conda/envs/jhub/etc/jupyter/nbgrader_config.py') as nb_grader_config:
-            content = nb_grader_config.read()
-        start = content.find('c.NbGrader.course_titles')
-        end = content.find('}', start)
-        pre = content[:start]
-        code = content[start:end + 1]
-        post = content[end + 1:]
-        code = code.replace('c.NbGrader.course_titles = ', 'mapping.update(')
-        code = code.replace('}', '})')
-        mapping = {}
-        exec(code + '\n')
-
-        if course_id in mapping.keys():
-            del mapping[course_id]
-
-        with open(file='/opt/conda/envs/jhub/etc/jupyter/nbgrader_config.py', mode='w') as nb_grader_config:
-            nb_grader_config.write(pre)
-            nb_grader_config.write(f'c.NbGrader.course_titles = {str(mapping)}')
-            nb_grader_config.write(post)
-
-        # Restart JupyterHub to adopt the changes.
-        logging.info('Restarting JupyterHub in 3 seconds...')
-        run(['systemd-run', '--on-active=3', 'systemctl', 'restart', 'jupyterhub'])
-
-        return Response(response=json.dumps({'message': 'Selected course deleted successfully! JupyterHub will restart soon!'}), status=200)
+            # Restart JupyterHub to adopt the changes.
+            logging.info('Restarting JupyterHub in 3 seconds...')
+            run(['systemd-run', '--on-active=3', 'systemctl', 'restart', 'jupyterhub'])
+
+            return 200, {'message': 'Selected course deleted successfully! JupyterHub will restart soon!'}
+
+        return job_queue.run(kind='course_delete', username=user_name, operation=delete_course)
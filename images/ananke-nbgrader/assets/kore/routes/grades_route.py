@@ -2,163 +2,176 @@ import datetime
 import json
 import logging
 import os
-import time
 from json import JSONDecodeError
+from typing import List, Tuple
 
-import jwt
-import requests
 from flask import Blueprint, Response, current_app
 from flask import request as flask_request
 from nbgrader.api import Gradebook
-from requests.exceptions import ConnectionError, HTTPError, RequestException
+from requests.exceptions import RequestException
 from urllib3.exceptions import LocationParseError
 
 from exceptions import InfoFileError
+from misc.gradebook_scores import student_scores
+from misc.jobs import Job
+from misc.lms_client import ScoreSender, get_access_token, invalidate_access_token
 from misc.utils import load_info
+from models.registry import CourseRegistry
 
 grades_bp = Blueprint('grades', __name__)
 
 
+def unsynced_scores(registry: CourseRegistry, course_id: str, lineitem: str, score_data: List[dict],
+                    force: bool = False) -> List[dict]:
+    """
+    Scores which have not been sent to the LMS yet or have changed since they have been sent.
+
+    Parameters
+    ----------
+    registry : CourseRegistry
+        The course registry (holds the scores sent to the LMS).
+    course_id : str
+        The course's ID.
+    lineitem : str
+        The course's line item (scores are tracked per line item).
+    score_data : List[dict]
+        Scores to send (LTI score objects with keys `userId`, `scoreGiven` and `scoreMaximum`).
+    force : bool
+        Return all scores (full resync).
+
+    Returns
+    -------
+    List[dict]
+        Scores from `score_data` which differ from the last score sent.
+    """
+
+    if force:
+        return score_data
+    synced = registry.get_synced_scores(course_id=course_id, lineitem=lineitem)
+    return [data for data in score_data if synced.get(data['userId']) != (data['scoreGiven'], data['scoreMaximum'])]
+
+
+def grades_response(sent: int, report: List[dict]) -> Tuple[int, dict]:
+    """
+    HTTP status and response body after sending scores: 200 if all scores have been sent, 500 if none, 207 else.
+
+    Parameters
+    ----------
+    sent : int
+        Number of scores sent successfully.
+    report : List[dict]
+        Report per student (see `ScoreSender.send`).
+
+    Returns
+    -------
+    Tuple[int, dict]
+        Status and response body.
+    """
+
+    if sent == len(report):
+        return 200, {'message': 'Grades send successfully!', 'students': report}
+    if sent == 0:
+        return 500, {'message': 'SendGradesError', 'students': report}
+    return 207, {'message': f'Grades send for {sent} of {len(report)} students.', 'students': report}
+
+
 @grades_bp.route('/grades', methods=['POST'])
 def grades():
     config_loader = current_app.config['CONFIG_LOADER']
     lti_config = config_loader.lti_config
+    registry = current_app.config['REGISTRY']
 
-    kore_token = current_app.config['KORE_TOKEN']
+    hub_client = current_app.config['HUB_CLIENT']
+    job_queue = current_app.config['JOB_QUEUE']
 
     if flask_request.method == 'POST':
         try:
             user_name = flask_request.json['user']
             path = flask_request.json['path'].removesuffix('/')
+            force = bool(flask_request.json.get('force', False))
         except KeyError:
             return Response(response=json.dumps({'message': 'KeyError'}), status=500)
 
         logging.info(f'User {user_name} indents to send grades of course at {path}.')
 
-        # Read `info.json` file.
+        # Read course info from registry.
         try:
-            info = load_info(f'{path}/info.json')
-            base_url = info['target_link_uri']
+            info = load_info(registry=registry, path=path)
             aud = info['aud']
             lineitem = info['lineitem']
             grader_user = info['grader_user']
+            course_id = info['id']
         except (KeyError, InfoFileError):
             return Response(response=json.dumps({'message': 'InfoFileError'}), status=500)
 
         # Get admin state.
-        headers = {
-            'Content-Type': 'application/json',
-            'Accept': 'application/json',
-            'Authorization': f'token {kore_token}',
-        }
-
         try:
-            response = requests.get(url=f'http://127.0.0.1:8081/{base_url}hub/api/users/{user_name}', headers=headers)
-            response.raise_for_status()
-            user_data = response.json()
-            admin = user_data['admin']
+            admin = hub_client.is_admin(user_name)
             logging.debug(f'{user_name} is admin: {admin}')
-        except (HTTPError, LocationParseError, JSONDecodeError):
+        except (KeyError, RequestException, JSONDecodeError):
             logging.error(f'Error while trying to access admin state of user {user_name}!')
             return Response(response=json.dumps({'message': 'AdminStateError'}), status=500)
 
-        # Create token for requesting access token from LMS.
-        try:
-            auth_token_request_data = {
-                'iss': aud,
-                'aud': lti_config['issuer'],
-                'sub': aud,
-                'iat': int(time.time()) - 5,
-                'exp': int(time.time()) + 60,
-            }
-        except KeyError:
-            logging.error('At least one key not found in LTI configuration or LTI state file!')
-            return Response(response=json.dumps({'message': 'TokenCreationError'}), status=500)
-
-        # Read the private key of Kore.
-        private_key_path = 'keys/lti_key'
-        try:
-            with open(file=private_key_path, mode='r') as private_key:
-                private_key = private_key.read()
-        except (FileNotFoundError, PermissionError, OSError):
-            logging.error('Error while handling private key!')
-            return Response(response=json.dumps({'message': 'PrivateKeyError'}), status=500)
-
-        # Read the public key of Kore.
-        public_key_path = 'keys/lti_key.json'
-        try:
-            with open(file=public_key_path, mode='r') as public_key:
-                jwk = json.load(public_key)
-        except (FileNotFoundError, PermissionError, OSError, JSONDecodeError):
-            logging.error('Error while handling public key!')
-            return Response(response=json.dumps({'message': 'PublicKeyError'}), status=500)
-
-        token = jwt.encode(auth_token_request_data, private_key, algorithm='RS256', headers={'kid': jwk['kid']})
-        params = {
-            'grant_type': 'client_credentials',
-            'client_assertion_type': 'urn:ietf:params:oauth:client-assertion-type:jwt-bearer',
-            'client_assertion': token,
-            'scope': 'https://purl.imsglobal.org/spec/lti-ags/scope/score https://purl.imsglobal.org/spec/lti-ags/scope/lineitem'
-        }
-
-        # Retrieve access token from LMS.
-        try:
-            response = requests.post(lti_config['access_token_url'], data=params)
-            response.raise_for_status()
-            access_token = response.json()['access_token']
-        except (KeyError, HTTPError, LocationParseError, JSONDecodeError):
-            logging.error('Error while accessing token.')
-            return Response(response=json.dumps({'message': 'AccessTokenError'}), status=500)
-
-        # Get score URL from line items.
-        try:
-            url, args = lineitem.split('?')
-            score_url = url + '/scores?' + args
-        except (ValueError, AttributeError):
-            logging.error('Error while composing url for score sending!')
-            return Response(response=json.dumps({'message': 'LineitemError'}), status=500)
-
-        # Get parameters from gradebook.
-        student_ids, scores, max_scores = [], [], []
-
-        # Due to the fact that the gradebook.db would be created while trying to access it with the Gradebook() code line we have to check here if it exists
-        if not os.path.isfile(f'/home/{grader_user}/course_data/gradebook.db'):
-            logging.error('Gradebook does not exist!')
-            return Response(response=json.dumps({'message': 'GradebookNotExistentError'}), status=500)
-
-        with Gradebook(f'sqlite:////home/{grader_user}/course_data/gradebook.db') as gb:
-            for student in gb.students:
-                student_ids.append(student.lms_user_id)
-                scores.append(student.score)
-                max_scores.append(student.max_score)
-
-        # Prepare user independent score data for sending.
-        params = {
-            'activityProgress': 'Completed',
-            'gradingProgress': 'FullyGraded',
-            'timestamp': datetime.datetime.now().astimezone().isoformat(),
-            'userId': '',
-            'comment': '',
-        }
-        headers = {
-            'Authorization': 'Bearer ' + access_token,
-            'Accept': 'application/json',
-            'Content-Type': 'application/vnd.ims.lis.v1.score+json'
-        }
-
-        # Send scores to LMS.
-        for student_id, score, max_score in zip(student_ids, scores, max_scores):
-            params['userId'] = student_id
-            params['scoreGiven'] = score
-            params['scoreMaximum'] = max_score
-
+        def send_grades(job: Job) -> Tuple[int, dict]:
+            # Due to the fact that the gradebook.db would be created while trying to access it with the Gradebook() code line we have to check here if it exists
+            if not os.path.isfile(f'/home/{grader_user}/course_data/gradebook.db'):
+                logging.error('Gradebook does not exist!')
+                return 500, {'message': 'GradebookNotExistentError'}
+
+            # Get scores of all students from gradebook (aggregate queries instead of several queries per student).
+            with job.step('gradebook'), Gradebook(f'sqlite:////home/{grader_user}/course_data/gradebook.db') as gb:
+                students = student_scores(gb)
+
+            # Prepare score data for sending.
+            timestamp = datetime.datetime.now().astimezone().isoformat()
+            score_data = [
+                {
+                    'activityProgress': 'Completed',
+                    'gradingProgress': 'FullyGraded',
+                    'timestamp': timestamp,
+                    'userId': student['lms_user_id'],
+                    'comment': '',
+                    'scoreGiven': student['score'],
+                    'scoreMaximum': student['max_score']
+                }
+                for student in students
+            ]
+
+            # Only new or changed scores are sent (unless a full resync is forced).
+            score_data = unsynced_scores(registry=registry, course_id=course_id, lineitem=lineitem, score_data=score_data, force=force)
+            if not score_data:
+                return 200, {'message': 'No new or changed grades to send.', 'students': []}
+
+            # Retrieve access token from LMS (cached until shortly before it expires).
+            scope = 'https://purl.imsglobal.org/spec/lti-ags/scope/score https://purl.imsglobal.org/spec/lti-ags/scope/lineitem'
+            try:
+                with job.step('access_token'):
+                    access_token = get_access_token(registry=registry, access_token_url=lti_config['access_token_url'],
+                                                    issuer=lti_config['issuer'], client_id=aud, scope=scope)
+            except (KeyError, OSError, ValueError, RequestException, LocationParseError):
+                logging.error('Error while accessing token.')
+                return 500, {'message': 'AccessTokenError'}
+
+            # Get score URL from line items.
             try:
-                response = requests.post(score_url, json=params, headers=headers)
-                response.raise_for_status()
-                if response.status_code == 200:
-                    logging.debug(f'Score(s) for student with ID {student_id} successfully send!')
-            except (HTTPError, ConnectionError, RequestException):
-                logging.error('Error while trying to send grades to LMS')
-                return Response(response=json.dumps({'message': 'SendGradesError'}), status=500)
-
-        return Response(response=json.dumps({'message': 'Grades send successfully!'}), status=200)
+                url, args = lineitem.split('?')
+                score_url = url + '/scores?' + args
+            except (ValueError, AttributeError):
+                logging.error('Error while composing url for score sending!')
+                return 500, {'message': 'LineitemError'}
+
+            # Send scores to LMS.
+            with job.step('send'):
+                sender = ScoreSender(score_url=score_url, access_token=access_token,
+                                     concurrency=config_loader.lms_concurrency, retries=config_loader.lms_retries)
+                sent, report = sender.send_all(score_data)
+            if any(student_report.get('error') == 'status 401' for student_report in report):
+                invalidate_access_token(registry=registry, access_token_url=lti_config['access_token_url'], client_id=aud, scope=scope)
+            registry.set_synced_scores(course_id=course_id, lineitem=lineitem, scores=[
+                (data['userId'], data['scoreGiven'], data['scoreMaximum'])
+                for data, student_report in zip(score_data, report) if student_report['ok']
+            ])
+
+            return grades_response(sent=sent, report=report)
+
+        return job_queue.run(kind='grades', username=user_name, operation=send_grades)
@@ -0,0 +1,90 @@
+import json
+import logging
+import time
+from json import JSONDecodeError
+from typing import Optional
+
+from flask import Blueprint, Response, current_app
+from flask import request as flask_request
+from flask import session as flask_session
+from jupyterhub.services.auth import HubAuth
+from requests.exceptions import RequestException
+from tornado.web import HTTPError
+
+jobs_bp = Blueprint('jobs', __name__)
+
+# Interval (seconds) for checking a job's progress when streaming it as server-sent events.
+stream_interval = 0.5
+
+# A stream occupies one of Kore's threads, so it ends after this many seconds (clients reconnect, e.g. EventSource does).
+stream_max_duration = 60
+
+
+def request_user() -> Optional[str]:
+    """
+    Name of the hub user sending the request, identified by the token of Kore's session (browser) or a JupyterHub API
+    token in the `Authorization` header (e.g. from the user's server).
+
+    Returns
+    -------
+    Optional[str]
+        The user's name, None if the request is not authenticated.
+    """
+
+    token = flask_session.get('token')
+    match = HubAuth.auth_header_pat.match(flask_request.headers.get('Authorization', ''))
+    if match:
+        token = match.group(1)
+    if not token:
+        return None
+
+    try:
+        user = current_app.config['HUB_AUTH'].user_for_token(token)
+    except HTTPError:
+        logging.error('Error while identifying user of request.')
+        return None
+    return user.get('name') if user else None
+
+
+@jobs_bp.route('/jobs/<job_id>', methods=['GET'])
+def jobs(job_id: str):
+    registry = current_app.config['REGISTRY']
+    hub_client = current_app.config['HUB_CLIENT']
+
+    user_name = request_user()
+    if user_name is None:
+        return Response(response=json.dumps({'message': 'AuthenticationError'}), status=401)
+
+    job = registry.get_job(job_id)
+    if job is None:
+        return Response(response=json.dumps({'message': 'JobNotFoundError'}), status=404)
+
+    # Results contain course data (e.g. students' grades), only the user who started the job and admins may read them.
+    if user_name != job['username']:
+        try:
+            admin = hub_client.is_admin(user_name)
+        except (KeyError, RequestException, JSONDecodeError):
+            logging.error(f'Error while trying to access admin state of user {user_name}!')
+            return Response(response=json.dumps({'message': 'AdminStateError'}), status=500)
+        if not admin:
+            logging.warning(f'User {user_name} requested job {job_id} of user {job["username"]}.')
+            return Response(response=json.dumps({'message': 'JobAccessError'}), status=403)
+
+    if 'text/event-stream' not in flask_request.headers.get('Accept', ''):
+        return Response(response=json.dumps(job), status=200)
+
+    # Stream progress as server-sent events until the job has finished (or the stream's time is up).
+    def events():
+        last = None
+        current = job
+        end = time.monotonic() + stream_max_duration
+        while True:
+            if current != last:
+                yield f'data: {json.dumps(current)}\n\n'
+                last = current
+            if current['state'] in ['finished', 'failed'] or time.monotonic() > end:
+                return
+            time.sleep(stream_interval)
+            current = registry.get_job(job_id)
+
+    return Response(response=events(), status=200, mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
@@ -2,12 +2,13 @@ import json
 import logging
 import time
 from pathlib import Path
-from subprocess import run, CalledProcessError
 
 from flask import Blueprint, Response, current_app
 from flask import request as flask_request
 
-from exceptions import InfoFileError
+from exceptions import CopyError, InfoFileError
+from misc.backup_store import copy_content
+from misc.copy_engine import make_dirs
 from misc.utils import get_list, load_info
 from models.enums import Content
 
@@ -18,13 +19,13 @@ problems_bp = Blueprint('problems', __name__)
 def problems():
     config_loader = current_app.config['CONFIG_LOADER']
 
-    autogenerated_file_path = config_loader.autogenerated_file_path
+    registry = current_app.config['REGISTRY']
     date_time_format = config_loader.date_time_format
 
     # Retrieve full problem list (active and backed up ones).
     if flask_request.method == 'GET':
         try:
-            return get_list(autogenerated_file_path=autogenerated_file_path, content=Content.PROBLEMS)
+            return get_list(registry=registry, content=Content.PROBLEMS)
         except ValueError:
             return Response(response=json.dumps({'message': 'ValueError'}), status=500)
 
@@ -37,9 +38,9 @@ def problems():
             logging.error('Request key is not in form!')
             return Response(response=json.dumps({'message': 'KeyError'}), status=500)
 
-        # Read `info.json` file.
+        # Read course info from registry.
         try:
-            info = load_info(f'{dst}/info.json')
+            info = load_info(registry=registry, path=dst)
             grader_user = info['grader_user']
         except (KeyError, InfoFileError):
             return Response(response=json.dumps({'message': 'InfoFileError'}), status=500)
@@ -47,11 +48,10 @@ def problems():
         dst = f'{dst}/source/imported/'
         filename = f'{Path(src).stem}_{time.strftime(date_time_format)}{Path(src).suffix}'
         try:
-            run(['mkdir', '-p', dst], check=True)
-            run(['cp', src, f'{dst}{filename}'], check=True)
-            run(['chown', '-R', f'{grader_user}:{grader_user}', f'{dst}'], check=True)
-        except CalledProcessError:
-            return Response(response=json.dumps({'message': 'CalledProcessError'}), status=500)
+            make_dirs(dst, owner=grader_user)
+            copy_content(src, f'{dst}{filename}', owner=grader_user)
+        except CopyError:
+            return Response(response=json.dumps({'message': 'CopyError'}), status=500)
 
         return Response(response=json.dumps({'message': 'Selected problem copied successfully! \n'
                                                         'Please refresh the webpage (Formgrader) to see the imported problem.'}), status=200)
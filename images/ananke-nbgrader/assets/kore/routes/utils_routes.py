@@ -1,7 +1,6 @@
 import json
 
 from flask import Blueprint, current_app, Response
-from flask import jsonify as flask_jsonify
 from flask import make_response
 from flask import redirect as flask_redirect
 from flask import request as flask_request
@@ -9,10 +8,14 @@ from flask import session as flask_session
 from jupyterhub.services.auth import HubOAuth
 
 from exceptions import ConfigFileError
+from misc.lti_keys import lti_keys
 from misc.utils import load_config
 
 utils_bp = Blueprint('utils', __name__)
 
+# Seconds LMSs may cache Kore's key set.
+jwks_max_age = 3600
+
 
 @utils_bp.route('/config', methods=['GET'])
 def config():
@@ -51,11 +54,15 @@ def oauth_callback():
 
 @utils_bp.route('/jwks', methods=['GET'])
 def get_jwks():
-    # Read the public key of Kore.
-    with open(file='keys/lti_key.json') as public_key:
-        jwk = json.load(public_key)
+    # JWKS containing Kore's public key only (kept in memory, reloaded on key rotation).
+    try:
+        jwks, etag = lti_keys.jwks()
+    except (OSError, ValueError, KeyError):
+        return Response(response=json.dumps({'message': 'PublicKeyError'}), status=500)
 
-    # Make JWKS containing the read JWK only.
-    jwks = {'keys': [jwk]}
+    response = Response(response=jwks, status=200, mimetype='application/json')
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = jwks_max_age
 
-    return flask_jsonify(jwks)
+    return response.make_conditional(flask_request)
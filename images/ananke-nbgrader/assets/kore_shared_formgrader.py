@@ -0,0 +1,132 @@
+# Jupyter server extension serving nbgrader's formgrader for many courses from one server (Kore's shared formgrader mode).
+#
+# Requests to `<base_url><course_id>/formgrader/...` are routed to nbgrader's formgrader handlers with the course's
+# directory, config and gradebook. Courses (course id > grader user) are read from a JSON file written by the hub.
+# Only members of the course's `formgrade-<course_id>` group get access.
+
+import inspect
+import json
+import os
+import time
+from collections import ChainMap
+from types import SimpleNamespace
+from typing import Optional
+
+from nbgrader.server_extensions.formgrader.base import BaseHandler
+from nbgrader.server_extensions.formgrader.formgrader import FormgradeExtension
+from tornado import web
+from tornado.httpclient import AsyncHTTPClient, HTTPClientError, HTTPRequest
+
+courses_file_path = os.path.expanduser('~/.kore_courses.json')
+
+
+class SharedCourses:
+    """
+    Courses served by the shared formgrader (reloaded if the courses file changes) and group lookups.
+    """
+
+    def __init__(self, serverapp, members_cache_ttl: float = 60) -> None:
+        self.serverapp = serverapp
+        self.members_cache_ttl = members_cache_ttl
+        self._grader_users: dict[str, str] = {}
+        self._mtime: Optional[float] = None
+        self._settings: dict[str, ChainMap] = {}
+        self._groups: dict[str, tuple[list, float]] = {}
+
+    def grader_user(self, course_id: str) -> Optional[str]:
+        try:
+            mtime = os.stat(courses_file_path).st_mtime
+        except FileNotFoundError:
+            return None
+        if mtime != self._mtime:
+            with open(courses_file_path) as f:
+                self._grader_users = json.load(f)
+            self._mtime = mtime
+        return self._grader_users.get(course_id)
+
+    def settings(self, course_id: str) -> ChainMap:
+        """
+        Tornado settings of the course's formgrader (course-specific values, falling back to the server's settings).
+        """
+
+        if course_id not in self._settings:
+            grader_user = self._grader_users[course_id]
+            formgrader = FormgradeExtension(parent=self.serverapp)
+            formgrader.root_dir = f'/home/{grader_user}'
+            formgrader.config_dir = f'/home/{grader_user}/.jupyter'
+            formgrader.load_cwd_config = False
+            formgrader.log = self.serverapp.log
+            formgrader.initialize([])
+
+            course_settings = SimpleNamespace(settings={'base_url': f'{self.serverapp.web_app.settings["base_url"]}{course_id}/'})
+            formgrader.init_tornado_settings(course_settings)
+            self._settings[course_id] = ChainMap(course_settings.settings, self.serverapp.web_app.settings)
+
+        return self._settings[course_id]
+
+    async def is_member(self, username: str, course_id: str) -> bool:
+        groups, expires = self._groups.get(username, ([], 0))
+        if expires <= time.monotonic():
+            request = HTTPRequest(
+                url=f'{os.environ["JUPYTERHUB_API_URL"].rstrip("/")}/users/{username}',
+                headers={'Authorization': f'token {os.environ["JUPYTERHUB_API_TOKEN"]}', 'Accept': 'application/json'}
+            )
+            try:
+                response = await AsyncHTTPClient().fetch(request)
+            except (HTTPClientError, OSError) as e:
+                self.serverapp.log.error(f'Reading groups of {username} from hub failed: {e}')
+                return False
+            groups = json.loads(response.body).get('groups', [])
+            self._groups[username] = (groups, time.monotonic() + self.members_cache_ttl)
+        return f'formgrade-{course_id}' in groups
+
+
+def _jupyter_server_extension_points():
+    return [{'module': 'kore_shared_formgrader'}]
+
+
+def _load_jupyter_server_extension(serverapp):
+    serverapp.log.info('Loading Kore\'s shared formgrader extension')
+    webapp = serverapp.web_app
+    base_url = webapp.settings['base_url']
+    courses = SharedCourses(serverapp)
+
+    # nbgrader's formgrader handlers (without course, the course is taken from the request).
+    FormgradeExtension(parent=serverapp).init_handlers(webapp)
+
+    # Strip the course id from the path and remember the course for the handler.
+    find_handler = webapp.find_handler
+
+    def find_course_handler(request, **kwargs):
+        if request.path.startswith(base_url):
+            course_id, _, rest = request.path[len(base_url):].partition('/')
+            if rest and courses.grader_user(course_id):
+                request.kore_course_id = course_id
+                request.path = f'{base_url}{rest}'
+        return find_handler(request, **kwargs)
+
+    webapp.find_handler = find_course_handler
+
+    # Course-specific settings and authorization for all formgrader handlers.
+    def settings(handler):
+        course_id = getattr(handler.request, 'kore_course_id', None)
+        return courses.settings(course_id) if course_id else handler.application.settings
+
+    prepare = BaseHandler.prepare
+
+    async def prepare_course(handler, *args, **kwargs):
+        result = prepare(handler, *args, **kwargs)
+        if inspect.isawaitable(result):
+            await result
+        if handler._finished:
+            return
+
+        course_id = getattr(handler.request, 'kore_course_id', None)
+        if course_id is None:
+            raise web.HTTPError(404)
+        # Unauthenticated requests are redirected to login by the handlers.
+        if handler.current_user and not await courses.is_member(handler.current_user.username, course_id):
+            raise web.HTTPError(403)
+
+    BaseHandler.settings = property(settings)
+    BaseHandler.prepare = prepare_course
@@ -0,0 +1,17 @@
+import os
+import sys
+
+import pytest
+
+# Kore's modules import each other relative to Kore's directory (Kore runs in /opt/kore in the container) and use
+# modules of the base image (installed to the hub's site-packages).
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'assets', 'kore'))
+sys.path.insert(1, os.path.join(os.path.dirname(__file__), '..', '..', 'ananke-base', 'assets'))
+
+
+@pytest.fixture
+def registry(tmp_path):
+    from models.registry import CourseRegistry
+
+    return CourseRegistry(path=str(tmp_path / 'registry.sqlite'), autogenerated_file_path=str(tmp_path / 'autogenerated_services.json'),
+                          nbgrader_config_path=str(tmp_path / 'nbgrader_config.py'))
@@ -0,0 +1,85 @@
+import os
+import pwd
+import threading
+
+import pytest
+
+from misc import accounts
+from misc.accounts import reconcile_accounts
+
+
+class FakeAccounts:
+    """
+    Account database and user management commands (`run`) of a fresh container.
+    """
+
+    def __init__(self) -> None:
+        self.users: dict[str, pwd.struct_passwd] = {}
+        self.commands: list[list[str]] = []
+        self.running = 0
+        self.max_running = {'useradd': 0, 'chown': 0}
+        self.lock = threading.Lock()
+        self.next_id = 2000
+
+    def getpwnam(self, name: str) -> pwd.struct_passwd:
+        return self.users[name]
+
+    def getpwuid(self, uid: int) -> pwd.struct_passwd:
+        for entry in self.users.values():
+            if entry.pw_uid == uid:
+                return entry
+        raise KeyError(uid)
+
+    def run(self, args, check=False):
+        with self.lock:
+            self.commands.append(args)
+            self.running += 1
+            if args[0] in self.max_running:
+                self.max_running[args[0]] = max(self.max_running[args[0]], self.running)
+        try:
+            threading.Event().wait(0.05)
+            if args[0] == 'useradd':
+                options = dict(arg.removeprefix('--').split('=') for arg in args[1:-1] if '=' in arg)
+                uid = int(options.get('uid', self.next_id))
+                self.next_id += 1
+                self.users[args[-1]] = pwd.struct_passwd((args[-1], 'x', uid, int(options.get('gid', uid)), '', options['home-dir'],
+                                                          options['shell']))
+        finally:
+            with self.lock:
+                self.running -= 1
+
+
+@pytest.fixture
+def system(monkeypatch):
+    system = FakeAccounts()
+    monkeypatch.setattr(accounts, 'run', system.run)
+    monkeypatch.setattr(accounts.pwd, 'getpwnam', system.getpwnam)
+    monkeypatch.setattr(accounts.pwd, 'getpwuid', system.getpwuid)
+    monkeypatch.setattr(accounts.grp, 'getgrgid', lambda gid: (_ for _ in ()).throw(KeyError(gid)))
+    return system
+
+
+def test_reconcile_accounts(system, registry, tmp_path):
+    names = [f'grader-{i}' for i in range(4)]
+    for name in names:
+        os.makedirs(tmp_path / name)
+    # Known ids of two accounts from the manifest (home directories are owned by others, so ownership has to be fixed).
+    registry.set_accounts({name: {'uid': 5000 + i, 'gid': 5000 + i, 'home': str(tmp_path / name), 'state': ''} for i, name in enumerate(names[0:2])})
+
+    reconcile_accounts(registry=registry, home_root=str(tmp_path), concurrency=4)
+
+    useradds = [args for args in system.commands if args[0] == 'useradd']
+    assert len(useradds) == 4
+    # Accounts keeping their ids are created first.
+    assert {args[-1] for args in useradds[0:2]} == {'grader-0', 'grader-1'}
+    assert '--uid=5000' in next(args for args in useradds if args[-1] == 'grader-0')
+    # Accounts are created one by one, ownership is fixed in parallel.
+    assert system.max_running['useradd'] == 1
+    assert sorted(args[-1] for args in system.commands if args[0] == 'chown') == sorted(str(tmp_path / name) for name in names)
+    assert system.max_running['chown'] > 1
+    assert set(registry.get_accounts()) == set(names)
+
+    # Nothing to do after a restart.
+    system.commands.clear()
+    reconcile_accounts(registry=registry, home_root=str(tmp_path), concurrency=4)
+    assert system.commands == []
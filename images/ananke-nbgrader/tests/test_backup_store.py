@@ -0,0 +1,129 @@
+import json
+import os
+import pwd
+
+import pytest
+
+from exceptions import CopyError
+from misc import backup_store
+from misc.backup_store import copy_content, create_backup, find_backup, load_manifests
+
+owner = pwd.getpwuid(os.getuid()).pw_name
+
+
+@pytest.fixture
+def backups(tmp_path, monkeypatch):
+    monkeypatch.setattr(backup_store, 'backups_dir', str(tmp_path / 'private'))
+    monkeypatch.setattr(backup_store, '_manifests', {})
+    os.makedirs(tmp_path / 'private' / 'instructor')
+    return tmp_path / 'private'
+
+
+@pytest.fixture
+def course(tmp_path):
+    src = tmp_path / 'course'
+    os.makedirs(src / 'source' / 'a1')
+    (src / 'source' / 'a1' / 'problem.ipynb').write_text('{"cells": []}')
+    (src / 'source' / 'a1' / 'copy.ipynb').write_text('{"cells": []}')
+    (src / 'gradebook.db').write_bytes(os.urandom(3 * backup_store.chunk_size // 2))
+    os.symlink('source/a1', src / 'current')
+    return src
+
+
+def write_manifest(backups, manifest: dict, name: str = 'evil') -> None:
+    with open(backups / backup_store.store_dir_name / 'instructor' / 'manifests' / f'{name}.json', 'w') as file:
+        json.dump(manifest, file)
+
+
+def test_backup_and_restore(backups, course, tmp_path):
+    create_backup(user_name='instructor', src=str(course), name='course_1')
+    store = backups / backup_store.store_dir_name / 'instructor'
+    assert oct(os.stat(store).st_mode & 0o777) == '0o700'
+    # Equal notebooks share a chunk, the gradebook needs two chunks.
+    assert len(list(store.glob('chunks/*/*'))) == 3
+
+    copy_content(src=f'{backups}/instructor/course_1', dst=str(tmp_path / 'restored'), owner=owner)
+    assert (tmp_path / 'restored' / 'gradebook.db').read_bytes() == (course / 'gradebook.db').read_bytes()
+    assert (tmp_path / 'restored' / 'source' / 'a1' / 'problem.ipynb').read_text() == '{"cells": []}'
+    assert os.readlink(tmp_path / 'restored' / 'current') == 'source/a1'
+
+    copy_content(src=f'{backups}/instructor/course_1/source/a1/copy.ipynb', dst=str(tmp_path / 'copy.ipynb'), owner=owner)
+    assert (tmp_path / 'copy.ipynb').read_text() == '{"cells": []}'
+
+
+@pytest.mark.parametrize('path', ['../outside', '/tmp/outside', 'a/../../outside', 'a/./b', ''])
+def test_restore_rejects_paths_outside(backups, course, tmp_path, path):
+    create_backup(user_name='instructor', src=str(course), name='course_1')
+    manifest = load_manifests('instructor')['course_1']
+    chunks = next(entry['chunks'] for entry in manifest['entries'] if entry['path'] == 'source/a1/problem.ipynb')
+    write_manifest(backups, {'source': str(course), 'created': 0, 'entries': [
+        {'path': 'a', 'type': 'dir', 'mode': 0o755},
+        {'path': path, 'type': 'file', 'mode': 0o644, 'size': 13, 'mtime': 0, 'chunks': chunks}
+    ]})
+
+    with pytest.raises(CopyError):
+        copy_content(src=f'{backups}/instructor/evil', dst=str(tmp_path / 'restored'), owner=owner)
+    assert not (tmp_path / 'restored').exists()
+    assert not (tmp_path / 'outside').exists()
+    assert not [name for name in os.listdir(tmp_path) if name.startswith('.kore-copy-')]
+
+
+def test_restore_skips_links_leaving_the_tree(backups, course, tmp_path):
+    create_backup(user_name='instructor', src=str(course), name='course_1')
+    write_manifest(backups, {'source': str(course), 'created': 0, 'entries': [
+        {'path': 'a', 'type': 'dir', 'mode': 0o755},
+        {'path': 'a/inside', 'type': 'link', 'mode': 0o777, 'target': '../a'},
+        {'path': 'a/absolute', 'type': 'link', 'mode': 0o777, 'target': '/etc'},
+        {'path': 'a/up', 'type': 'link', 'mode': 0o777, 'target': '../..'},
+        {'path': 'a/up/passwd', 'type': 'file', 'mode': 0o644, 'size': 0, 'mtime': 0, 'chunks': []}
+    ]})
+
+    with pytest.raises(CopyError):
+        copy_content(src=f'{backups}/instructor/evil', dst=str(tmp_path / 'restored'), owner=owner)
+    assert not (tmp_path / 'passwd').exists()
+
+    write_manifest(backups, {'source': str(course), 'created': 0, 'entries': [
+        {'path': 'a', 'type': 'dir', 'mode': 0o755},
+        {'path': 'a/inside', 'type': 'link', 'mode': 0o777, 'target': '../a'},
+        {'path': 'a/absolute', 'type': 'link', 'mode': 0o777, 'target': '/etc'},
+        {'path': 'a/up', 'type': 'link', 'mode': 0o777, 'target': '../..'}
+    ]}, name='links')
+    copy_content(src=f'{backups}/instructor/links', dst=str(tmp_path / 'restored'), owner=owner)
+    assert os.listdir(tmp_path / 'restored' / 'a') == ['inside']
+
+
+def test_restore_rejects_invalid_chunks(backups, course, tmp_path):
+    create_backup(user_name='instructor', src=str(course), name='course_1')
+    write_manifest(backups, {'source': str(course), 'created': 0, 'entries': [
+        {'path': 'file', 'type': 'file', 'mode': 0o644, 'size': 0, 'mtime': 0, 'chunks': ['../../../../../etc/passwd']}
+    ]})
+
+    with pytest.raises(CopyError):
+        copy_content(src=f'{backups}/instructor/evil', dst=str(tmp_path / 'restored'), owner=owner)
+
+
+def test_find_backup_rejects_other_directories(backups, course):
+    create_backup(user_name='instructor', src=str(course), name='course_1')
+
+    assert find_backup(f'{backups}/instructor/course_1/source')[2] == 'source'
+    assert find_backup(f'{backups}/../instructor/course_1') is None
+    assert find_backup(f'{backups}/{backup_store.store_dir_name}/instructor') is None
+
+
+def test_store_of_former_versions_is_moved(backups, course, tmp_path):
+    old_store = backups / 'instructor' / backup_store.store_dir_name
+    backup_store.backups_dir, real_backups_dir = str(tmp_path / 'old'), backup_store.backups_dir
+    os.makedirs(tmp_path / 'old' / 'instructor')
+    create_backup(user_name='instructor', src=str(course), name='course_1')
+    backup_store.backups_dir = real_backups_dir
+    os.rename(tmp_path / 'old' / backup_store.store_dir_name / 'instructor', old_store)
+    os.symlink('/etc/passwd', old_store / 'manifests' / 'link.json')
+
+    assert list(load_manifests('instructor')) == ['course_1']
+    assert not old_store.exists()
+    store = backups / backup_store.store_dir_name / 'instructor'
+    assert not (store / 'manifests' / 'link.json').exists()
+    assert all(os.stat(path).st_uid == 0 for path in store.rglob('*'))
+
+    copy_content(src=f'{backups}/instructor/course_1', dst=str(tmp_path / 'restored'), owner=owner)
+    assert (tmp_path / 'restored' / 'gradebook.db').read_bytes() == (course / 'gradebook.db').read_bytes()
@@ -0,0 +1,127 @@
+import asyncio
+import threading
+import time
+
+import pytest
+from nbgrader.api import Gradebook
+from sqlalchemy.exc import OperationalError
+
+from misc.enrollment import EnrollmentQueue
+from misc.provisioning import Provisioner
+
+
+@pytest.fixture
+def queue(tmp_path, monkeypatch):
+    monkeypatch.setattr(EnrollmentQueue, '_gradebook_path', staticmethod(lambda grader_user: str(tmp_path / f'{grader_user}.db')))
+    return EnrollmentQueue(provisioner=Provisioner(concurrency=4, step_timeout=10), delay=0.01)
+
+
+def enqueue(queue, username, first_name='First'):
+    return queue.enqueue('grader-test', username, first_name, 'Last', f'{username}@example.org', f'lms-{username}')
+
+
+async def drain(queue):
+    while queue._flush_tasks:
+        await asyncio.gather(*list(queue._flush_tasks.values()))
+
+
+def students(queue):
+    with Gradebook(f'sqlite:///{queue._gradebook_path("grader-test")}') as gb:
+        return {student.id: student.first_name for student in gb.students}
+
+
+def test_launches_are_coalesced(queue, monkeypatch):
+    batches = []
+    write_batch = queue._write_batch
+    monkeypatch.setattr(queue, '_write_batch', lambda grader_user, batch: batches.append(dict(batch)) or write_batch(grader_user, batch))
+
+    async def main():
+        for username in ['s1', 's2', 's3']:
+            assert enqueue(queue, username)
+        await drain(queue)
+
+    asyncio.run(main())
+
+    assert len(batches) == 1
+    assert students(queue) == {'s1': 'First', 's2': 'First', 's3': 'First'}
+
+
+def test_unchanged_students_are_not_queued(queue):
+    queue._gradebook('grader-test')
+
+    async def main():
+        enqueue(queue, 's1')
+        await drain(queue)
+        assert not enqueue(queue, 's1')
+        assert enqueue(queue, 's1', first_name='Changed')
+        await drain(queue)
+
+    asyncio.run(main())
+
+    assert students(queue) == {'s1': 'Changed'}
+
+
+def test_launch_during_write_waits_for_write(queue, monkeypatch):
+    running, overlaps = [], []
+    write_batch = queue._write_batch
+
+    def slow_write_batch(grader_user, batch):
+        overlaps.append(bool(running))
+        running.append(True)
+        time.sleep(0.2)
+        try:
+            return write_batch(grader_user, batch)
+        finally:
+            running.pop()
+
+    monkeypatch.setattr(queue, '_write_batch', slow_write_batch)
+
+    async def main():
+        enqueue(queue, 's1')
+        await asyncio.sleep(0.1)
+        enqueue(queue, 's2')
+        assert len(queue._flush_tasks) == 1
+        await drain(queue)
+
+    asyncio.run(main())
+
+    assert overlaps == [False, False]
+    assert students(queue) == {'s1': 'First', 's2': 'First'}
+
+
+def test_failed_batch_is_retried(queue, monkeypatch):
+    failures = [OperationalError('INSERT', {}, Exception('database is locked'))]
+    upsert = queue._upsert
+
+    def failing_upsert(grader_user, batch):
+        if failures:
+            raise failures.pop()
+        return upsert(grader_user, batch)
+
+    monkeypatch.setattr(queue, '_upsert', failing_upsert)
+
+    async def main():
+        enqueue(queue, 's1')
+        await drain(queue)
+
+    asyncio.run(main())
+
+    assert students(queue) == {'s1': 'First'}
+    assert not queue._failures
+
+
+def test_writes_of_a_course_are_serialized(queue):
+    # A write whose caller timed out may still run while the next batch is written.
+    queue._gradebook('grader-test')
+    lock = queue._write_locks.setdefault('grader-test', threading.Lock())
+    lock.acquire()
+    results = []
+    thread = threading.Thread(target=lambda: results.append(queue._write_batch('grader-test', {'s1': {
+        'first_name': 'First', 'last_name': 'Last', 'email': '', 'lms_user_id': ''}})))
+    thread.start()
+    time.sleep(0.1)
+    assert not results
+    lock.release()
+    thread.join()
+
+    assert 's1' in results[0]
@@ -0,0 +1,41 @@
+from routes.grades_route import unsynced_scores
+
+
+def score(user_id: str, score_given: float, score_maximum: float = 10.0) -> dict:
+    return {'userId': user_id, 'scoreGiven': score_given, 'scoreMaximum': score_maximum}
+
+
+def test_unsynced_scores(registry):
+    scores = [score('a', 1.0), score('b', 2.0), score('c', 3.0)]
+    assert unsynced_scores(registry=registry, course_id='course', lineitem='item', score_data=scores) == scores
+
+    registry.set_synced_scores(course_id='course', lineitem='item', scores=[('a', 1.0, 10.0), ('b', 2.0, 10.0)])
+    assert unsynced_scores(registry=registry, course_id='course', lineitem='item', score_data=scores) == [score('c', 3.0)]
+
+    # Changed score or maximum score.
+    scores = [score('a', 1.5), score('b', 2.0, 12.0), score('c', 3.0)]
+    assert unsynced_scores(registry=registry, course_id='course', lineitem='item', score_data=scores) == scores
+
+
+def test_force(registry):
+    scores = [score('a', 1.0), score('b', 2.0)]
+    registry.set_synced_scores(course_id='course', lineitem='item', scores=[('a', 1.0, 10.0), ('b', 2.0, 10.0)])
+
+    assert unsynced_scores(registry=registry, course_id='course', lineitem='item', score_data=scores) == []
+    assert unsynced_scores(registry=registry, course_id='course', lineitem='item', score_data=scores, force=True) == scores
+
+
+def test_synced_scores_per_course_and_lineitem(registry):
+    registry.set_synced_scores(course_id='course', lineitem='item', scores=[('a', 1.0, 10.0)])
+    scores = [score('a', 1.0)]
+
+    assert unsynced_scores(registry=registry, course_id='course', lineitem='item', score_data=scores) == []
+    assert unsynced_scores(registry=registry, course_id='course', lineitem='other', score_data=scores) == scores
+    assert unsynced_scores(registry=registry, course_id='other', lineitem='item', score_data=scores) == scores
+
+
+def test_synced_scores_are_updated(registry):
+    registry.set_synced_scores(course_id='course', lineitem='item', scores=[('a', 1.0, 10.0)])
+    registry.set_synced_scores(course_id='course', lineitem='item', scores=[('a', 4.0, 10.0), ('b', 2.0, 10.0)])
+
+    assert registry.get_synced_scores(course_id='course', lineitem='item') == {'a': (4.0, 10.0), 'b': (2.0, 10.0)}
@@ -0,0 +1,81 @@
+import random
+
+import pytest
+from nbgrader.api import Gradebook, MissingEntry
+
+from misc.gradebook_scores import assignment_max_scores, student_scores
+
+assignments = ['a1', 'a2', 'a3']
+cells = ['c0', 'c1', 'c2', 't']
+
+
+@pytest.fixture
+def gradebook(tmp_path):
+    """
+    Gradebook with three assignments, students without, with some and with all submissions, unset, manual and
+    automatic scores, extra credit, and students with equal names.
+    """
+
+    rand = random.Random(1)
+    with Gradebook(f'sqlite:///{tmp_path}/gradebook.db') as gb:
+        for assignment in assignments:
+            gb.add_assignment(assignment)
+            for notebook in ['n1', 'n2']:
+                gb.add_notebook(notebook, assignment)
+                for cell in cells[:3]:
+                    gb.add_grade_cell(cell, notebook, assignment, max_score=rand.choice([1, 2, 5]), cell_type='code')
+                gb.add_task_cell('t', notebook, assignment, max_score=3, cell_type='markdown')
+        for i in range(20):
+            gb.add_student(f's{i}', first_name=f'F{i % 3}', last_name=f'L{i % 5}', lms_user_id=f'lms{i}')
+        for i in range(15):
+            for assignment in assignments[:i % 4]:
+                gb.add_submission(assignment, f's{i}')
+                for notebook in ['n1', 'n2']:
+                    for cell in cells:
+                        grade = gb.find_grade(cell, notebook, assignment, f's{i}')
+                        r = rand.random()
+                        if r < 0.3:
+                            grade.manual_score = rand.randint(0, 2)
+                        elif r < 0.6:
+                            grade.auto_score = rand.randint(0, 2)
+                        if rand.random() < 0.2:
+                            grade.extra_credit = 0.5
+                gb.db.commit()
+        yield gb
+
+
+def test_assignment_max_scores(gradebook):
+    assert assignment_max_scores(gradebook) == {assignment.name: assignment.max_score for assignment in gradebook.assignments}
+
+
+def test_student_scores_match_nbgrader(gradebook):
+    scores = student_scores(gradebook)
+
+    # Order of students with equal names is not defined by nbgrader.
+    expected = {student.id: student for student in gradebook.students}
+    assert sorted(student['id'] for student in scores) == sorted(expected)
+    assert [(expected[student['id']].last_name, expected[student['id']].first_name) for student in scores] \
+        == [(student.last_name, student.first_name) for student in gradebook.students]
+
+    for student in scores:
+        nbgrader_student = expected[student['id']]
+        assert student['lms_user_id'] == nbgrader_student.lms_user_id
+        assert student['score'] == pytest.approx(nbgrader_student.score)
+        assert student['max_score'] == pytest.approx(nbgrader_student.max_score)
+        assert set(student['assignments']) == set(assignments)
+        for assignment, score in student['assignments'].items():
+            try:
+                submission_score = gradebook.find_submission(assignment, student['id']).score
+            except MissingEntry:
+                submission_score = 0.0
+            assert score == pytest.approx(submission_score)
+
+    assert any(student['score'] > 0 for student in scores)
+    assert any(student['score'] == 0 and not any(student['assignments'].values()) for student in scores)
+
+
+def test_student_scores_empty(tmp_path):
+    with Gradebook(f'sqlite:///{tmp_path}/gradebook.db') as gb:
+        assert student_scores(gb) == []
+        gb.add_student('s', lms_user_id='lms')
+        assert student_scores(gb) == [{'id': 's', 'lms_user_id': 'lms', 'score': 0.0, 'max_score': 0.0, 'assignments': {}}]
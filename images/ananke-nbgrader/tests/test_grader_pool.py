@@ -0,0 +1,142 @@
+import asyncio
+import os
+from subprocess import CalledProcessError
+
+import pytest
+
+from misc import grader_pool as grader_pool_module
+from misc.grader_pool import GraderPool, ready_marker
+from misc.provisioning import Provisioner
+
+
+class FakeSystem(Provisioner):
+    """
+    Provisioner simulating the user management commands on a temporary home directory.
+    """
+
+    def __init__(self, home_dir: str) -> None:
+        super().__init__(concurrency=2, step_timeout=10)
+        self.home_dir = home_dir
+        self.users: set[str] = set()
+        self.groups: set[str] = set()
+        self.commands: list[list[str]] = []
+        self.failing: set[str] = set()
+
+    async def run(self, args, timeout=None):
+        self.commands.append(args)
+        if args[0] in self.failing or ' '.join(args[:2]) in self.failing:
+            raise CalledProcessError(1, args)
+        if args[0] == 'useradd':
+            self.users.add(args[-1])
+            self.groups.add(args[-1])
+            os.makedirs(f'{self.home_dir}/{args[-1]}')
+        elif args[0] == 'usermod' and args[1] == '--login':
+            self.users.remove(args[-1])
+            self.users.add(args[2])
+            os.rename(f'{self.home_dir}/{args[-1]}', args[4])
+        elif args[0] == 'groupmod':
+            self.groups.remove(args[-1])
+            self.groups.add(args[2])
+        elif args[0] == 'userdel':
+            self.users.discard(args[-1])
+            self.groups.discard(args[-1])
+
+
+@pytest.fixture
+def system(tmp_path, monkeypatch):
+    system = FakeSystem(str(tmp_path))
+    monkeypatch.setattr(grader_pool_module, 'user_exists', lambda name: name in system.users)
+    monkeypatch.setattr(grader_pool_module, 'group_exists', lambda name: name in system.groups)
+    return system
+
+
+@pytest.fixture
+def pool(system, tmp_path):
+    pool = GraderPool(provisioner=system, size=2, home_dir=str(tmp_path))
+    asyncio.run(pool._fill())
+    return pool
+
+
+def test_fill_prepares_accounts(pool, tmp_path):
+    assert len(pool.ready) == 2
+    for pool_user in pool.ready:
+        assert os.path.isfile(tmp_path / pool_user / ready_marker)
+        assert os.path.isfile(tmp_path / pool_user / 'course_data' / 'gradebook.db')
+        assert os.path.isdir(tmp_path / pool_user / '.jupyter')
+
+    # Accounts are found again after a restart.
+    assert GraderPool(provisioner=pool.provisioner, home_dir=str(tmp_path)).ready == sorted(pool.ready)
+
+
+def test_claim_renames_account(pool, system, tmp_path):
+    pool_user = pool.ready[0]
+
+    assert asyncio.run(pool.claim('grader-course'))
+
+    assert pool_user not in pool.ready
+    assert 'grader-course' in system.users and 'grader-course' in system.groups
+    assert not os.path.exists(tmp_path / 'grader-course' / ready_marker)
+
+
+def test_failed_claim_is_undone(pool, system, tmp_path):
+    pool_user = pool.ready[0]
+    system.failing.add('groupmod --new-name')
+
+    assert not asyncio.run(pool.claim('grader-course'))
+
+    assert pool.ready[-1] == pool_user
+    assert pool_user in system.users and 'grader-course' not in system.users
+    assert os.path.isfile(tmp_path / pool_user / ready_marker)
+    assert not pool.quarantined
+
+
+def test_failed_undo_quarantines_account(pool, system):
+    pool_user = pool.ready[0]
+    run = system.run
+
+    # Renaming the user succeeds, renaming the group fails and so does renaming the user back.
+    async def failing_run(args, timeout=None):
+        if args[0] == 'groupmod':
+            system.failing.update(['groupmod', 'usermod'])
+        return await run(args, timeout)
+
+    system.run = failing_run
+
+    assert not asyncio.run(pool.claim('grader-course'))
+
+    assert pool_user not in pool.ready
+    assert pool.quarantined == [pool_user]
+    # The half-renamed account is not prepared again.
+    assert not asyncio.run(pool.prepare('grader-course'))
+
+
+def test_failed_preparation_stops_filling(system, tmp_path):
+    pool = GraderPool(provisioner=system, size=2, home_dir=str(tmp_path))
+    system.failing.add('chown')
+
+    asyncio.run(pool._fill())
+
+    assert pool.ready == []
+    assert [args[0] for args in system.commands].count('useradd') == 1
+    assert system.commands[-1][0] == 'userdel'
+    assert not system.users
+
+
+def test_failed_preparation_removes_account(system, tmp_path):
+    pool = GraderPool(provisioner=system, size=2, home_dir=str(tmp_path))
+    system.failing.add('chmod')
+
+    assert not asyncio.run(pool.prepare('grader-course'))
+
+    assert system.commands[-1] == ['userdel', '--remove', 'grader-course']
+    assert 'grader-course' not in system.users
+
+
+def test_existing_account_is_not_prepared_or_removed(system, tmp_path):
+    pool = GraderPool(provisioner=system, size=2, home_dir=str(tmp_path))
+    system.users.add('grader-course')
+
+    assert not asyncio.run(pool.prepare('grader-course'))
+
+    assert system.commands == []
+    assert 'grader-course' in system.users
@@ -0,0 +1,177 @@
+import json
+import threading
+
+import pytest
+from flask import Flask
+
+from misc.jobs import JobQueue, preferred_wait
+
+
+@pytest.fixture
+def app():
+    app = Flask(__name__)
+    app.config['PREFIX'] = '/services/kore/'
+    return app
+
+
+def call(app, queue, operation, prefer=None):
+    headers = {'Prefer': prefer} if prefer else {}
+    with app.test_request_context('/courses', method='PUT', headers=headers):
+        response = queue.run(kind='test', username='teacher', operation=operation)
+    return response.status_code, json.loads(response.get_data()), response.headers
+
+
+def test_preferred_wait():
+    assert preferred_wait('', 20) == 20
+    assert preferred_wait('respond-async', 20) == 0
+    assert preferred_wait('respond-async, wait=10', 20) == 0
+    assert preferred_wait('wait=5', 20) == 5
+    assert preferred_wait('wait=100', 20) == 20
+    assert preferred_wait('wait=abc', 20) == 20
+
+
+def test_fast_job_returns_result(app, registry):
+    queue = JobQueue(registry=registry, wait=5)
+
+    def operation(job):
+        with job.step('copy'):
+            pass
+        return 200, {'message': 'done'}
+
+    status, body, _ = call(app, queue, operation)
+
+    assert (status, body) == (200, {'message': 'done'})
+
+
+def test_slow_job_continues_in_background(app, registry):
+    queue = JobQueue(registry=registry, wait=0.1)
+    release = threading.Event()
+
+    def operation(job):
+        with job.step('backup'):
+            release.wait(5)
+        return 200, {'message': 'done'}
+
+    status, body, headers = call(app, queue, operation)
+
+    assert status == 202
+    assert headers['Location'] == f'/services/kore/jobs/{body["job"]}'
+    assert 'Preference-Applied' not in headers
+    job = registry.get_job(body['job'])
+    assert job['state'] == 'running'
+    assert job['steps'] == [{'name': 'backup', 'duration': None}]
+
+    release.set()
+    queue.executor.shutdown(wait=True)
+
+    job = registry.get_job(body['job'])
+    assert (job['state'], job['status'], job['result']) == ('finished', 200, {'message': 'done'})
+    assert job['steps'][0]['duration'] is not None
+
+
+def test_respond_async(app, registry):
+    queue = JobQueue(registry=registry, wait=5)
+
+    status, body, headers = call(app, queue, lambda job: (200, {}), prefer='respond-async')
+
+    assert status == 202
+    assert headers['Preference-Applied'] == 'respond-async'
+
+
+def test_failing_jobs(app, registry):
+    queue = JobQueue(registry=registry, wait=5)
+
+    def crash(job):
+        raise RuntimeError('boom')
+
+    status, body, _ = call(app, queue, crash)
+    assert (status, body) == (500, {'message': 'JobError'})
+
+    status, body, _ = call(app, queue, lambda job: (404, {'message': 'CourseNotFoundError'}))
+    assert status == 404
+
+    assert [registry.get_job(job_id)['state'] for job_id in job_ids(registry)] == ['failed', 'failed']
+
+
+def test_recover_jobs(registry):
+    registry.add_job(job_id='running', kind='test', username='teacher')
+    registry.update_job('running', state='running')
+    registry.add_job(job_id='finished', kind='test', username='teacher')
+    registry.update_job('finished', state='finished', status=200, result={'message': 'done'})
+
+    registry.recover_jobs(max_age=3600)
+
+    assert registry.get_job('running')['state'] == 'failed'
+    assert registry.get_job('running')['result'] == {'message': 'JobInterruptedError'}
+    assert registry.get_job('finished')['state'] == 'finished'
+
+    registry.recover_jobs(max_age=-1)
+    assert registry.get_job('finished') is None
+
+
+class Hub:
+    """
+    Hub's user identification (HubOAuth) and admin states (HubClient) with fixed API tokens per user.
+    """
+
+    users = {'teacher-token': 'teacher', 'other-token': 'other', 'admin-token': 'admin'}
+
+    def user_for_token(self, token):
+        return {'name': self.users[token]} if token in self.users else None
+
+    def is_admin(self, username):
+        return username == 'admin'
+
+
+@pytest.fixture
+def jobs_app(app, registry):
+    from routes import jobs_route
+
+    app.config.update(REGISTRY=registry, HUB_AUTH=Hub(), HUB_CLIENT=Hub(), SECRET_KEY='test')
+    app.register_blueprint(jobs_route.jobs_bp)
+    registry.add_job(job_id='running', kind='test', username='teacher')
+    registry.update_job('running', state='running')
+    return app
+
+
+def get_job(app, job_id, token=None, **headers):
+    if token:
+        headers['Authorization'] = f'token {token}'
+    response = app.test_client().get(f'/jobs/{job_id}', headers=headers)
+    return response.status_code, response.get_data(as_text=True)
+
+
+def test_progress_stream_ends(jobs_app, monkeypatch):
+    from routes import jobs_route
+
+    monkeypatch.setattr(jobs_route, 'stream_interval', 0.01)
+    monkeypatch.setattr(jobs_route, 'stream_max_duration', 0.1)
+
+    # A job running longer than the stream's time limit.
+    status, body = get_job(jobs_app, 'running', token='teacher-token', Accept='text/event-stream')
+    events = [json.loads(line.removeprefix('data: ')) for line in body.split('\n\n') if line]
+    assert [event['state'] for event in events] == ['running']
+
+    status, body = get_job(jobs_app, 'running', token='teacher-token')
+    assert json.loads(body)['state'] == 'running'
+    assert get_job(jobs_app, 'unknown', token='teacher-token')[0] == 404
+
+
+def test_job_access(jobs_app):
+    assert get_job(jobs_app, 'running')[0] == 401
+    assert get_job(jobs_app, 'running', token='invalid')[0] == 401
+    assert get_job(jobs_app, 'running', token='other-token') == (403, json.dumps({'message': 'JobAccessError'}))
+    assert get_job(jobs_app, 'running', token='other-token', Accept='text/event-stream')[0] == 403
+    assert get_job(jobs_app, 'running', token='teacher-token')[0] == 200
+    assert get_job(jobs_app, 'running', token='admin-token')[0] == 200
+
+    # Browsers are identified by Kore's session.
+    client = jobs_app.test_client()
+    with client.session_transaction() as session:
+        session['token'] = 'teacher-token'
+    assert client.get('/jobs/running').status_code == 200
+
+
+def job_ids(registry):
+    with registry._connect() as db:
+        return [row['id'] for row in db.execute('SELECT id FROM jobs')]
@@ -0,0 +1,271 @@
+import email.utils
+import json
+import os
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import jwt
+import pytest
+import requests
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+from misc import lms_client
+from misc.lms_client import ScoreSender, get_access_token, invalidate_access_token
+from misc.lti_keys import LTIKeys
+from routes.grades_route import grades_response
+
+
+class LMS(ThreadingHTTPServer):
+    """
+    Local HTTP server playing the LMS. Answers POST requests with queued (status, headers, body) tuples (200 if the
+    queue is empty) and records the requests.
+    """
+
+    def __init__(self) -> None:
+        super().__init__(('127.0.0.1', 0), LMSHandler)
+        self.responses: dict[str, list] = {}
+        self.requests: list[tuple] = []
+        self.lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+
+class LMSHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, *args) -> None:
+        pass
+
+    def do_POST(self) -> None:
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        with self.server.lock:
+            self.server.requests.append((self.path, dict(self.headers), body))
+            queue = self.server.responses.get(self.path, [])
+            status, headers, content = queue.pop(0) if queue else (200, {}, {})
+        data = json.dumps(content).encode()
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+@pytest.fixture
+def lms():
+    server = LMS()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(autouse=True)
+def fast_backoff(monkeypatch):
+    monkeypatch.setattr(lms_client, 'backoff_factor', 0.01)
+
+
+def score(user_id: str) -> dict:
+    return {'userId': user_id, 'scoreGiven': 1.0, 'scoreMaximum': 2.0, 'activityProgress': 'Completed',
+            'gradingProgress': 'FullyGraded', 'timestamp': '2026-01-01T00:00:00+00:00'}
+
+
+def test_send_all(lms):
+    sender = ScoreSender(f'{lms.url}/scores', 'token', concurrency=4)
+    sent, reports = sender.send_all([score(f'user-{i}') for i in range(10)])
+
+    assert sent == 10
+    assert [report['id'] for report in reports] == [f'user-{i}' for i in range(10)]
+    assert len(lms.requests) == 10
+    path, headers, body = lms.requests[0]
+    assert path == '/scores'
+    assert headers['Authorization'] == 'Bearer token'
+    assert headers['Content-Type'] == 'application/vnd.ims.lis.v1.score+json'
+    assert json.loads(body)['scoreMaximum'] == 2.0
+
+
+def test_transient_errors_are_retried(lms):
+    lms.responses['/scores'] = [(503, {}, {}), (429, {}, {})]
+    sender = ScoreSender(f'{lms.url}/scores', 'token', concurrency=1, retries=3)
+
+    assert sender.send(score('user')) == {'id': 'user', 'ok': True}
+    assert len(lms.requests) == 3
+
+
+def test_retries_are_limited(lms):
+    lms.responses['/scores'] = [(503, {}, {})] * 10
+    sender = ScoreSender(f'{lms.url}/scores', 'token', concurrency=1, retries=2)
+
+    assert sender.send(score('user')) == {'id': 'user', 'ok': False, 'error': 'status 503'}
+    assert len(lms.requests) == 3
+
+
+def test_client_errors_are_not_retried(lms):
+    lms.responses['/scores'] = [(400, {}, {})]
+    sender = ScoreSender(f'{lms.url}/scores', 'token', concurrency=1, retries=3)
+
+    assert sender.send(score('user')) == {'id': 'user', 'ok': False, 'error': 'status 400'}
+    assert len(lms.requests) == 1
+
+
+def test_connection_errors_are_retried(lms):
+    url = lms.url
+    lms.shutdown()
+    lms.server_close()
+    sender = ScoreSender(f'{url}/scores', 'token', concurrency=1, retries=1)
+
+    report = sender.send(score('user'))
+    assert not report['ok']
+    assert report['error']
+
+
+def test_retry_after_pauses_all_threads(lms):
+    lms.responses['/scores'] = [(429, {'Retry-After': '0.5'}, {})]
+    sender = ScoreSender(f'{lms.url}/scores', 'token', concurrency=4)
+
+    start = time.monotonic()
+    sent, _ = sender.send_all([score(f'user-{i}') for i in range(8)])
+    assert sent == 8
+    assert time.monotonic() - start >= 0.5
+
+    # Requests after the 429 response wait for the break to end.
+    assert len(lms.requests) == 9
+
+
+def test_retry_after_header():
+    def retry_after(value: str):
+        response = requests.Response()
+        if value is not None:
+            response.headers['Retry-After'] = value
+        return lms_client._retry_after(response)
+
+    assert retry_after(None) is None
+    assert retry_after('7') == 7
+    assert retry_after('-3') == 0
+    assert retry_after('86400') == lms_client.max_retry_after
+    assert retry_after('soon') is None
+    assert 25 <= retry_after(email.utils.formatdate(time.time() + 30, usegmt=True)) <= 30
+    assert retry_after(email.utils.formatdate(time.time() - 30, usegmt=True)) == 0
+
+
+def test_grades_response():
+    ok = {'id': 'a', 'ok': True}
+    failed = {'id': 'b', 'ok': False, 'error': 'status 400'}
+
+    assert grades_response(sent=2, report=[ok, ok])[0] == 200
+    assert grades_response(sent=0, report=[failed, failed]) == (500, {'message': 'SendGradesError', 'students': [failed, failed]})
+    status, content = grades_response(sent=1, report=[ok, failed])
+    assert status == 207
+    assert content['message'] == 'Grades send for 1 of 2 students.'
+
+
+@pytest.fixture
+def keys(tmp_path, monkeypatch):
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    (tmp_path / 'lti_key').write_bytes(private_key.private_bytes(encoding=serialization.Encoding.PEM, format=serialization.PrivateFormat.PKCS8,
+                                                                 encryption_algorithm=serialization.NoEncryption()))
+    jwk = json.loads(jwt.algorithms.RSAAlgorithm.to_jwk(private_key.public_key()))
+    jwk.update({'kid': 'test-kid', 'alg': 'RS256', 'use': 'sig'})
+    (tmp_path / 'lti_key.json').write_text(json.dumps(jwk))
+
+    keys = LTIKeys(key_dir=str(tmp_path))
+    monkeypatch.setattr(lms_client, 'lti_keys', keys)
+    monkeypatch.setattr(lms_client, '_access_tokens', {})
+    return private_key.public_key()
+
+
+def token(lms, registry, scope: str = 'score lineitem') -> str:
+    return get_access_token(registry=registry, access_token_url=f'{lms.url}/token', issuer='https://lms', client_id='client', scope=scope)
+
+
+def token_response(access_token: str, expires_in: int = 3600) -> tuple:
+    return 200, {}, {'access_token': access_token, 'token_type': 'Bearer', 'expires_in': expires_in}
+
+
+def test_access_token_request(lms, registry, keys):
+    lms.responses['/token'] = [token_response('first')]
+
+    assert token(lms, registry) == 'first'
+    assert len(lms.requests) == 1
+
+    data = urllib.parse.parse_qs(lms.requests[0][2].decode())
+    assert data['grant_type'] == ['client_credentials']
+    assert data['scope'] == ['score lineitem']
+    assertion = data['client_assertion'][0]
+    assert jwt.get_unverified_header(assertion)['kid'] == 'test-kid'
+    claims = jwt.decode(assertion, keys, algorithms=['RS256'], audience='https://lms')
+    assert claims['iss'] == claims['sub'] == 'client'
+
+
+def test_access_token_cache(lms, registry, keys, monkeypatch):
+    lms.responses['/token'] = [token_response('first'), token_response('second')]
+
+    assert token(lms, registry) == 'first'
+    assert token(lms, registry) == 'first'
+    # Scopes in other order share the token.
+    assert token(lms, registry, scope='lineitem score') == 'first'
+    assert len(lms.requests) == 1
+
+    # Another worker process finds the token in the registry.
+    monkeypatch.setattr(lms_client, '_access_tokens', {})
+    assert token(lms, registry) == 'first'
+    assert len(lms.requests) == 1
+
+    # Other scopes need another token.
+    assert token(lms, registry, scope='score') == 'second'
+    assert len(lms.requests) == 2
+
+
+def test_access_token_expiry(lms, registry, keys):
+    # Tokens are renewed shortly before they expire, so a token valid for less than the margin is not reused.
+    lms.responses['/token'] = [token_response('first', expires_in=lms_client.access_token_margin - 10), token_response('second')]
+
+    assert token(lms, registry) == 'first'
+    assert token(lms, registry) == 'second'
+    assert token(lms, registry) == 'second'
+    assert len(lms.requests) == 2
+
+
+def test_access_token_invalidation(lms, registry, keys, monkeypatch):
+    lms.responses['/token'] = [token_response('first'), token_response('second')]
+
+    assert token(lms, registry) == 'first'
+    invalidate_access_token(registry=registry, access_token_url=f'{lms.url}/token', client_id='client', scope='score lineitem')
+    assert token(lms, registry) == 'second'
+
+    # Both caches hold the new token.
+    monkeypatch.setattr(lms_client, '_access_tokens', {})
+    assert token(lms, registry) == 'second'
+    assert len(lms.requests) == 2
+
+
+def test_access_token_error(lms, registry, keys):
+    lms.responses['/token'] = [(401, {}, {'error': 'invalid_client'}), token_response('first')]
+
+    with pytest.raises(requests.exceptions.HTTPError):
+        token(lms, registry)
+    assert token(lms, registry) == 'first'
+
+
+def test_jwks_reload(keys, tmp_path):
+    jwks, etag = lms_client.lti_keys.jwks()
+    assert json.loads(jwks)['keys'][0]['kid'] == 'test-kid'
+    assert lms_client.lti_keys.jwks() == (jwks, etag)
+
+    # Rotated key files are loaded without restart.
+    jwk = json.loads((tmp_path / 'lti_key.json').read_text())
+    jwk['kid'] = 'rotated-kid'
+    (tmp_path / 'lti_key.json').write_text(json.dumps(jwk))
+    stat = os.stat(tmp_path / 'lti_key.json')
+    os.utime(tmp_path / 'lti_key.json', ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+
+    rotated, rotated_etag = lms_client.lti_keys.jwks()
+    assert json.loads(rotated)['keys'][0]['kid'] == 'rotated-kid'
+    assert rotated_etag != etag
+    assert lms_client.lti_keys.signing_key()[1] == 'rotated-kid'
@@ -0,0 +1,24 @@
+import json
+
+
+def course_info(course_id: str, title: str) -> dict:
+    return {'id': course_id, 'title': title, 'title_short': title, 'grader_user': f'grader-{course_id}', 'target_link_uri': '',
+            'aud': 'client', 'lineitem': ''}
+
+
+def test_course_titles_after_container_replacement(registry, tmp_path):
+    nbgrader_config = tmp_path / 'nbgrader_config.py'
+    image_config = 'c = get_config()\n\nc.NbGrader.course_titles = {}\n'
+    nbgrader_config.write_text(image_config)
+
+    assert registry.add_course(course_info('c1', 'Course 1'))
+    assert "c.NbGrader.course_titles = {'c1': 'Course 1'}" in nbgrader_config.read_text()
+
+    # New container: image's config, logins without changes do not write the registry.
+    nbgrader_config.write_text(image_config)
+    assert not registry.add_course(course_info('c1', 'Course 1'))
+    assert "c.NbGrader.course_titles = {}" in nbgrader_config.read_text()
+
+    registry.export()
+    assert "c.NbGrader.course_titles = {'c1': 'Course 1'}" in nbgrader_config.read_text()
+    assert [service['name'] for service in json.loads((tmp_path / 'autogenerated_services.json').read_text())['services']] == ['c1']